@@ -0,0 +1,10 @@
+from django.contrib import admin
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "task", "status", "attempts", "run_after", "updated_at")
+    list_filter = ("status", "task")
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.queue import work
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty"
+        )
+        parser.add_argument(
+            "--sleep", type=float, default=1.0, help="Seconds to wait when idle"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            done = work()
+            if done:
+                self.stdout.write(f"Ran {done} jobs")
+            if options["once"]:
+                break
+            if not done:
+                time.sleep(options["sleep"])
@@ -0,0 +1,106 @@
+import datetime
+import logging
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class UnknownTask(KeyError):
+    pass
+
+
+def task(name, on_failure=None):
+    """
+    Registers a function as a job handler under name. on_failure is called
+    with the same kwargs once the job has used up all of its attempts.
+    """
+
+    def decorator(func):
+        _registry[name] = (func, on_failure)
+        return func
+
+    return decorator
+
+
+def enqueue(name, /, **kwargs):
+    if name not in _registry:
+        raise UnknownTask(name)
+    return Job.objects.create(
+        task=name,
+        kwargs=kwargs,
+        max_attempts=getattr(settings, "JOBS_MAX_ATTEMPTS", 5),
+    )
+
+
+def retry_delay(attempts):
+    base = getattr(settings, "JOBS_RETRY_DELAY", 10)
+    return datetime.timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def claim():
+    """
+    Marks the next runnable job as running and returns it, or None.
+    Jobs left running past the lease by a dead worker are picked up again.
+    """
+    now = timezone.now()
+    lease = datetime.timedelta(seconds=getattr(settings, "JOBS_LEASE", 300))
+    ready = Job.objects.filter(
+        Q(status=Job.PENDING, run_after__lte=now)
+        | Q(status=Job.RUNNING, updated_at__lt=now - lease)
+    ).order_by("run_after", "id")
+    for job_id, status in ready.values_list("id", "status")[:10]:
+        # Only one worker wins the conditional update for a given job
+        claimed = Job.objects.filter(pk=job_id, status=status).update(
+            status=Job.RUNNING, updated_at=now
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def run(job):
+    func, on_failure = _registry.get(job.task, (None, None))
+    job.attempts += 1
+    try:
+        if func is None:
+            raise UnknownTask(job.task)
+        with transaction.atomic():
+            func(**job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            logger.error("Job %s failed permanently:\n%s", job.pk, job.last_error)
+            if on_failure is not None:
+                on_failure(**job.kwargs)
+        else:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+            logger.warning("Job %s failed, retrying at %s", job.pk, job.run_after)
+    else:
+        job.status = Job.DONE
+        job.last_error = ""
+    job.save()
+    return job
+
+
+def work(limit=None):
+    """Runs ready jobs until none are left (or limit is reached)."""
+    done = 0
+    while limit is None or done < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        done += 1
+    return done
@@ -0,0 +1,88 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import UnknownTask, claim, enqueue, run, task, work
+
+
+calls = []
+
+
+@task("jobs.tests.record")
+def record(value):
+    calls.append(value)
+
+
+def record_failure(value):
+    calls.append(f"gave up on {value}")
+
+
+@task("jobs.tests.explode", on_failure=record_failure)
+def explode(value):
+    raise RuntimeError(value)
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_work_runs_pending_jobs_in_order(self):
+        enqueue("jobs.tests.record", value=1)
+        enqueue("jobs.tests.record", value=2)
+        self.assertEqual(work(), 2)
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+        self.assertEqual(work(), 0)
+
+    def test_enqueue_unknown_task(self):
+        with self.assertRaises(UnknownTask):
+            enqueue("jobs.tests.missing")
+
+    @override_settings(JOBS_MAX_ATTEMPTS=2, JOBS_RETRY_DELAY=60)
+    def test_failures_are_retried_with_backoff(self):
+        job = enqueue("jobs.tests.explode", value="boom")
+        with self.assertLogs("jobs.queue", "WARNING"):
+            self.assertEqual(work(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("RuntimeError: boom", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        # Not due yet, so the worker leaves it alone
+        self.assertEqual(work(), 0)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs("jobs.queue", "ERROR"):
+            self.assertEqual(work(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(calls, ["gave up on boom"])
+
+    def test_claim_is_exclusive(self):
+        enqueue("jobs.tests.record", value=1)
+        job = claim()
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertIsNone(claim())
+        run(job)
+        self.assertEqual(calls, [1])
+
+    def test_stale_running_jobs_are_reclaimed(self):
+        job = enqueue("jobs.tests.record", value=1)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING,
+            updated_at=timezone.now() - datetime.timedelta(hours=1),
+        )
+        self.assertEqual(work(), 1)
+        self.assertEqual(calls, [1])
+
+    def test_run_worker_once(self):
+        enqueue("jobs.tests.record", value=1)
+        out = StringIO()
+        call_command("run_worker", "--once", stdout=out)
+        self.assertEqual(calls, [1])
+        self.assertIn("Ran 1 jobs", out.getvalue())
@@ -0,0 +1,10 @@
+from django.contrib import admin
+from .models import Blob
+
+
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ("name", "size", "refs", "updated_at")
+    search_fields = ("name",)
+
+
+admin.site.register(Blob, BlobAdmin)
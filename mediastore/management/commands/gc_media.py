@@ -0,0 +1,62 @@
+import datetime
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mediastore.models import Blob
+from mediastore.storage import cas_prefix
+
+
+class Command(BaseCommand):
+    help = "Deletes content-addressed media that nothing references any more"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace",
+            type=int,
+            default=getattr(settings, "MEDIASTORE_GC_GRACE", 60 * 60),
+            help="Seconds an unreferenced file is kept before it is deleted",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(seconds=options["grace"])
+        dry_run = options["dry_run"]
+        deleted = 0
+
+        orphans = Blob.objects.filter(refs__lte=0, updated_at__lt=cutoff)
+        for pk, name in orphans.values_list("pk", "name").iterator():
+            if dry_run:
+                self.stdout.write(name)
+            # A blob re-acquired meanwhile is left alone, file included
+            elif not default_storage.collect(name):
+                continue
+            deleted += 1
+
+        # Files written by a save whose transaction rolled back have no Blob
+        known = set(Blob.objects.values_list("name", flat=True))
+        for name in self.walk(cas_prefix()):
+            if name in known:
+                continue
+            modified = default_storage.get_modified_time(name)
+            if modified >= cutoff:
+                continue
+            if dry_run:
+                self.stdout.write(name)
+            else:
+                default_storage.purge(name)
+            deleted += 1
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {deleted} files"))
+
+    def walk(self, path):
+        if not default_storage.exists(path):
+            return
+        directories, files = default_storage.listdir(path)
+        for name in files:
+            yield f"{path}/{name}"
+        for directory in directories:
+            yield from self.walk(f"{path}/{directory}")
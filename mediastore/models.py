@@ -0,0 +1,22 @@
+from django.db import models
+
+
+class Blob(models.Model):
+    """
+    One stored file of ContentAddressedStorage. refs counts the rows that
+    point at it; blobs at zero are removed by the gc_media command.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refs = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["refs", "updated_at"], name="blob_orphan_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,102 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Blob
+
+
+def cas_prefix():
+    return getattr(settings, "MEDIASTORE_PREFIX", "cas")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores uploads under the SHA-256 of their content, sharded as
+    <prefix>/ab/cd/abcd....ext, so identical files are written once.
+
+    Each save() takes a reference on the Blob and each delete() gives one
+    back; the file itself stays until gc_media collects unreferenced blobs,
+    so a concurrent upload of the same content never loses its file.
+    Names outside the prefix (uploads from before this storage) are
+    handled like FileSystemStorage.
+    """
+
+    def is_content_addressed(self, name):
+        return name.startswith(f"{cas_prefix()}/")
+
+    def digest(self, content):
+        sha = hashlib.sha256()
+        if hasattr(content, "seek"):
+            content.seek(0)
+        for chunk in content.chunks():
+            sha.update(chunk)
+        if hasattr(content, "seek"):
+            content.seek(0)
+        return sha.hexdigest()
+
+    def content_name(self, name, content):
+        digest = self.digest(content)
+        ext = os.path.splitext(name)[1].lower()
+        return f"{cas_prefix()}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        # The reference comes before the check for the file: from then on
+        # collect() leaves the file in place, or puts it back
+        self.acquire(name, content.size)
+        if not self.exists(name):
+            written = super()._save(name, content)
+            if written != name:
+                # A concurrent writer got there first with the same bytes
+                super().delete(written)
+        return name
+
+    def acquire(self, name, size=0):
+        blob, created = Blob.objects.get_or_create(
+            name=name, defaults={"size": size, "refs": 1}
+        )
+        if not created:
+            Blob.objects.filter(pk=blob.pk).update(
+                refs=F("refs") + 1, updated_at=timezone.now()
+            )
+
+    def release(self, name):
+        Blob.objects.filter(name=name, refs__gt=0).update(
+            refs=F("refs") - 1, updated_at=timezone.now()
+        )
+
+    def delete(self, name):
+        if self.is_content_addressed(name):
+            self.release(name)
+        else:
+            super().delete(name)
+
+    def purge(self, name):
+        """Removes the file itself; only gc_media should call this."""
+        super().delete(name)
+
+    def collect(self, name):
+        """
+        Deletes an unreferenced blob and its file, returning whether it did;
+        only gc_media should call this. The file is moved aside before the
+        row is deleted and put back if an upload of the same content took
+        a reference in between.
+        """
+        path = self.path(name)
+        aside = f"{path}.gc"
+        try:
+            os.replace(path, aside)
+        except FileNotFoundError:
+            aside = None
+        collected = bool(Blob.objects.filter(name=name, refs__lte=0).delete()[0])
+        if aside is not None:
+            if collected:
+                os.remove(aside)
+            else:
+                # Same content as anything written there meanwhile
+                os.replace(aside, path)
+        return collected
@@ -0,0 +1,220 @@
+import datetime
+import os
+from io import StringIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.images import ImageFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Blob
+from .views import IMMUTABLE_CACHE_CONTROL, parse_range
+from tweets.models import Tweet
+from user.models import CustomUser
+
+
+class ContentAddressedStorageTests(TestCase):
+    def test_identical_content_is_stored_once(self):
+        first = default_storage.save("a/one.txt", ContentFile(b"same bytes"))
+        second = default_storage.save("b/two.txt", ContentFile(b"same bytes"))
+        other = default_storage.save("a/one.txt", ContentFile(b"other bytes"))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r"^cas/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.txt$")
+        self.assertEqual(Blob.objects.get(name=first).refs, 2)
+        self.assertEqual(Blob.objects.get(name=first).size, len(b"same bytes"))
+
+    def test_delete_releases_a_reference(self):
+        name = default_storage.save("one.txt", ContentFile(b"shared"))
+        default_storage.save("two.txt", ContentFile(b"shared"))
+        default_storage.delete(name)
+        self.assertEqual(Blob.objects.get(name=name).refs, 1)
+        default_storage.delete(name)
+        self.assertEqual(Blob.objects.get(name=name).refs, 0)
+        # The file outlives its last reference until gc_media runs
+        self.assertTrue(default_storage.exists(name))
+
+    def test_gc_deletes_unreferenced_files_after_grace(self):
+        kept = default_storage.save("kept.txt", ContentFile(b"kept"))
+        orphan = default_storage.save("orphan.txt", ContentFile(b"orphan"))
+        default_storage.delete(orphan)
+
+        call_command("gc_media", stdout=StringIO())
+        self.assertTrue(default_storage.exists(orphan))
+
+        Blob.objects.filter(name=orphan).update(
+            updated_at=timezone.now() - datetime.timedelta(days=1)
+        )
+        out = StringIO()
+        call_command("gc_media", "--dry-run", stdout=out)
+        self.assertIn(orphan, out.getvalue())
+        self.assertTrue(default_storage.exists(orphan))
+
+        call_command("gc_media", stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertFalse(Blob.objects.filter(name=orphan).exists())
+        self.assertTrue(default_storage.exists(kept))
+        default_storage.delete(kept)
+
+    def test_upload_racing_gc_keeps_its_file(self):
+        orphan = default_storage.save("orphan.txt", ContentFile(b"orphan"))
+        default_storage.delete(orphan)
+        Blob.objects.filter(name=orphan).update(
+            updated_at=timezone.now() - datetime.timedelta(days=1)
+        )
+        replace = os.replace
+
+        def upload_meanwhile(src, dst):
+            # The same content is uploaded once gc has started on the file
+            replace(src, dst)
+            if dst.endswith(".gc"):
+                default_storage.save("again.txt", ContentFile(b"orphan"))
+
+        with mock.patch("mediastore.storage.os.replace", upload_meanwhile):
+            call_command("gc_media", stdout=StringIO())
+        self.assertTrue(default_storage.exists(orphan))
+        self.assertEqual(Blob.objects.get(name=orphan).refs, 1)
+        self.assertFalse(os.path.exists(default_storage.path(orphan) + ".gc"))
+        default_storage.delete(orphan)
+
+        # Uploaded after gc deleted the row: the upload writes the file again
+        remove = os.remove
+
+        def upload_before_remove(path):
+            default_storage.save("again.txt", ContentFile(b"orphan"))
+            remove(path)
+
+        Blob.objects.filter(name=orphan).update(
+            updated_at=timezone.now() - datetime.timedelta(days=1)
+        )
+        with mock.patch("mediastore.storage.os.remove", upload_before_remove):
+            call_command("gc_media", stdout=StringIO())
+        self.assertTrue(default_storage.exists(orphan))
+        self.assertEqual(Blob.objects.get(name=orphan).refs, 1)
+        default_storage.delete(orphan)
+
+    def test_gc_deletes_files_without_a_blob(self):
+        name = default_storage.save("stray.txt", ContentFile(b"stray"))
+        Blob.objects.filter(name=name).delete()
+        past = (timezone.now() - datetime.timedelta(days=1)).timestamp()
+        os.utime(default_storage.path(name), (past, past))
+        call_command("gc_media", stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_deleting_a_tweet_releases_its_image(self):
+        user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        path = "./media/test/test_img.jpg"
+        first = Tweet.objects.create(
+            user=user, body="first", image=ImageFile(open(path, "rb"), "a.jpg")
+        )
+        second = Tweet.objects.create(
+            user=user, body="second", image=ImageFile(open(path, "rb"), "b.jpg")
+        )
+        self.assertEqual(first.image.name, second.image.name)
+        # Released only once the delete commits
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+            self.assertEqual(Blob.objects.get(name=second.image.name).refs, 2)
+        self.assertEqual(Blob.objects.get(name=second.image.name).refs, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(Blob.objects.get(name=second.image.name).refs, 0)
+
+    def test_rolled_back_replacement_keeps_the_image(self):
+        user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        path = "./media/test/test_img.jpg"
+        tweet = Tweet.objects.create(
+            user=user, body="tweet", image=ImageFile(open(path, "rb"), "a.jpg")
+        )
+        name = tweet.image.name
+        tweet.image = default_storage.save("b.txt", ContentFile(b"other bytes"))
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                tweet.save()
+                self.assertEqual(Blob.objects.get(name=name).refs, 1)
+                raise RuntimeError
+        self.assertEqual(Blob.objects.get(name=name).refs, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            tweet.save()
+        self.assertEqual(Blob.objects.get(name=name).refs, 0)
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.name = default_storage.save("served.txt", ContentFile(b"0123456789"))
+        self.url = reverse("media", kwargs={"path": self.name})
+
+    def tearDown(self):
+        default_storage.delete(self.name)
+
+    def test_serves_file_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        self.assertEqual(response["Cache-Control"], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_request(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(response["Content-Length"], "4")
+        self.assertEqual(b"".join(response.streaming_content), b"2345")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-3")
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=20-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_suffix_range_of_an_empty_file_is_unsatisfiable(self):
+        self.assertEqual(parse_range("bytes=-3", 10), (7, 9))
+        with self.assertRaises(ValueError):
+            parse_range("bytes=-5", 0)
+
+        name = default_storage.save("empty.txt", ContentFile(b""))
+        self.addCleanup(default_storage.delete, name)
+        response = self.client.get(
+            reverse("media", kwargs={"path": name}), HTTP_RANGE="bytes=-5"
+        )
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */0")
+
+    def test_stale_if_range_sends_whole_file(self):
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+
+    @override_settings(MEDIA_SERVE_MODE="x-accel-redirect")
+    def test_x_accel_redirect_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.name}")
+        self.assertEqual(response.content, b"")
+
+    @override_settings(MEDIA_SERVE_MODE="x-sendfile")
+    def test_x_sendfile_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Sendfile"], default_storage.path(self.name))
+
+    def test_missing_and_outside_files_are_404(self):
+        self.assertEqual(self.client.get("/media/cas/missing.txt").status_code, 404)
+        self.assertEqual(self.client.get("/media/../manage.py").status_code, 404)
+        self.assertEqual(self.client.get("/media/cas").status_code, 404)
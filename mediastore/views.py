@@ -0,0 +1,156 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from .storage import cas_prefix
+
+
+# A content-addressed name never points at different bytes, so it can be
+# cached for as long as browsers and proxies allow
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=86400"
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def serve_mode():
+    """
+    "django" streams the file from the worker (zero-copy through
+    wsgi.file_wrapper where the server supports it); "x-sendfile" and
+    "x-accel-redirect" only send headers and let Apache/lighttpd or nginx
+    transfer the file.
+    """
+    return getattr(settings, "MEDIA_SERVE_MODE", "django")
+
+
+def cache_control(path):
+    if path.startswith(f"{cas_prefix()}/"):
+        return IMMUTABLE_CACHE_CONTROL
+    return DEFAULT_CACHE_CONTROL
+
+
+def parse_range(header, size):
+    """
+    Returns (start, end) inclusive for a single "bytes=" range, None when
+    the header should be ignored, or raises ValueError if unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    # Multiple ranges are rare for media; answering 200 is always allowed
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        # An empty file has no last bytes to send
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class RangeFile:
+    """File wrapper that stops reading after length bytes."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serves a file from MEDIA_ROOT with validators, strong Cache-Control and
+    single byte-range support, or hands it to the web server (MEDIA_SERVE_MODE).
+    """
+    path = posixpath.normpath(path).lstrip("/")
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    last_modified = int(stat.st_mtime)
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or "application/octet-stream"
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = file_response(
+            request, fullpath, path, stat.st_size, etag, content_type
+        )
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = cache_control(path)
+    return response
+
+
+def file_response(request, fullpath, path, size, etag, content_type):
+    mode = serve_mode()
+    if mode == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = fullpath
+        return response
+    if mode == "x-accel-redirect":
+        prefix = getattr(settings, "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = prefix + path
+        return response
+
+    byte_range = None
+    header = request.headers.get("Range")
+    # A stale If-Range means the client's partial copy is useless: send it all
+    if header and request.headers.get("If-Range", etag) == etag:
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(fullpath, "rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        file = RangeFile(open(fullpath, "rb"), start, length)
+        response = FileResponse(file, content_type=content_type)
+        response.status_code = 206
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = length
+    response["Accept-Ranges"] = "bytes"
+    return response
@@ -0,0 +1,35 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .db import SQLITE_PRAGMAS, apply_pragmas
+
+
+def check_connections(**kwargs):
+    """
+    Drops persistent connections that died while idle (database restart,
+    pooler or firewall timeout) before the request gets to use them.
+    """
+    for connection in connections.all():
+        if not connection.settings_dict.get("CONN_HEALTH_CHECKS"):
+            continue
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    pragmas = {**SQLITE_PRAGMAS, **getattr(settings, "SQLITE_PRAGMAS", {})}
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, pragmas)
+
+
+class MytwitterConfig(AppConfig):
+    name = "mytwitter"
+
+    def ready(self):
+        request_started.connect(check_connections)
+        connection_created.connect(configure_sqlite)
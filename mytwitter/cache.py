@@ -0,0 +1,150 @@
+import threading
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl, urlsplit
+
+from django.core.cache import caches
+from django.core.cache.backends import filebased, locmem, redis
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+
+
+def cache_config(url, default_location):
+    """
+    A CACHES entry for url: redis://, rediss:// and unix:// for a Redis
+    server, file:///path for a cache shared through one machine's disk, or
+    locmem:// for a single process. Query parameters such as
+    ?timeout=300&max_entries=10000 become TIMEOUT and OPTIONS. Without a url,
+    a file cache in default_location.
+    """
+    if not url:
+        return {
+            "BACKEND": "mytwitter.cache.FileBasedCache",
+            "LOCATION": default_location,
+        }
+    parts = urlsplit(url)
+    params = {
+        key: int(value) if value.isdigit() else value
+        for key, value in parse_qsl(parts.query)
+    }
+    config = {}
+    if "timeout" in params:
+        config["TIMEOUT"] = params.pop("timeout")
+    if parts.scheme in ("redis", "rediss", "unix"):
+        config["BACKEND"] = "mytwitter.cache.RedisCache"
+        config["LOCATION"] = parts._replace(query="").geturl()
+        # Everything else is for the Redis connection pool
+        config["OPTIONS"] = params
+        return config
+    if parts.scheme == "file":
+        config["BACKEND"] = "mytwitter.cache.FileBasedCache"
+        config["LOCATION"] = parts.path
+    elif parts.scheme == "locmem":
+        config["BACKEND"] = "mytwitter.cache.LocMemCache"
+        config["LOCATION"] = parts.netloc
+    else:
+        raise ImproperlyConfigured(f"Unsupported CACHE_URL scheme: {parts.scheme}")
+    config["OPTIONS"] = params
+    return config
+
+
+# Counters per cache location, shared by the per-thread backend instances
+_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+_missing = object()
+
+
+class StatsMixin:
+    """Counts hits, misses, sets and evictions for cache_stats()."""
+
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        self._stats_key = str(location)
+
+    def _count(self, **deltas):
+        with _stats_lock:
+            _stats[self._stats_key].update(deltas)
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            self._count(misses=1)
+            return default
+        self._count(hits=1)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version)
+        self._count(sets=1)
+
+    def stats(self):
+        with _stats_lock:
+            counts = dict(_stats[self._stats_key])
+        stats = {name: counts.get(name, 0) for name in ("hits", "misses", "sets")}
+        stats["evictions"] = counts.get("evictions", 0)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+        return stats
+
+
+class FileBasedCache(StatsMixin, filebased.FileBasedCache):
+    _culling = False
+
+    def _cull(self):
+        self._culling = True
+        try:
+            super()._cull()
+        finally:
+            self._culling = False
+
+    def _delete(self, fname):
+        deleted = super()._delete(fname)
+        if deleted and self._culling:
+            self._count(evictions=1)
+        return deleted
+
+
+class LocMemCache(StatsMixin, locmem.LocMemCache):
+    def _cull(self):
+        before = len(self._cache)
+        super()._cull()
+        self._count(evictions=before - len(self._cache))
+
+
+class RedisCache(StatsMixin, redis.RedisCache):
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = super().get_many(keys, version)
+        self._count(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def stats(self):
+        # Redis evicts on its own under maxmemory, so ask the server
+        stats = super().stats()
+        info = self._cache.get_client().info("stats")
+        stats["evictions"] = info.get("evicted_keys", 0)
+        stats["expirations"] = info.get("expired_keys", 0)
+        return stats
+
+
+def cache_stats():
+    """{alias: stats} for every configured cache that keeps them."""
+    return {
+        cache_alias: caches[cache_alias].stats()
+        for cache_alias in caches.settings
+        if hasattr(caches[cache_alias], "stats")
+    }
+
+
+def cache_aside(key, produce, timeout=DEFAULT_TIMEOUT, using="default"):
+    """
+    Returns the value cached under key, or calls produce() and caches what
+    it returns. None is never cached, so a lookup that found nothing is
+    tried again next time.
+    """
+    cache = caches[using]
+    value = cache.get(key)
+    if value is None:
+        value = produce()
+        if value is not None:
+            cache.set(key, value, timeout)
+    return value
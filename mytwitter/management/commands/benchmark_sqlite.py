@@ -0,0 +1,150 @@
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mytwitter.db import SQLITE_PRAGMAS, apply_pragmas
+
+
+# What a connection gets without the tuning hook (Python's sqlite3 already
+# waits 5 seconds for locks by default)
+BASELINE_PRAGMAS = {"journal_mode": "delete", "synchronous": "full"}
+
+SCHEMA = """
+CREATE TABLE tweet (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX tweet_user_created ON tweet (user_id, created_at);
+CREATE TABLE user (id INTEGER PRIMARY KEY, tweets INTEGER NOT NULL DEFAULT 0);
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent tweet writers and timeline readers against scratch "
+        "SQLite files with and without the tuned pragmas"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8)
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writes", type=int, default=200, help="Per writer")
+        parser.add_argument(
+            "--baseline-timeout",
+            type=float,
+            default=5.0,
+            help="Seconds a baseline connection waits for a lock; the tuned "
+            "profile waits for its busy_timeout pragma instead",
+        )
+
+    def handle(self, *args, **options):
+        tuned = {**SQLITE_PRAGMAS, **getattr(settings, "SQLITE_PRAGMAS", {})}
+        self.stdout.write(
+            f"{'profile':<10}{'writes/s':>10}{'errors':>8}{'p50':>10}{'p95':>10}"
+            f"{'reads/s':>10}"
+        )
+        for name, pragmas in (("baseline", BASELINE_PRAGMAS), ("tuned", tuned)):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "bench.sqlite3")
+                result = self.run(path, pragmas, options)
+            self.stdout.write(
+                f"{name:<10}{result['writes_per_second']:>10.0f}"
+                f"{result['errors']:>8}{result['p50'] * 1000:>8.1f}ms"
+                f"{result['p95'] * 1000:>8.1f}ms{result['reads_per_second']:>10.0f}"
+            )
+
+    def connect(self, path, pragmas, timeout):
+        connection = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        apply_pragmas(connection.cursor(), pragmas)
+        return connection
+
+    def run(self, path, pragmas, options):
+        setup = self.connect(path, pragmas, options["baseline_timeout"])
+        setup.executescript(SCHEMA)
+        setup.executemany(
+            "INSERT INTO user (id) VALUES (?)",
+            [(i,) for i in range(options["writers"])],
+        )
+        setup.close()
+
+        latencies = []
+        errors = []
+        reads = []
+        done = threading.Event()
+        lock = threading.Lock()
+
+        def write(user_id):
+            connection = self.connect(path, pragmas, options["baseline_timeout"])
+            for i in range(options["writes"]):
+                started = time.perf_counter()
+                try:
+                    # Autocommitted statements, like TweetCreateView's ORM calls
+                    connection.execute(
+                        "INSERT INTO tweet (user_id, body, created_at) "
+                        "VALUES (?, ?, ?)",
+                        (user_id, f"tweet {i}", time.time()),
+                    )
+                    connection.execute(
+                        "UPDATE user SET tweets = tweets + 1 WHERE id = ?",
+                        (user_id,),
+                    )
+                except sqlite3.OperationalError:
+                    with lock:
+                        errors.append(user_id)
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            connection.close()
+
+        def read():
+            connection = self.connect(path, pragmas, options["baseline_timeout"])
+            count = 0
+            while not done.is_set():
+                try:
+                    connection.execute(
+                        "SELECT id, body FROM tweet ORDER BY created_at DESC "
+                        "LIMIT 20"
+                    ).fetchall()
+                    count += 1
+                except sqlite3.OperationalError:
+                    pass
+            connection.close()
+            with lock:
+                reads.append(count)
+
+        writers = [
+            threading.Thread(target=write, args=(i,)) for i in range(options["writers"])
+        ]
+        readers = [threading.Thread(target=read) for _ in range(options["readers"])]
+        started = time.perf_counter()
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        if len(latencies) > 1:
+            quantiles = statistics.quantiles(latencies, n=100)
+            p50, p95 = quantiles[49], quantiles[94]
+        else:
+            p50 = p95 = latencies[0] if latencies else 0.0
+        return {
+            "writes_per_second": len(latencies) / elapsed,
+            "errors": len(errors),
+            "p50": p50,
+            "p95": p95,
+            "reads_per_second": sum(reads) / elapsed,
+        }
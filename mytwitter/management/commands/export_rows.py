@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from mytwitter import transfer
+
+
+class Command(BaseCommand):
+    help = "Streams users, profiles or tweets to newline-delimited JSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=sorted(transfer.MODELS))
+        parser.add_argument("path", nargs="?", default="-", help="- for stdout")
+        parser.add_argument(
+            "--format",
+            choices=transfer.FORMATS,
+            help="Defaults to csv for .csv paths and ndjson otherwise",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        model = transfer.MODELS[options["model"]]
+        path = options["path"]
+        fmt = options["format"] or ("csv" if path.endswith(".csv") else "ndjson")
+        rows = transfer.export_rows(model, options["batch_size"])
+        if path == "-":
+            count = transfer.write_rows(model, rows, self.stdout, fmt)
+        else:
+            with open(path, "w", newline="", encoding="utf-8") as stream:
+                count = transfer.write_rows(model, rows, stream, fmt)
+        # Keep stdout clean for the rows themselves
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} {options['model']}"))
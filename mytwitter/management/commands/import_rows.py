@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from mytwitter import transfer
+from user.models import Profile
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads users, profiles or tweets from newline-delimited JSON or CSV "
+        "with bulk inserts. Import users before their profiles and tweets."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=sorted(transfer.MODELS))
+        parser.add_argument("path", nargs="?", default="-", help="- for stdin")
+        parser.add_argument(
+            "--format",
+            choices=transfer.FORMATS,
+            help="Defaults to csv for .csv paths and ndjson otherwise",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--update",
+            action="store_true",
+            help="Overwrite rows whose primary key already exists instead of "
+            "skipping them (always on for profiles, which importing users "
+            "creates empty)",
+        )
+
+    def handle(self, *args, **options):
+        model = transfer.MODELS[options["model"]]
+        path = options["path"]
+        fmt = options["format"] or ("csv" if path.endswith(".csv") else "ndjson")
+        update = options["update"] or model is Profile
+        if path == "-":
+            count = self.load(model, sys.stdin, fmt, options["batch_size"], update)
+        else:
+            with open(path, newline="", encoding="utf-8") as stream:
+                count = self.load(model, stream, fmt, options["batch_size"], update)
+        self.stdout.write(self.style.SUCCESS(f"Imported {count} {options['model']}"))
+        if options["model"] == "tweets":
+            self.stdout.write(
+                "Signals were skipped: run rebuild_timelines, backfill_entities, "
+                "rebuild_search_index and reconcile_counters next."
+            )
+
+    def load(self, model, stream, fmt, batch_size, update):
+        instances = transfer.read_rows(model, stream, fmt)
+        return transfer.import_rows(model, instances, batch_size, update)
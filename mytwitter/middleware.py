@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+
+from .routers import _replica_reads
+
+
+PRIMARY_COOKIE = "read_primary_until"
+
+
+class ReplicaMiddleware:
+    """
+    Lets views with use_read_replica = True read from replicas on safe
+    requests. After a successful write the client reads from the primary for
+    REPLICA_STICKY_SECONDS, so it sees its own tweet despite replication lag.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.use_read_replica = False
+        try:
+            response = self.get_response(request)
+        finally:
+            # Covers lazily rendered templates too, which query after the view
+            if request.use_read_replica:
+                _replica_reads.reset(request._replica_token)
+        if request.method not in ("GET", "HEAD", "OPTIONS") and (
+            response.status_code < 400
+        ):
+            seconds = getattr(settings, "REPLICA_STICKY_SECONDS", 10)
+            response.set_cookie(
+                PRIMARY_COOKIE,
+                str(int(time.time()) + seconds),
+                max_age=seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, "view_class", view_func)
+        if (
+            request.method in ("GET", "HEAD")
+            and getattr(view, "use_read_replica", False)
+            and not self.pinned_to_primary(request)
+        ):
+            request.use_read_replica = True
+            request._replica_token = _replica_reads.set(True)
+
+    def pinned_to_primary(self, request):
+        try:
+            return int(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
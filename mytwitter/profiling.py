@@ -0,0 +1,231 @@
+"""
+Per-request SQL profiling: QueryProfile records every query run on any
+database alias, QueryProfilerMiddleware attaches one to each request and
+reports query count, database and template time and likely N+1 patterns,
+and query_budget() and ProfilingTestRunner turn those reports into test
+failures.
+"""
+import contextlib
+import logging
+import re
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+logger = logging.getLogger(__name__)
+
+# IN (%s, %s, ...) lists of any length are the same query
+_IN_LIST = re.compile(r"\(%s(?:, %s)*\)")
+
+
+def shape(sql):
+    """sql with its IN lists collapsed, so calls differing by size match."""
+    return _IN_LIST.sub("(%s, ...)", sql)
+
+
+def query_budget_default():
+    return getattr(settings, "QUERY_BUDGET", 20)
+
+
+def repeat_threshold():
+    return getattr(settings, "QUERY_REPEAT_THRESHOLD", 5)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryProfile:
+    """The queries run while capture() is active, with their timings."""
+
+    def __init__(self):
+        self.queries = []
+        self.template_time = None
+
+    def _record(self, alias):
+        def wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration = time.perf_counter() - started
+                self.queries.append((alias, sql, params, duration))
+
+        return wrapper
+
+    @contextlib.contextmanager
+    def capture(self):
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(self._record(alias))
+                )
+            yield self
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def db_time(self):
+        return sum(duration for _, _, _, duration in self.queries)
+
+    def shapes(self):
+        return Counter(shape(sql) for _, sql, _, _ in self.queries)
+
+    def repeated(self, threshold=None):
+        """
+        {shape: count} for statements run at least threshold times with
+        different parameters: one query per row, the N+1 pattern.
+        """
+        threshold = repeat_threshold() if threshold is None else threshold
+        params = defaultdict(set)
+        for _, sql, values, _ in self.queries:
+            params[shape(sql)].add(repr(values))
+        return {
+            sql: count
+            for sql, count in self.shapes().items()
+            if count >= threshold and len(params[sql]) > 1
+        }
+
+    def duplicates(self):
+        """{sql: count} for identical queries, parameters included, run twice."""
+        counts = Counter((sql, repr(params)) for _, sql, params, _ in self.queries)
+        return {sql: count for (sql, _), count in counts.items() if count > 1}
+
+    def problems(self, budget=None, threshold=None):
+        found = []
+        if budget is not None and self.count > budget:
+            found.append(f"{self.count} queries, over the budget of {budget}")
+        for sql, count in self.repeated(threshold).items():
+            found.append(f"N+1: {count} x {sql}")
+        return found
+
+
+@contextlib.contextmanager
+def query_budget(budget, threshold=None):
+    """
+    Fails with QueryBudgetExceeded if the block runs more than budget
+    queries or repeats one query per row. For tests:
+
+        with query_budget(6):
+            self.client.get(url)
+    """
+    profile = QueryProfile()
+    with profile.capture():
+        yield profile
+    problems = profile.problems(budget, threshold)
+    if problems:
+        raise QueryBudgetExceeded("\n".join(problems))
+
+
+class QueryProfilerMiddleware:
+    """
+    With QUERY_PROFILER on, profiles every request, sends the numbers back
+    in Server-Timing and X-Query-Count headers and logs a warning when a
+    view runs more queries than its query_budget attribute (or
+    QUERY_BUDGET) or looks like N+1. QUERY_PROFILER_STRICT raises
+    QueryBudgetExceeded instead, which the test client re-raises.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "QUERY_PROFILER", False):
+            return self.get_response(request)
+        request.query_profile = profile = QueryProfile()
+        request.query_budget = query_budget_default()
+        with profile.capture():
+            response = self.get_response(request)
+        self.report(request, response, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, "view_class", view_func)
+        budget = getattr(view, "query_budget", None)
+        if budget is not None and hasattr(request, "query_profile"):
+            request.query_budget = budget
+
+    def process_template_response(self, request, response):
+        # Runs just before a TemplateResponse renders; views calling
+        # render() count their template time as view time
+        profile = getattr(request, "query_profile", None)
+        if profile is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                profile.template_time = time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def report(self, request, response, profile):
+        timings = [f"db;dur={profile.db_time * 1000:.1f}"]
+        if profile.template_time is not None:
+            timings.append(f"tpl;dur={profile.template_time * 1000:.1f}")
+        response["Server-Timing"] = ", ".join(timings)
+        response["X-Query-Count"] = str(profile.count)
+
+        problems = profile.problems(request.query_budget)
+        duplicates = profile.duplicates()
+        if duplicates:
+            logger.info(
+                "%s %s ran %d identical queries more than once",
+                request.method,
+                request.path,
+                len(duplicates),
+            )
+        if not problems:
+            return
+        message = f"{request.method} {request.path}: " + "; ".join(problems)
+        if getattr(settings, "QUERY_PROFILER_STRICT", False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+# Second tweet database for tests with databases = {"default", TEST_SHARD},
+# in memory unless DATABASE_SHARD_URLS already configures it
+TEST_SHARD = "shard1"
+
+
+class ProfilingTestRunner(DiscoverRunner):
+    """
+    Runs the tests with the profiler on and strict, so budgets fail them,
+    with a TEST_SHARD database to shard tweets onto and, when the cache is
+    on disk, in a fresh directory removed afterwards.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # connections reads this same dict, and connects lazily
+        settings.DATABASES.setdefault(
+            TEST_SHARD, {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+        )
+        self._cache_dir = tempfile.TemporaryDirectory(prefix="mytwitter-cache-")
+        caches = {}
+        for alias, config in settings.CACHES.items():
+            if config["BACKEND"].endswith("FileBasedCache"):
+                config = {**config, "LOCATION": self._cache_dir.name}
+            caches[alias] = config
+        self._profiling = override_settings(
+            QUERY_PROFILER=True, QUERY_PROFILER_STRICT=True, CACHES=caches
+        )
+        self._profiling.enable()
+
+    def setup_databases(self, **kwargs):
+        # Migrated as a shard: only the tweets table
+        shards = getattr(settings, "TWEET_SHARDS", [DEFAULT_DB_ALIAS])
+        with override_settings(TWEET_SHARDS=list(dict.fromkeys([*shards, TEST_SHARD]))):
+            return super().setup_databases(**kwargs)
+
+    def teardown_test_environment(self, **kwargs):
+        self._profiling.disable()
+        self._cache_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
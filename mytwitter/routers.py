@@ -0,0 +1,50 @@
+import contextlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+# True while serving a view that may read from replicas
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class ReplicaRouter:
+    """
+    Sends reads of DATABASE_REPLICA_APPS models to a random replica, but
+    only inside replica_reads() (see ReplicaMiddleware). Everything else,
+    including all writes, sessions and migrations, stays on default.
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or not _replica_reads.get():
+            return None
+        if model._meta.app_label not in getattr(
+            settings, "DATABASE_REPLICA_APPS", ("tweets", "user")
+        ):
+            return None
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
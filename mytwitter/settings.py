@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import os
 from pathlib import Path
 
+from .cache import cache_config
+from .db import database_config, replica_configs, shard_configs
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -33,6 +37,11 @@ INSTALLED_APPS = [
     # Local
     "user.apps.UserConfig",
     "tweets.apps.TweetsConfig",
+    "jobs.apps.JobsConfig",
+    "mediastore.apps.MediastoreConfig",
+    "search.apps.SearchConfig",
+    "trends.apps.TrendsConfig",
+    "mytwitter.apps.MytwitterConfig",
     # Third Party
     "phonenumber_field",
     "extra_views",
@@ -46,6 +55,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it also counts the session and auth queries
+    "mytwitter.profiling.QueryProfilerMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -53,6 +64,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "mytwitter.middleware.ReplicaMiddleware",
 ]
 
 ROOT_URLCONF = "mytwitter.urls"
@@ -79,12 +91,69 @@ WSGI_APPLICATION = "mytwitter.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Configured by DATABASE_URL, DB_CONN_MAX_AGE, DB_CONN_HEALTH_CHECKS and
+# DB_POOLER; see mytwitter/db.py. Defaults to BASE_DIR / "db.sqlite3".
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
+    "default": database_config(os.environ, BASE_DIR),
+    **replica_configs(os.environ, BASE_DIR),
+    **shard_configs(os.environ, BASE_DIR),
+}
+
+# Views with use_read_replica = True read these apps from the replicas in
+# DATABASE_REPLICA_URLS, except for REPLICA_STICKY_SECONDS after a client's
+# own write, which it then reads back from default
+DATABASE_ROUTERS = ["tweets.sharding.ShardRouter", "mytwitter.routers.ReplicaRouter"]
+DATABASE_REPLICAS = list(replica_configs(os.environ, BASE_DIR))
+DATABASE_REPLICA_APPS = ("tweets", "user")
+REPLICA_STICKY_SECONDS = 10
+
+# Tweets are partitioned by author across default and DATABASE_SHARD_URLS on
+# a consistent-hash ring; see tweets.sharding and the reshard_tweets command
+TWEET_SHARDS = ["default", *shard_configs(os.environ, BASE_DIR)]
+TWEET_SHARD_VNODES = 64
+# Seconds a process trusts its cached copy of a user's shard
+TWEET_SHARD_CACHE_TIMEOUT = 60
+
+# Node number (0-1023) stamped into the tweet ids this process mints; see
+# tweets.ids. Unset, it is derived from the host name and process id
+SNOWFLAKE_NODE = (
+    int(os.environ["SNOWFLAKE_NODE"]) if "SNOWFLAKE_NODE" in os.environ else None
+)
+
+# New SQLite connections get WAL, busy_timeout and the other pragmas in
+# mytwitter.db.SQLITE_PRAGMAS; override single pragmas here (None skips one)
+SQLITE_PRAGMAS = {}
+
+# Query profiling; see mytwitter/profiling.py. Views above their
+# query_budget attribute (or QUERY_BUDGET), or running one statement at
+# least QUERY_REPEAT_THRESHOLD times with different parameters, are
+# logged, and fail the tests under ProfilingTestRunner
+QUERY_PROFILER = DEBUG
+QUERY_PROFILER_STRICT = False
+QUERY_BUDGET = 20
+QUERY_REPEAT_THRESHOLD = 5
+TEST_RUNNER = "mytwitter.profiling.ProfilingTestRunner"
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+# Shared by every worker: CACHE_URL=redis://host:6379/0 in production, or
+# file:///path / locmem://; see mytwitter/cache.py. Defaults to a file cache
+# under BASE_DIR; test runs get a fresh directory from ProfilingTestRunner.
+CACHES = {
+    "default": cache_config(os.environ.get("CACHE_URL"), BASE_DIR / "cache"),
 }
+# Seconds the first page of a home or profile timeline is served from the
+# cache; the owner's own writes invalidate it immediately
+HOME_TIMELINE_CACHE_TIMEOUT = 30
+PROFILE_CACHE_TIMEOUT = 60
+TWEET_CACHE_TIMEOUT = 300
+
+# Sessions are read from the cache and only written through to the database
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+# Seconds a signup wizard is kept between steps; see user.wizard
+SIGNUP_WIZARD_TIMEOUT = 1800
 
 
 # Password validation
@@ -143,3 +212,51 @@ EMAIL_FILE_PATH = BASE_DIR / "sent_emails"
 # Image backend
 MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_URL = "/media/"
+# Uploads are stored once per distinct content under MEDIA_ROOT/cas/
+DEFAULT_FILE_STORAGE = "mediastore.storage.ContentAddressedStorage"
+# Seconds an unreferenced upload is kept before gc_media deletes it
+MEDIASTORE_GC_GRACE = 60 * 60
+# How /media/ is delivered: "django" streams it from the worker,
+# "x-sendfile" (Apache/lighttpd) or "x-accel-redirect" (nginx) offload it
+MEDIA_SERVE_MODE = "django"
+# nginx internal location aliased to MEDIA_ROOT, used by x-accel-redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+
+# Tweet counters
+# Buffer like/retweet/reply deltas per process and flush them in batches
+TWEET_COUNTER_BUFFER = {
+    "ENABLED": False,
+    "INTERVAL": 1.0,
+    "MAX_PENDING": 1000,
+}
+
+# Seconds a rendered tweet card stays in the cache
+TWEET_CARD_CACHE_TIMEOUT = 60 * 60
+
+# Seconds a tweet detail page rendered for anonymous viewers stays cached
+TWEET_DETAIL_CACHE_TIMEOUT = 5 * 60
+
+# Widths of the resized copies generated for tweet images
+TWEET_IMAGE_WIDTHS = (320, 640, 1280)
+
+# Background jobs
+# Failed jobs are retried with exponential backoff starting at JOBS_RETRY_DELAY
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 10
+
+# Tweet search
+# FTS5Backend needs SQLite; SimpleBackend works anywhere but scans the table.
+# None picks from the default database: FTS5 on SQLite, Simple elsewhere
+SEARCH_BACKEND = None
+# Ranking points a tweet gains per day of recency on top of its BM25 score
+SEARCH_RECENCY_WEIGHT = 0.1
+
+# Trending topics, computed by the run_trends command
+TRENDS = {
+    # Window name -> half-life in seconds of the time decay
+    "WINDOWS": {"hour": 60 * 60, "day": 24 * 60 * 60},
+    "PANEL_WINDOW": "hour",
+    "TOP_K": 10,
+    # Seconds between snapshots of the top terms
+    "INTERVAL": 60,
+}
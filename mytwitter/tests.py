@@ -0,0 +1,452 @@
+import os
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.shortcuts import reverse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .apps import check_connections, configure_sqlite
+from .cache import LocMemCache, cache_aside, cache_config
+from .db import database_config, parse_database_url, replica_configs
+from .middleware import PRIMARY_COOKIE
+from .profiling import QueryBudgetExceeded, QueryProfile, query_budget, shape
+from .routers import ReplicaRouter, replica_reads
+from tweets.models import Tweet
+from user.models import CustomUser, Profile
+
+
+class DatabaseConfigTests(SimpleTestCase):
+    def test_sqlite_urls(self):
+        base_dir = Path("/srv/app")
+        self.assertEqual(
+            parse_database_url("sqlite:///db.sqlite3", base_dir),
+            {"ENGINE": "django.db.backends.sqlite3", "NAME": base_dir / "db.sqlite3"},
+        )
+        self.assertEqual(
+            parse_database_url("sqlite:////var/db.sqlite3?timeout=20", base_dir),
+            {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": "/var/db.sqlite3",
+                "OPTIONS": {"timeout": 20},
+            },
+        )
+        self.assertEqual(parse_database_url("sqlite://", base_dir)["NAME"], ":memory:")
+
+    def test_postgres_url(self):
+        self.assertEqual(
+            parse_database_url("postgres://app:p%40ss@db:6432/twitter?sslmode=require"),
+            {
+                "ENGINE": "django.db.backends.postgresql",
+                "NAME": "twitter",
+                "USER": "app",
+                "PASSWORD": "p@ss",
+                "HOST": "db",
+                "PORT": "6432",
+                "OPTIONS": {"sslmode": "require"},
+            },
+        )
+
+    def test_unsupported_scheme(self):
+        with self.assertRaises(ValueError):
+            parse_database_url("mysql://db/twitter")
+
+    def test_defaults_and_pooler(self):
+        config = database_config({}, Path("/srv/app"))
+        self.assertEqual(config["NAME"], Path("/srv/app/db.sqlite3"))
+        self.assertEqual(config["CONN_MAX_AGE"], 60)
+        self.assertTrue(config["CONN_HEALTH_CHECKS"])
+        self.assertNotIn("DISABLE_SERVER_SIDE_CURSORS", config)
+
+        config = database_config(
+            {
+                "DATABASE_URL": "postgres://app@pgbouncer/twitter",
+                "DB_CONN_MAX_AGE": "none",
+                "DB_CONN_HEALTH_CHECKS": "0",
+                "DB_POOLER": "pgbouncer",
+            },
+            Path("/srv/app"),
+        )
+        self.assertIsNone(config["CONN_MAX_AGE"])
+        self.assertFalse(config["CONN_HEALTH_CHECKS"])
+        self.assertTrue(config["DISABLE_SERVER_SIDE_CURSORS"])
+
+
+class ConnectionHealthCheckTests(TestCase):
+    def test_unusable_connection_is_closed_on_request_start(self):
+        connection.ensure_connection()
+        with mock.patch.object(connection, "is_usable", return_value=False):
+            with mock.patch.object(connection, "close") as close:
+                check_connections()
+        close.assert_called_once()
+
+    def test_usable_connection_is_kept(self):
+        connection.ensure_connection()
+        with mock.patch.object(connection, "close") as close:
+            check_connections()
+        close.assert_not_called()
+
+
+class SQLitePragmaTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_on_connect(self):
+        self.assertEqual(self.pragma("busy_timeout"), 5000)
+        # 1 is NORMAL, 2 is MEMORY
+        self.assertEqual(self.pragma("synchronous"), 1)
+        self.assertEqual(self.pragma("temp_store"), 2)
+        self.assertEqual(self.pragma("cache_size"), -20000)
+
+    # None skips a pragma; journal_mode and synchronous cannot be changed
+    # inside the test transaction anyway
+    @override_settings(
+        SQLITE_PRAGMAS={
+            "busy_timeout": 1234,
+            "cache_size": None,
+            "journal_mode": None,
+            "synchronous": None,
+        }
+    )
+    def test_pragmas_configurable(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA cache_size = -2000")
+        configure_sqlite(sender=None, connection=connection)
+        self.assertEqual(self.pragma("busy_timeout"), 1234)
+        self.assertEqual(self.pragma("cache_size"), -2000)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command(
+            "benchmark_sqlite",
+            "--writers",
+            "2",
+            "--readers",
+            "1",
+            "--writes",
+            "5",
+            stdout=out,
+        )
+        self.assertIn("baseline", out.getvalue())
+        self.assertIn("tuned", out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=["default"])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.client.login(username="test", password="12345")
+
+    def replica_used(self, method, url, data=None):
+        # The test replica is default itself; watch the router pick it
+        choice = mock.Mock(return_value="default")
+        with mock.patch("mytwitter.routers.random.choice", choice):
+            getattr(self.client, method)(url, data)
+        return choice.called
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Tweet))
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Tweet), "default")
+            self.assertIsNone(router.db_for_read(Session))
+        self.assertEqual(router.db_for_write(Tweet), "default")
+        self.assertFalse(router.allow_migrate("replica1", "tweets"))
+
+    def test_read_views_use_replicas(self):
+        tweet = Tweet.objects.create(user=self.user, body="hello")
+        self.assertTrue(self.replica_used("get", reverse("user:home")))
+        self.assertTrue(
+            self.replica_used(
+                "get", reverse("user:user_profile", kwargs={"pk": self.user.id})
+            )
+        )
+        self.assertTrue(
+            self.replica_used(
+                "get", reverse("tweets:tweet_detail", kwargs={"pk": tweet.id})
+            )
+        )
+        self.assertFalse(
+            self.replica_used(
+                "get", reverse("tweets:tweet_edit", kwargs={"pk": tweet.id})
+            )
+        )
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.assertFalse(
+            self.replica_used("post", reverse("tweets:tweet"), {"body": "mine"})
+        )
+        self.assertIn(PRIMARY_COOKIE, self.client.cookies)
+        self.assertFalse(self.replica_used("get", reverse("user:home")))
+
+        self.client.cookies[PRIMARY_COOKIE] = str(int(time.time()) - 1)
+        self.assertTrue(self.replica_used("get", reverse("user:home")))
+
+    def test_replica_urls(self):
+        replicas = replica_configs(
+            {"DATABASE_REPLICA_URLS": "postgres://r1/db, postgres://r2/db"},
+            Path("/srv/app"),
+        )
+        self.assertEqual(list(replicas), ["replica1", "replica2"])
+        self.assertEqual(replicas["replica2"]["HOST"], "r2")
+        self.assertEqual(replicas["replica1"]["TEST"], {"MIRROR": "default"})
+
+
+class CacheTests(SimpleTestCase):
+    def test_cache_urls(self):
+        self.assertEqual(
+            cache_config("redis://cache:6379/0?timeout=60&max_connections=50", "x"),
+            {
+                "BACKEND": "mytwitter.cache.RedisCache",
+                "LOCATION": "redis://cache:6379/0",
+                "TIMEOUT": 60,
+                "OPTIONS": {"max_connections": 50},
+            },
+        )
+        self.assertEqual(
+            cache_config("file:///var/cache/app?max_entries=10000", "x"),
+            {
+                "BACKEND": "mytwitter.cache.FileBasedCache",
+                "LOCATION": "/var/cache/app",
+                "OPTIONS": {"max_entries": 10000},
+            },
+        )
+        self.assertEqual(
+            cache_config(None, "/srv/cache"),
+            {"BACKEND": "mytwitter.cache.FileBasedCache", "LOCATION": "/srv/cache"},
+        )
+
+    def test_stats_count_hits_misses_and_evictions(self):
+        cache = LocMemCache(
+            "stats-test", {"OPTIONS": {"MAX_ENTRIES": 2, "CULL_FREQUENCY": 2}}
+        )
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get_or_set("c", 3), 3)
+        cache.set("d", 4)
+        stats = cache.stats()
+        # get_or_set() reads the value back after adding it
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+        self.assertEqual(stats["hit_rate"], 0.5)
+        self.assertEqual(stats["evictions"], 1)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "mytwitter.cache.LocMemCache", "LOCATION": "aside"}
+        }
+    )
+    def test_cache_aside(self):
+        produce = mock.Mock(return_value="value")
+        self.assertEqual(cache_aside("key", produce), "value")
+        self.assertEqual(cache_aside("key", produce), "value")
+        produce.assert_called_once()
+
+        # Nothing found is not cached
+        produce = mock.Mock(return_value=None)
+        cache_aside("missing", produce)
+        cache_aside("missing", produce)
+        self.assertEqual(produce.call_count, 2)
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        for i in range(7):
+            user = CustomUser.objects.create(
+                username=f"test{i}",
+                email=f"test{i}@test.com",
+                phone="+818012345678" if i % 2 else "",
+                date_of_birth="1901-01-01",
+            )
+            user.profile.bio = f"bio {i}"
+            user.profile.save()
+            Tweet.objects.create(
+                user=user, body=f'tweet, "{i}"\nline two', renditions=[{"width": i}]
+            )
+
+    def snapshot(self):
+        return [
+            list(CustomUser.objects.order_by("pk").values()),
+            list(Profile.objects.order_by("pk").values()),
+            list(Tweet.objects.order_by("pk").values()),
+        ]
+
+    def round_trip(self, extension):
+        before = self.snapshot()
+        paths = {}
+        for name in ("users", "profiles", "tweets"):
+            paths[name] = os.path.join(self.dir.name, f"{name}.{extension}")
+            call_command("export_rows", name, paths[name], stderr=StringIO())
+        Tweet.objects.all().delete()
+        CustomUser.objects.all().delete()
+
+        for name in ("users", "profiles", "tweets"):
+            out = StringIO()
+            call_command(
+                "import_rows", name, paths[name], "--batch-size", "3", stdout=out
+            )
+            self.assertIn(f"Imported 7 {name}", out.getvalue())
+        self.assertEqual(self.snapshot(), before)
+
+    def test_ndjson_round_trip(self):
+        self.round_trip("ndjson")
+
+    def test_csv_round_trip(self):
+        self.round_trip("csv")
+
+    def test_import_is_batched(self):
+        path = os.path.join(self.dir.name, "users.ndjson")
+        call_command("export_rows", "users", path, stderr=StringIO())
+        CustomUser.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            call_command(
+                "import_rows", "users", path, "--batch-size", "5", stdout=StringIO()
+            )
+        inserts = [q for q in queries if q["sql"].startswith("INSERT")]
+        # Users and their profiles, once per batch of 5
+        self.assertEqual(len(inserts), 4)
+        self.assertEqual(Profile.objects.count(), 7)
+
+    def test_existing_rows_are_skipped_unless_updating(self):
+        path = os.path.join(self.dir.name, "users.csv")
+        call_command("export_rows", "users", path, stderr=StringIO())
+        CustomUser.objects.update(email="changed@test.com")
+        out = StringIO()
+        call_command("import_rows", "users", path, stdout=out)
+        self.assertIn("Imported 0 users", out.getvalue())
+        self.assertEqual(CustomUser.objects.filter(email="changed@test.com").count(), 7)
+        out = StringIO()
+        call_command("import_rows", "users", path, "--update", stdout=out)
+        self.assertIn("Imported 7 users", out.getvalue())
+        self.assertFalse(CustomUser.objects.filter(email="changed@test.com").exists())
+
+    def test_rows_with_a_taken_username_are_not_counted(self):
+        path = os.path.join(self.dir.name, "users.ndjson")
+        call_command("export_rows", "users", path, stderr=StringIO())
+        CustomUser.objects.filter(username="test0").delete()
+        # test0's primary key is free again, but not its username
+        CustomUser.objects.create(
+            username="test0", email="new@test.com", date_of_birth="1901-01-01"
+        )
+        out = StringIO()
+        call_command("import_rows", "users", path, stdout=out)
+        self.assertIn("Imported 0 users", out.getvalue())
+
+    def test_sequences_continue_after_imported_keys(self):
+        path = os.path.join(self.dir.name, "users.ndjson")
+        call_command("export_rows", "users", path, stderr=StringIO())
+        last = CustomUser.objects.order_by("pk").last().pk
+        CustomUser.objects.all().delete()
+        call_command("import_rows", "users", path, stdout=StringIO())
+        user = CustomUser.objects.create(
+            username="after", email="after@test.com", date_of_birth="1901-01-01"
+        )
+        self.assertGreater(user.pk, last)
+
+    def test_export_to_stdout(self):
+        out = StringIO()
+        call_command(
+            "export_rows", "tweets", "--format", "csv", stdout=out, stderr=StringIO()
+        )
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("id,user_id,body"))
+
+
+class QueryProfilerTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        authors = CustomUser.objects.bulk_create_with_profiles(
+            CustomUser(
+                username=f"author{i}",
+                email=f"author{i}@test.com",
+                date_of_birth="1901-01-01",
+            )
+            for i in range(6)
+        )
+        Tweet.objects.bulk_create(
+            Tweet(user=author, body=f"tweet {i}") for i, author in enumerate(authors)
+        )
+
+    def test_in_lists_share_a_shape(self):
+        self.assertEqual(
+            shape("SELECT * FROM t WHERE id IN (%s, %s, %s)"),
+            shape("SELECT * FROM t WHERE id IN (%s)"),
+        )
+
+    def test_one_query_per_row_is_flagged(self):
+        profile = QueryProfile()
+        with profile.capture():
+            for tweet in Tweet.objects.all():
+                CustomUser.objects.get(pk=tweet.user_id)
+        self.assertEqual(profile.count, 7)
+        self.assertEqual(list(profile.repeated().values()), [6])
+        self.assertEqual(profile.duplicates(), {})
+
+    def test_the_same_lookup_repeated_is_not_n_plus_one(self):
+        profile = QueryProfile()
+        with profile.capture():
+            for _ in range(6):
+                CustomUser.objects.get(pk=self.user.pk)
+        self.assertEqual(profile.repeated(), {})
+        self.assertEqual(list(profile.duplicates().values()), [6])
+
+    def test_query_budget(self):
+        with query_budget(1):
+            list(Tweet.objects.all())
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                list(Tweet.objects.all())
+                list(CustomUser.objects.all())
+        with self.assertRaisesMessage(QueryBudgetExceeded, "N+1"):
+            with query_budget(100):
+                for tweet in Tweet.objects.all():
+                    tweet.user
+
+    @override_settings(QUERY_PROFILER=True)
+    def test_middleware_reports_timings(self):
+        self.client.login(username="test", password="12345")
+        response = self.client.get(reverse("user:home"))
+        self.assertEqual(
+            int(response["X-Query-Count"]), response.wsgi_request.query_profile.count
+        )
+        self.assertRegex(response["Server-Timing"], r"^db;dur=[\d.]+, tpl;dur=[\d.]+$")
+
+    @override_settings(QUERY_PROFILER=False)
+    def test_middleware_can_be_turned_off(self):
+        self.client.login(username="test", password="12345")
+        self.assertNotIn("X-Query-Count", self.client.get(reverse("user:home")))
+
+    @override_settings(QUERY_PROFILER=True, QUERY_PROFILER_STRICT=True, QUERY_BUDGET=1)
+    def test_strict_mode_fails_over_budget_views(self):
+        self.client.login(username="test", password="12345")
+        # HomeView sets its own query_budget
+        self.client.get(reverse("user:home"))
+        with self.assertRaisesMessage(QueryBudgetExceeded, "over the budget of 1"):
+            self.client.get(reverse("user:edit_profile", kwargs={"pk": self.user.pk}))
+
+    @override_settings(QUERY_PROFILER=True, QUERY_PROFILER_STRICT=False, QUERY_BUDGET=1)
+    def test_over_budget_views_are_logged(self):
+        self.client.login(username="test", password="12345")
+        url = reverse("user:edit_profile", kwargs={"pk": self.user.pk})
+        with self.assertLogs("mytwitter.profiling", "WARNING") as logs:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f"GET {url}", logs.output[0])
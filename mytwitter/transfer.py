@@ -0,0 +1,213 @@
+"""
+Streaming export and import of users, profiles and tweets as
+newline-delimited JSON or CSV, used by the export_rows and import_rows
+commands. Rows flow through generators and are written in fixed-size
+batches, so memory stays flat however many rows there are.
+"""
+import contextlib
+import csv
+import datetime
+import itertools
+import json
+from collections import defaultdict
+
+from django.core.management.color import no_style
+from django.db import connections, models, router, transaction
+
+from tweets import sharding
+from tweets.models import Tweet
+from user.models import CustomUser, Profile
+
+
+MODELS = {"users": CustomUser, "profiles": Profile, "tweets": Tweet}
+FORMATS = ("ndjson", "csv")
+
+
+def fields_of(model):
+    return list(model._meta.concrete_fields)
+
+
+def encode(field, value, flat=False):
+    """A JSON-friendly value; flat values (for CSV) are always strings."""
+    if value is None:
+        return "" if flat else None
+    if isinstance(field, models.JSONField):
+        return json.dumps(value) if flat else value
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bool, int, float, str)) and not flat:
+        return value
+    return str(value)
+
+
+def decode(field, value, flat=False):
+    if flat:
+        if value == "" and field.null:
+            return None
+        if isinstance(field, models.JSONField):
+            return json.loads(value)
+    if value is None:
+        return None
+    return field.to_python(value)
+
+
+def export_rows(model, batch_size=1000):
+    """Yields {attname: value} dicts in pk order, a keyset batch at a time."""
+    names = [field.attname for field in fields_of(model)]
+    querysets = [model.objects.all()]
+    if model is Tweet and sharding.is_sharded():
+        querysets = [Tweet.objects.using(alias) for alias in sharding.shards()]
+    for queryset in querysets:
+        queryset = queryset.order_by("pk").values(*names)
+        last_pk = None
+        while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            yield from batch
+            last_pk = batch[-1][model._meta.pk.attname]
+
+
+def write_rows(model, rows, stream, fmt):
+    fields = fields_of(model)
+    flat = fmt == "csv"
+    if flat:
+        writer = csv.writer(stream)
+        writer.writerow(field.attname for field in fields)
+    count = 0
+    for row in rows:
+        values = [encode(field, row[field.attname], flat) for field in fields]
+        if flat:
+            writer.writerow(values)
+        else:
+            record = dict(zip((field.attname for field in fields), values))
+            stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+        count += 1
+    return count
+
+
+def read_rows(model, stream, fmt):
+    """Yields model instances parsed from stream, one line at a time."""
+    fields = {field.attname: field for field in fields_of(model)}
+    flat = fmt == "csv"
+    records = csv.DictReader(stream) if flat else map(json.loads, stream)
+    for record in records:
+        yield model(
+            **{
+                name: decode(fields[name], value, flat)
+                for name, value in record.items()
+                if name in fields
+            }
+        )
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+@contextlib.contextmanager
+def keep_timestamps(model):
+    """
+    Stops auto_now/auto_now_add fields from overwriting imported values.
+    It changes the model's fields for the whole process, so it is only for
+    single-threaded commands.
+    """
+    changed = [
+        (field, field.auto_now, field.auto_now_add)
+        for field in fields_of(model)
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    for field, _, _ in changed:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in changed:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _save_batch(model, manager, batch, update):
+    """The primary keys of the rows in batch that were written."""
+    pk_name = model._meta.pk.attname
+    existing = set(
+        manager.filter(pk__in=[getattr(obj, pk_name) for obj in batch]).values_list(
+            "pk", flat=True
+        )
+    )
+    written = set()
+    if update and existing:
+        names = [field.attname for field in fields_of(model) if not field.primary_key]
+        manager.bulk_update(
+            [obj for obj in batch if getattr(obj, pk_name) in existing], names
+        )
+        written = existing
+    new = [obj for obj in batch if getattr(obj, pk_name) not in existing]
+    if new:
+        # Rows whose primary key (or another unique field) is already taken
+        # are skipped, not overwritten; read back which ones went in
+        manager.bulk_create(new, ignore_conflicts=True)
+        written |= set(
+            manager.filter(pk__in=[getattr(obj, pk_name) for obj in new]).values_list(
+                "pk", flat=True
+            )
+        )
+    return written
+
+
+def save_batch(model, batch, update=False):
+    """
+    Saves batch in one transaction per database it goes to, and returns
+    how many rows were inserted or updated.
+    """
+    if model is not Tweet:
+        with transaction.atomic(using=router.db_for_write(model)):
+            written = _save_batch(model, model.objects, batch, update)
+            if model is CustomUser and written:
+                Profile.objects.provision(written)
+        return len(written)
+    # Each tweet goes to its author's shard
+    by_shard = defaultdict(list)
+    for tweet in batch:
+        by_shard[sharding.place_user(tweet.user_id)].append(tweet)
+    count = 0
+    for alias, tweets in by_shard.items():
+        with transaction.atomic(using=alias):
+            count += len(_save_batch(Tweet, sharding.tweets_on(alias), tweets, update))
+    return count
+
+
+def reset_sequences(model):
+    """
+    Moves the model's id sequences past the imported primary keys, as
+    loaddata does, so rows created afterwards don't collide with them.
+    """
+    aliases = sharding.shards() if model is Tweet else [router.db_for_write(model)]
+    for alias in aliases:
+        connection = connections[alias]
+        statements = connection.ops.sequence_reset_sql(no_style(), [model])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+def import_rows(model, instances, batch_size=1000, update=False):
+    """
+    Saves instances with one bulk_create per batch, each batch in its own
+    transactions so an interrupted import keeps what it finished. Signals
+    are not sent; imported users get empty profiles from provision().
+    Existing rows are updated with update, otherwise left alone. Returns
+    the number of rows inserted or updated.
+    """
+    count = 0
+    with keep_timestamps(model):
+        for batch in batched(instances, batch_size):
+            count += save_batch(model, batch, update)
+    reset_sequences(model)
+    return count
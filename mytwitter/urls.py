@@ -15,12 +15,17 @@ Including another URLconf
 """
 from django.conf import settings
 from django.contrib import admin
-from django.contrib.staticfiles.urls import static
 from django.urls import path, include
 
+from mediastore.views import serve_media
+
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("users/", include("user.urls")),
     path("tweets/", include("tweets.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("search/", include("search.urls")),
+    # Media goes through a real view (or X-Sendfile/X-Accel-Redirect
+    # offload, see MEDIA_SERVE_MODE) rather than the DEBUG-only static()
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media, name="media"),
+]
@@ -0,0 +1,143 @@
+import functools
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from tweets.models import Tweet
+
+
+class BaseSearchBackend:
+    """
+    Interface of a tweet search engine. search() returns up to limit
+    (score, tweet_id) pairs ordered by ascending score then id, strictly
+    after the (score, tweet_id) pair given as after.
+    """
+
+    def index(self, tweets):
+        raise NotImplementedError
+
+    def remove(self, tweet_ids):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def search(self, terms, limit, after=None):
+        raise NotImplementedError
+
+
+class FTS5Backend(BaseSearchBackend):
+    """
+    SQLite FTS5 inverted index (created by search's migration) ranked by
+    BM25 plus a recency bonus. The bonus grows linearly with created_at, so
+    a tweet's score does not drift over time and cursors stay valid.
+    """
+
+    table = "search_tweet_fts"
+
+    def recency_weight(self):
+        # Score points gained per day of recency; BM25 scores span ~1-20
+        return getattr(settings, "SEARCH_RECENCY_WEIGHT", 0.1)
+
+    def index(self, tweets):
+        rows = [(tweet.pk, tweet.body) for tweet in tweets]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            self._delete(cursor, [pk for pk, _ in rows])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, body) VALUES (%s, %s)", rows
+            )
+
+    def remove(self, tweet_ids):
+        with connection.cursor() as cursor:
+            self._delete(cursor, list(tweet_ids))
+
+    def _delete(self, cursor, tweet_ids):
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(tweet_ids), 500):
+            batch = tweet_ids[start : start + 500]
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", batch
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+    def match_expression(self, terms):
+        parts = []
+        for term in terms:
+            phrase = '"' + " ".join(term.words) + '"'
+            parts.append(phrase + "*" if term.prefix else phrase)
+        return " ".join(parts)
+
+    def search(self, terms, limit, after=None):
+        sql = f"""
+            SELECT score, id FROM (
+                SELECT bm25({self.table})
+                    - %s * (julianday(tweet.created_at) - 2440587.5) AS score,
+                    tweet.id AS id
+                FROM {self.table}
+                JOIN {Tweet._meta.db_table} tweet ON tweet.id = {self.table}.rowid
+                WHERE {self.table} MATCH %s
+            )
+        """
+        params = [self.recency_weight(), self.match_expression(terms)]
+        if after is not None:
+            sql += " WHERE score > %s OR (score = %s AND id > %s)"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY score, id LIMIT %s"
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class SimpleBackend(BaseSearchBackend):
+    """
+    Index-free fallback for databases without a full-text engine: matches
+    with icontains and ranks newest first. Scans the table; not for production.
+    """
+
+    def index(self, tweets):
+        pass
+
+    def remove(self, tweet_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, terms, limit, after=None):
+        queryset = Tweet.objects.all()
+        for term in terms:
+            queryset = queryset.filter(body__icontains=" ".join(term.words))
+        # Negated ids order newest first under the ascending-score contract
+        queryset = queryset.annotate(score=-F("id")).order_by("score")
+        if after is not None:
+            # Filter on the id itself: a float score cannot hold a 64-bit id
+            queryset = queryset.filter(id__lt=after[1])
+        return [
+            (score, pk) for score, pk in queryset.values_list("score", "id")[:limit]
+        ]
+
+
+def default_backend(database):
+    """
+    The backend for a DATABASES entry: FTS5Backend on SQLite, the only
+    vendor its migration creates a table on, SimpleBackend elsewhere.
+    """
+    if database["ENGINE"] == "django.db.backends.sqlite3":
+        return "search.backends.FTS5Backend"
+    return "search.backends.SimpleBackend"
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend():
+    path = getattr(settings, "SEARCH_BACKEND", None)
+    path = path or default_backend(settings.DATABASES["default"])
+    return import_string(path)()
@@ -0,0 +1,110 @@
+import itertools
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from search.backends import get_backend
+from search.query import parse_query
+from tweets.models import Tweet
+from user.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Indexes a synthetic tweet corpus and reports search latency against "
+        "an icontains scan. Everything is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tweets", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--vocabulary", type=int, default=50_000)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        # Zipf-distributed words, like real text: few common, many rare
+        self.words = [f"w{rank}" for rank in range(1, options["vocabulary"] + 1)]
+        self.cum_weights = list(
+            itertools.accumulate(1 / rank for rank in range(1, len(self.words) + 1))
+        )
+        with transaction.atomic():
+            self.load(options["tweets"], options["batch_size"])
+            self.report(options["queries"])
+            transaction.set_rollback(True)
+
+    def body(self):
+        length = self.random.randint(5, 30)
+        return " ".join(
+            self.random.choices(self.words, cum_weights=self.cum_weights, k=length)
+        )
+
+    def load(self, count, batch_size):
+        user = CustomUser.objects.create(
+            username="benchmark_search",
+            email="benchmark@example.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+        backend = get_backend()
+        insert_seconds = index_seconds = 0.0
+        for start in range(0, count, batch_size):
+            size = min(batch_size, count - start)
+            started = time.perf_counter()
+            batch = Tweet.objects.bulk_create(
+                Tweet(user=user, body=self.body()) for _ in range(size)
+            )
+            insert_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            backend.index(batch)
+            index_seconds += time.perf_counter() - started
+        self.stdout.write(
+            f"Inserted {count} tweets in {insert_seconds:.1f}s, "
+            f"indexed in {index_seconds:.1f}s "
+            f"({count / max(index_seconds, 1e-9):.0f} tweets/s)"
+        )
+
+    def report(self, queries):
+        common = self.words[:20]
+        rare = self.words[len(self.words) // 2 :]
+        kinds = {
+            "common word": lambda: self.random.choice(common),
+            "rare word": lambda: self.random.choice(rare),
+            "two words": lambda: " ".join(self.random.sample(common, 2)),
+            "phrase": lambda: '"' + self.body()[:20].rsplit(" ", 1)[0] + '"',
+            "prefix": lambda: self.random.choice(common)[:3] + "*",
+        }
+        backend = get_backend()
+        self.stdout.write(
+            f"{'query':<14}{'backend p50':>14}{'p95':>10}{'icontains p50':>16}"
+        )
+        for kind, make in kinds.items():
+            texts = [make() for _ in range(queries)]
+            indexed = [
+                self.time(lambda: backend.search(parse_query(t), 21)) for t in texts
+            ]
+            scanned = [self.time(lambda: self.scan(t)) for t in texts[:5]]
+            self.stdout.write(
+                f"{kind:<14}{self.ms(indexed, 50):>12.1f}ms{self.ms(indexed, 95):>8.1f}ms"
+                f"{self.ms(scanned, 50):>14.1f}ms"
+            )
+
+    def scan(self, text):
+        queryset = Tweet.objects.all()
+        for term in parse_query(text):
+            queryset = queryset.filter(body__icontains=" ".join(term.words))
+        return list(queryset.order_by("-created_at", "-id").values_list("id")[:21])
+
+    def time(self, func):
+        started = time.perf_counter()
+        func()
+        return time.perf_counter() - started
+
+    def ms(self, samples, percentile):
+        if len(samples) == 1:
+            return samples[0] * 1000
+        return statistics.quantiles(samples, n=100)[percentile - 1] * 1000
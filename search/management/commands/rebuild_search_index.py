@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from search.backends import get_backend
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "Re-indexes every tweet in the search backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    # One transaction, so searches never see a half-built index
+    @transaction.atomic
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.clear()
+        tweets = Tweet.objects.order_by("pk").only("pk", "body")
+        last_pk = 0
+        indexed = 0
+        while True:
+            batch = list(tweets.filter(pk__gt=last_pk)[: options["batch_size"]])
+            if not batch:
+                break
+            backend.index(batch)
+            last_pk = batch[-1].pk
+            indexed += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} tweets"))
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+# FTS5 keeps its own copy of each body; prefix indexes speed up "dja*"
+CREATE_SQL = """
+CREATE VIRTUAL TABLE search_tweet_fts USING fts5(
+    body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+)
+"""
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(CREATE_SQL)
+    schema_editor.execute(
+        "INSERT INTO search_tweet_fts (rowid, body) SELECT id, body FROM tweets_tweet"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS search_tweet_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0007_tweet_image_processing"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
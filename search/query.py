@@ -0,0 +1,75 @@
+import re
+from collections import namedtuple
+
+from tweets.sharding import gather_tweets
+from tweets.pagination import InvalidCursor
+
+
+# A search term: words to match in order, and whether the last one may be
+# a prefix ("dja*")
+Term = namedtuple("Term", ["words", "prefix"])
+
+TOKEN_RE = re.compile(r'"([^"]*)"?|(\S+)')
+WORD_RE = re.compile(r"\w+")
+
+
+def parse_query(text):
+    """
+    Splits a search box string into terms: "quoted phrases", prefix* words
+    and plain words, all of which must match. Operators and punctuation are
+    dropped, so user input can never form an invalid backend query.
+    """
+    terms = []
+    for phrase, word in TOKEN_RE.findall(text or ""):
+        words = WORD_RE.findall((phrase or word).lower())
+        if words:
+            prefix = not phrase and word.endswith("*")
+            terms.append(Term(tuple(words), prefix))
+    return terms
+
+
+def encode_cursor(score, pk):
+    return f"{score!r}_{pk}"
+
+
+def decode_cursor(cursor):
+    try:
+        score, pk = cursor.rsplit("_", 1)
+        return float(score), int(pk)
+    except (AttributeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+class SearchPage:
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def search_tweets(text, per_page=20, cursor=None, backend=None):
+    """
+    Returns a SearchPage of tweets matching text, best first. Pages are
+    keyset-paginated on (score, id) so later pages never rescan earlier ones.
+    """
+    from .backends import get_backend
+
+    terms = parse_query(text)
+    if not terms:
+        return SearchPage([])
+    after = decode_cursor(cursor) if cursor else None
+    rows = (backend or get_backend()).search(terms, per_page + 1, after)
+    next_cursor = encode_cursor(*rows[per_page - 1]) if len(rows) > per_page else None
+    rows = rows[:per_page]
+    tweets = gather_tweets(pk for _, pk in rows)
+    # Rows can outlive a tweet deleted while the search ran
+    return SearchPage([tweets[pk] for _, pk in rows if pk in tweets], next_cursor)
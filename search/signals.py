@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .backends import get_backend
+from tweets.models import Tweet
+
+
+# Keeps the search index in step with tweets as they are written
+@receiver(post_save, sender=Tweet)
+def index_tweet(sender, instance, raw, **kwargs):
+    if not raw:
+        get_backend().index([instance])
+
+
+@receiver(post_delete, sender=Tweet)
+def unindex_tweet(sender, instance, **kwargs):
+    get_backend().remove([instance.pk])
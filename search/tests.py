@@ -0,0 +1,155 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.shortcuts import reverse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .backends import FTS5Backend, SimpleBackend, default_backend, get_backend
+from .query import Term, parse_query, search_tweets
+from mytwitter.db import parse_database_url
+from tweets.models import Tweet
+from user.models import CustomUser
+
+
+class ParseQueryTests(TestCase):
+    def test_terms_phrases_and_prefixes(self):
+        self.assertEqual(
+            parse_query('Django "keyset pagination" tim* -- OR ('),
+            [
+                Term(("django",), False),
+                Term(("keyset", "pagination"), False),
+                Term(("tim",), True),
+                # Operator words are searched for like any other word
+                Term(("or",), False),
+            ],
+        )
+
+    def test_operators_cannot_break_the_query(self):
+        self.assertEqual(parse_query('"" * NEAR( ^'), [Term(("near",), False)])
+        self.assertEqual(parse_query(""), [])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+
+    def tweet(self, body, days_ago=0):
+        tweet = Tweet.objects.create(user=self.user, body=body)
+        if days_ago:
+            created_at = timezone.now() - datetime.timedelta(days=days_ago)
+            Tweet.objects.filter(pk=tweet.pk).update(created_at=created_at)
+        return tweet
+
+    def ids(self, text, **kwargs):
+        return [tweet.pk for tweet in search_tweets(text, **kwargs)]
+
+    def test_index_follows_saves_and_deletes(self):
+        tweet = self.tweet("hello world")
+        self.assertEqual(self.ids("hello"), [tweet.pk])
+        tweet.body = "goodbye world"
+        tweet.save()
+        self.assertEqual(self.ids("hello"), [])
+        self.assertEqual(self.ids("goodbye"), [tweet.pk])
+        tweet.delete()
+        self.assertEqual(self.ids("world"), [])
+
+    def test_phrase_and_prefix_queries(self):
+        ordered = self.tweet("keyset pagination is fast")
+        reversed_ = self.tweet("pagination by keyset")
+        self.assertCountEqual(self.ids("keyset pagination"), [ordered.pk, reversed_.pk])
+        self.assertEqual(self.ids('"keyset pagination"'), [ordered.pk])
+        self.assertCountEqual(self.ids("pagin*"), [ordered.pk, reversed_.pk])
+        self.assertEqual(self.ids("pagin"), [])
+
+    def test_ranks_by_relevance_and_recency(self):
+        relevant = self.tweet("django django django", days_ago=1)
+        passing = self.tweet("a long tweet that mentions django only once", days_ago=1)
+        old = self.tweet("django django django", days_ago=400)
+        self.assertEqual(self.ids("django"), [relevant.pk, passing.pk, old.pk])
+
+    def test_keyset_pages_cover_all_results_once(self):
+        tweets = [self.tweet(f"page test {i}", days_ago=i) for i in range(7)]
+        seen = []
+        cursor = None
+        while True:
+            page = search_tweets("page", per_page=3, cursor=cursor)
+            seen += [tweet.pk for tweet in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, [tweet.pk for tweet in tweets])
+
+    def test_rebuild_search_index(self):
+        tweet = self.tweet("rebuilt")
+        get_backend().clear()
+        self.assertEqual(self.ids("rebuilt"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.ids("rebuilt"), [tweet.pk])
+
+    def test_simple_backend(self):
+        old = self.tweet("fallback search")
+        new = self.tweet("another fallback")
+        backend = SimpleBackend()
+        self.assertEqual(
+            [t.pk for t in search_tweets("fallback", backend=backend)], [new.pk, old.pk]
+        )
+        page = search_tweets("fallback", per_page=1, backend=backend)
+        page = search_tweets(
+            "fallback", per_page=1, cursor=page.next_cursor, backend=backend
+        )
+        self.assertEqual([t.pk for t in page], [old.pk])
+
+    def test_search_view(self):
+        """
+        GET: search/?q=
+        詳細: matching tweets are listed with a cursor link to more results
+        効果: 200
+        """
+        for i in range(21):
+            self.tweet(f"needle {i}")
+        self.tweet("haystack")
+        self.client.login(username="test", password="12345")
+        url = reverse("search:search")
+        response = self.client.get(url, {"q": "needle"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["tweets"]), 20)
+        self.assertNotContains(response, "haystack")
+        cursor = response.context["page"].next_cursor
+        self.assertContains(response, "More results")
+        response = self.client.get(url, {"q": "needle", "after": cursor})
+        self.assertEqual(len(response.context["tweets"]), 1)
+        response = self.client.get(url, {"q": "needle", "after": "garbage"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(self.client.get(url, {"q": "nothing"}), "No tweets match")
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command(
+            "benchmark_search", "--tweets", "200", "--queries", "2", stdout=out
+        )
+        self.assertIn("phrase", out.getvalue())
+        self.assertFalse(Tweet.objects.exists())
+
+
+class DefaultBackendTests(SimpleTestCase):
+    def tearDown(self):
+        get_backend.cache_clear()
+
+    def test_postgres_uses_the_simple_backend(self):
+        database = parse_database_url("postgres://user:secret@db:5432/mytwitter")
+        self.assertEqual(default_backend(database), "search.backends.SimpleBackend")
+
+    def test_sqlite_uses_fts5(self):
+        database = parse_database_url("sqlite:///db.sqlite3")
+        self.assertEqual(default_backend(database), "search.backends.FTS5Backend")
+
+    @override_settings(SEARCH_BACKEND=None)
+    def test_unset_setting_follows_the_default_database(self):
+        get_backend.cache_clear()
+        self.assertIsInstance(get_backend(), FTS5Backend)
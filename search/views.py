@@ -0,0 +1,24 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views.generic import TemplateView
+
+from .query import search_tweets
+from tweets.pagination import InvalidCursor
+
+
+class SearchView(LoginRequiredMixin, TemplateView):
+    template_name = "search/results.html"
+    permission_denied_message = "Oops! Seems like you haven't signed in yet."
+    paginate_by = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get("q", "").strip()
+        cursor = self.request.GET.get("after") or None
+        try:
+            page = search_tweets(query, self.paginate_by, cursor)
+        except InvalidCursor:
+            page = search_tweets(query, self.paginate_by)
+        context["query"] = query
+        context["page"] = page
+        context["tweets"] = page.object_list
+        return context
@@ -0,0 +1,10 @@
+from django.contrib import admin
+from .models import TrendSnapshot
+
+
+class TrendSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("id", "window", "created_at")
+    list_filter = ("window",)
+
+
+admin.site.register(TrendSnapshot, TrendSnapshotAdmin)
@@ -0,0 +1,123 @@
+import datetime
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import TrendSnapshot
+from .sketch import DecayingTopK
+from tweets.entities import HASHTAG_RE, MENTION_RE, extract_hashtags
+
+
+TRENDS_DEFAULTS = {
+    # Window name -> half-life in seconds of the exponential decay
+    "WINDOWS": {"hour": 60 * 60, "day": 24 * 60 * 60},
+    # Window shown in the trending panel
+    "PANEL_WINDOW": "hour",
+    "TOP_K": 10,
+    # Candidate terms tracked per window by Space-Saving
+    "CAPACITY": 1000,
+    # Count-Min sketch dimensions
+    "WIDTH": 2048,
+    "DEPTH": 4,
+    # Seconds between snapshots, and how long snapshots are kept
+    "INTERVAL": 60,
+    "RETENTION": 24 * 60 * 60,
+    # Seconds of recent tweets run_trends scans again on every pass, for
+    # tweets committed after a newer id had already been seen
+    "LAG": 30,
+}
+
+WORD_RE = re.compile(r"[^\W\d_][\w']{2,29}")
+STOPWORDS = frozenset(
+    """
+    about after again all also and any are because been before being but can
+    could did does doing don't down for from had has have having her here hers
+    him his how into its it's just more most not now off once only other our
+    out over own same she should some such than that the their them then there
+    these they this those through too under until very was were what when
+    where which while who whom why will with would you your
+    """.split()
+)
+
+
+def trends_settings():
+    return {**TRENDS_DEFAULTS, **getattr(settings, "TRENDS", {})}
+
+
+def terms(body):
+    """
+    The distinct trend terms of a tweet: its "#tags" and its other words of
+    three or more letters, lowercased, minus stopwords and @mentions.
+    """
+    found = {f"#{tag}": None for tag in extract_hashtags(body)}
+    # Tags and mentions are not counted again as plain words
+    rest = MENTION_RE.sub(" ", HASHTAG_RE.sub(" ", body))
+    for word in WORD_RE.findall(rest.lower()):
+        if word not in STOPWORDS:
+            found.setdefault(word, None)
+    return list(found)
+
+
+class TrendTracker:
+    """One DecayingTopK per configured window, fed from tweet bodies."""
+
+    def __init__(self, options=None, now=0.0):
+        self.options = options or trends_settings()
+        self.windows = {
+            name: DecayingTopK(
+                half_life,
+                self.options["CAPACITY"],
+                self.options["WIDTH"],
+                self.options["DEPTH"],
+                now,
+            )
+            for name, half_life in self.options["WINDOWS"].items()
+        }
+
+    def observe(self, body, timestamp):
+        tweet_terms = terms(body)
+        for window in self.windows.values():
+            for term in tweet_terms:
+                window.add(term, timestamp)
+
+    def top(self, now):
+        k = self.options["TOP_K"]
+        return {name: window.top(k, now) for name, window in self.windows.items()}
+
+
+def cache_key(window):
+    return f"trends:{window}"
+
+
+def take_snapshot(tracker, now):
+    """Stores the current top terms of every window and primes the cache."""
+    options = tracker.options
+    snapshots = []
+    for window, top in tracker.top(now).items():
+        snapshot = TrendSnapshot.objects.create(
+            window=window,
+            terms=[{"term": term, "score": round(score, 3)} for term, score in top],
+        )
+        cache.set(cache_key(window), snapshot.terms, None)
+        snapshots.append(snapshot)
+    cutoff = timezone.now() - datetime.timedelta(seconds=options["RETENTION"])
+    TrendSnapshot.objects.filter(created_at__lt=cutoff).delete()
+    return snapshots
+
+
+def current_trends(window=None):
+    """
+    The latest snapshot's terms for window: a cache read, falling back to one
+    index lookup when the cache was cleared.
+    """
+    window = window or trends_settings()["PANEL_WINDOW"]
+    trends = cache.get(cache_key(window))
+    if trends is None:
+        snapshot = (
+            TrendSnapshot.objects.filter(window=window).order_by("-created_at").first()
+        )
+        trends = snapshot.terms if snapshot else []
+        cache.set(cache_key(window), trends, None)
+    return trends
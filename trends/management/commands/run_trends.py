@@ -0,0 +1,92 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from trends.engine import TrendTracker, take_snapshot, trends_settings
+from tweets import sharding
+from tweets.ids import datetime_to_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Feeds new tweets into the trending sketches and periodically "
+        "snapshots the top terms for the trending panel"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Snapshot the tweets seen so far and exit",
+        )
+        parser.add_argument(
+            "--sleep", type=float, default=1.0, help="Seconds to wait when idle"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        config = trends_settings()
+        tracker = TrendTracker(config, now=time.time())
+        self.tracker = tracker
+        self.batch_size = options["batch_size"]
+        self.lag = datetime.timedelta(seconds=config["LAG"])
+        # Ids already observed within the lag window
+        self.recent = set()
+        # Warm up from the tweets that still carry weight after a restart:
+        # four half-lives of the longest window (about 6% of the original)
+        horizon = 4 * max(config["WINDOWS"].values())
+        # Snowflake ids are time-ordered, so no created_at scan is needed
+        since = timezone.now() - datetime.timedelta(seconds=horizon)
+        self.last_pk = datetime_to_id(since) - 1
+
+        last_snapshot = 0.0
+        while True:
+            close_old_connections()
+            seen = self.consume()
+            now = time.time()
+            if options["once"] or now - last_snapshot >= config["INTERVAL"]:
+                take_snapshot(tracker, now)
+                last_snapshot = now
+                self.stdout.write(f"Snapshot taken after tweet {self.last_pk}")
+            if options["once"]:
+                break
+            if not seen:
+                time.sleep(options["sleep"])
+
+    def consume(self):
+        """
+        Observes every tweet after last_pk, and any tweet from the last LAG
+        seconds not observed yet, on every shard; returns how many were
+        seen. Ids are minted before commit, so a slow transaction's tweet
+        can appear behind ids already seen.
+        """
+        floor = datetime_to_id(timezone.now() - self.lag)
+        self.recent = {pk for pk in self.recent if pk >= floor}
+        start = min(self.last_pk, floor - 1)
+        newest = self.last_pk
+        seen = 0
+        for alias in sharding.shards():
+            cursor = start
+            while True:
+                batch = list(
+                    sharding.tweets_on(alias)
+                    .filter(pk__gt=cursor)
+                    .order_by("pk")
+                    .values_list("pk", "body", "created_at")[: self.batch_size]
+                )
+                if not batch:
+                    break
+                for pk, body, created_at in batch:
+                    if pk in self.recent:
+                        continue
+                    self.tracker.observe(body, created_at.timestamp())
+                    if pk >= floor:
+                        self.recent.add(pk)
+                    seen += 1
+                cursor = batch[-1][0]
+                newest = max(newest, cursor)
+        self.last_pk = newest
+        return seen
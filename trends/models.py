@@ -0,0 +1,18 @@
+from django.db import models
+
+
+class TrendSnapshot(models.Model):
+    """The top terms of one decay window, as computed by run_trends."""
+
+    window = models.CharField(max_length=20)
+    # [{"term": "#django", "score": 12.5}, ...] heaviest first
+    terms = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["window", "-created_at"], name="trend_window_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.window} trends at {self.created_at}"
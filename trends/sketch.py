@@ -0,0 +1,132 @@
+import hashlib
+import heapq
+from array import array
+
+
+class CountMinSketch:
+    """
+    Approximate weighted counts in width * depth floats. Estimates never
+    undercount; conservative update keeps overcounting small.
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array("d", [0.0]) * width for _ in range(depth)]
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * self.depth).digest()
+        for row in range(self.depth):
+            chunk = digest[4 * row : 4 * row + 4]
+            yield row, int.from_bytes(chunk, "little") % self.width
+
+    def add(self, key, weight=1.0):
+        cells = list(self._cells(key))
+        target = min(self.rows[row][col] for row, col in cells) + weight
+        for row, col in cells:
+            if self.rows[row][col] < target:
+                self.rows[row][col] = target
+        return target
+
+    def estimate(self, key):
+        return min(self.rows[row][col] for row, col in self._cells(key))
+
+    def scale(self, factor):
+        for row in self.rows:
+            for col in range(self.width):
+                row[col] *= factor
+
+
+class SpaceSaving:
+    """
+    Keeps the capacity heaviest keys of a weighted stream (Metwally et al.).
+    A new key evicts the lightest one and inherits its count as error, so
+    any key heavier than total / capacity is guaranteed to be present.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # (count, key) entries; stale ones are skipped lazily
+        self._heap = []
+
+    def offer(self, key, weight=1.0):
+        if key in self.counts:
+            self.counts[key] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0.0
+        else:
+            floor, evicted = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[key] = floor + weight
+            self.errors[key] = floor
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild()
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return count, key
+
+    def _rebuild(self):
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, k):
+        return heapq.nlargest(k, self.counts.items(), key=lambda item: item[1])
+
+    def scale(self, factor):
+        for key in self.counts:
+            self.counts[key] *= factor
+            self.errors[key] *= factor
+        self._rebuild()
+
+
+class DecayingTopK:
+    """
+    Top-k terms by exponentially time-decayed frequency, using forward decay:
+    an event at time t is added with weight 2 ** ((t - landmark) / half_life)
+    and scores are divided by the same factor at query time. Old events never
+    need updating, so adding stays O(depth + log capacity).
+    """
+
+    # Rescale before weights lose precision or overflow
+    MAX_EXPONENT = 500
+
+    def __init__(self, half_life, capacity=1000, width=2048, depth=4, now=0.0):
+        self.half_life = half_life
+        self.landmark = now
+        self.sketch = CountMinSketch(width, depth)
+        self.heavy = SpaceSaving(capacity)
+
+    def _exponent(self, timestamp):
+        return (timestamp - self.landmark) / self.half_life
+
+    def add(self, term, timestamp, count=1):
+        if self._exponent(timestamp) > self.MAX_EXPONENT:
+            self.rebase(timestamp)
+        weight = count * 2 ** self._exponent(timestamp)
+        self.sketch.add(term, weight)
+        self.heavy.offer(term, weight)
+
+    def rebase(self, timestamp):
+        factor = 2 ** -self._exponent(timestamp)
+        self.sketch.scale(factor)
+        self.heavy.scale(factor)
+        self.landmark = timestamp
+
+    def top(self, k, now):
+        """[(term, decayed count)] for the k heaviest terms as of now."""
+        decay = 2 ** -self._exponent(now)
+        scored = [
+            # Both structures overcount; the smaller bound is the better one
+            (term, min(count, self.sketch.estimate(term)) * decay)
+            for term, count in self.heavy.top(self.heavy.capacity)
+        ]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return [(term, score) for term, score in scored[:k] if score > 0]
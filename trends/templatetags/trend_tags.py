@@ -0,0 +1,11 @@
+from django import template
+
+from trends.engine import current_trends
+
+
+register = template.Library()
+
+
+@register.inclusion_tag("trends/panel.html")
+def trending_panel(window=None):
+    return {"trends": current_trends(window)}
@@ -0,0 +1,163 @@
+import datetime
+import random
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .engine import cache_key, current_trends, terms
+from .management.commands.run_trends import Command as RunTrends
+from .models import TrendSnapshot
+from .sketch import CountMinSketch, DecayingTopK, SpaceSaving
+from tweets.ids import datetime_to_id
+from tweets.models import Tweet, UserShard
+from user.models import CustomUser
+
+
+class SketchTests(TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+        # Zipf-like stream: term i appears about 1000 / i times
+        self.stream = [f"t{i}" for i in range(1, 500) for _ in range(max(1, 1000 // i))]
+        self.random.shuffle(self.stream)
+        self.exact = {}
+        for term in self.stream:
+            self.exact[term] = self.exact.get(term, 0) + 1
+
+    def test_count_min_never_undercounts(self):
+        sketch = CountMinSketch(width=256, depth=4)
+        for term in self.stream:
+            sketch.add(term)
+        for term, count in self.exact.items():
+            self.assertGreaterEqual(sketch.estimate(term), count)
+        # With this width the heavy hitters are nearly exact
+        self.assertLess(sketch.estimate("t1"), self.exact["t1"] * 1.05)
+
+    def test_space_saving_keeps_heavy_hitters(self):
+        heavy = SpaceSaving(capacity=50)
+        for term in self.stream:
+            heavy.offer(term)
+        self.assertEqual(len(heavy.counts), 50)
+        top = [term for term, _ in heavy.top(5)]
+        self.assertEqual(top, ["t1", "t2", "t3", "t4", "t5"])
+
+    def test_decay_prefers_recent_bursts(self):
+        topk = DecayingTopK(half_life=60, capacity=20, width=256)
+        for second in range(600):
+            topk.add("steady", second)
+        # 150 events in the last 30s beat 600 spread over ten minutes
+        for second in range(570, 600):
+            topk.add("burst", second, count=5)
+        self.assertEqual([term for term, _ in topk.top(2, 600)], ["burst", "steady"])
+        # An hour later the burst has decayed to nothing noticeable
+        self.assertLess(topk.top(2, 4200)[0][1], 0.01)
+
+    def test_rebase_keeps_scores(self):
+        topk = DecayingTopK(half_life=1, capacity=10, width=64)
+        topk.add("a", 0)
+        topk.add("a", 0)
+        topk.add("b", 0)
+        before = dict(topk.top(2, 501))
+        # Past MAX_EXPONENT half-lives, so the weights are rebased
+        topk.add("c", 501)
+        self.assertEqual(topk.landmark, 501)
+        after = dict(topk.top(3, 501))
+        self.assertAlmostEqual(after["c"], 1)
+        self.assertAlmostEqual(after["a"] / before["a"], 1, places=6)
+        self.assertAlmostEqual(after["b"] / before["b"], 1, places=6)
+
+
+class TrendsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+
+    def test_terms(self):
+        self.assertEqual(
+            terms("The #Django release is out, @test: django RELEASE notes 2022"),
+            ["#django", "release", "django", "notes"],
+        )
+
+    def test_run_trends_snapshots_and_panel(self):
+        for i in range(5):
+            Tweet.objects.create(user=self.user, body=f"#launch party number {i}")
+        Tweet.objects.create(user=self.user, body="quiet morning")
+        call_command("run_trends", "--once", stdout=StringIO())
+        self.assertEqual(TrendSnapshot.objects.count(), 2)
+        trends = current_trends("hour")
+        self.assertEqual(trends[0]["term"], "#launch")
+        self.assertEqual(trends[1]["term"], "number")
+
+        self.client.login(username="test", password="12345")
+        response = self.client.get(reverse("user:home"))
+        self.assertContains(response, "Trending")
+        self.assertContains(
+            response, reverse("tweets:hashtag", kwargs={"tag": "launch"})
+        )
+
+        # The panel survives a cache flush by reading the latest snapshot
+        cache.delete(cache_key("hour"))
+        self.assertEqual(current_trends("hour"), trends)
+
+    def test_late_commits_are_observed_once(self):
+        command = RunTrends()
+        command.tracker = mock.Mock()
+        command.batch_size = 2
+        command.lag = datetime.timedelta(seconds=30)
+        command.recent = set()
+        command.last_pk = 0
+        for i in range(3):
+            Tweet.objects.create(user=self.user, body=f"tweet {i}")
+        self.assertEqual(command.consume(), 3)
+
+        # Minted five seconds ago, committed after newer ids were consumed
+        late = datetime_to_id(timezone.now() - datetime.timedelta(seconds=5)) + 1
+        Tweet.objects.create(pk=late, user=self.user, body="late")
+        self.assertEqual(command.consume(), 1)
+        self.assertEqual(command.consume(), 0)
+        self.assertEqual(command.tracker.observe.call_count, 4)
+
+    def test_warm_up_starts_at_the_horizon_id(self):
+        old = datetime_to_id(timezone.now() - datetime.timedelta(days=30))
+        Tweet.objects.create(pk=old, user=self.user, body="#ancient history")
+        Tweet.objects.create(user=self.user, body="#fresh news")
+        call_command("run_trends", "--once", stdout=StringIO())
+        trends = [trend["term"] for trend in current_trends("hour")]
+        self.assertIn("#fresh", trends)
+        self.assertNotIn("#ancient", trends)
+
+    def test_panel_hidden_without_snapshot(self):
+        self.client.login(username="test", password="12345")
+        self.assertNotContains(self.client.get(reverse("user:home")), "Trending")
+
+
+@override_settings(TWEET_SHARDS=["default", "shard1"])
+class ShardedTrendsTests(TestCase):
+    databases = {"default", "shard1"}
+
+    def test_every_shard_is_consumed(self):
+        cache.clear()
+        for alias in ("default", "shard1"):
+            user = CustomUser.objects.create(
+                username=alias, email=f"{alias}@test.com", date_of_birth="1901-01-01"
+            )
+            UserShard.objects.create(user=user, shard=alias)
+            # save() routes by author; objects.create() would pin default
+            Tweet(user=user, body=f"tweet on {alias}").save()
+        self.assertTrue(Tweet.objects.using("shard1").exists())
+        command = RunTrends()
+        command.tracker = mock.Mock()
+        command.batch_size = 10
+        command.lag = datetime.timedelta(seconds=30)
+        command.recent = set()
+        command.last_pk = 0
+        self.assertEqual(command.consume(), 2)
+        self.assertEqual(command.consume(), 0)
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+
+from .pagination import EPOCH
+
+
+# Stands in for the per-request CSRF token inside cached card HTML. Only
+# the whole input {% csrf_token %} renders is replaced: its quotes and
+# brackets come out escaped from tweet text, so a tweet quoting the
+# placeholder is left alone.
+CSRF_PLACEHOLDER = "__tweet_card_csrf_token__"
+CSRF_INPUT = '<input type="hidden" name="csrfmiddlewaretoken" value="{}">'
+
+
+def _version(value):
+    return (value - EPOCH).total_seconds() if value else 0
+
+
+def card_cache_key(tweet, is_owner):
+    # updated_at of the tweet and its author version the key, so an edit
+    # never serves a stale card even before the old entry is evicted.
+    # Renditions are written by a background job without touching
+    # updated_at, so their state versions the key too.
+    return "tweet_card:{}:{}:{}:{:d}:{:d}".format(
+        tweet.pk,
+        _version(tweet.updated_at),
+        _version(tweet.user.updated_at),
+        tweet.image_processing,
+        is_owner,
+    )
+
+
+def render_card(tweet, viewer, csrf_token=None):
+    is_owner = viewer is not None and tweet.user_id == viewer.id
+    key = card_cache_key(tweet, is_owner)
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string(
+            "tweets/tweet_card.html",
+            {"tweet": tweet, "is_owner": is_owner, "csrf_token": CSRF_PLACEHOLDER},
+        )
+        cache.set(key, html, getattr(settings, "TWEET_CARD_CACHE_TIMEOUT", 3600))
+    return html.replace(
+        format_html(CSRF_INPUT, CSRF_PLACEHOLDER),
+        format_html(CSRF_INPUT, str(csrf_token or "")),
+    )
+
+
+def invalidate_card(tweet):
+    cache.delete_many([card_cache_key(tweet, False), card_cache_key(tweet, True)])
@@ -0,0 +1,188 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+
+from . import sharding
+
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ("likes", "retweets", "replies")
+
+BUFFER_DEFAULTS = {
+    "ENABLED": False,
+    # Seconds between flushes of buffered deltas to the database
+    "INTERVAL": 1.0,
+    # Wake the flusher early once this many tweets have pending deltas
+    "MAX_PENDING": 1000,
+    # Tweets updated per UPDATE statement
+    "BATCH_SIZE": 500,
+}
+
+
+def buffer_settings():
+    return {**BUFFER_DEFAULTS, **getattr(settings, "TWEET_COUNTER_BUFFER", {})}
+
+
+def write_deltas(deltas, batch_size):
+    """
+    Applies {tweet_id: {field: delta}} with one UPDATE per batch of tweets
+    on each shard, using CASE expressions so each row gets its own delta.
+    """
+    by_shard = defaultdict(list)
+    for tweet_id in deltas:
+        by_shard[sharding.shard_of_tweet(tweet_id)].append(tweet_id)
+    # Deltas for tweets deleted meanwhile (alias None) have nothing to update
+    by_shard.pop(None, None)
+    for alias, tweet_ids in by_shard.items():
+        for start in range(0, len(tweet_ids), batch_size):
+            _write_batch(alias, tweet_ids[start : start + batch_size], deltas)
+
+
+def _write_batch(alias, batch, deltas):
+    updates = {}
+    for field in COUNTER_FIELDS:
+        whens = [
+            When(pk=tweet_id, then=Value(deltas[tweet_id][field]))
+            for tweet_id in batch
+            if deltas[tweet_id].get(field)
+        ]
+        if whens:
+            delta = Case(*whens, default=Value(0))
+            updates[field] = Greatest(F(field) + delta, Value(0))
+    if updates:
+        sharding.tweets_on(alias).filter(pk__in=batch).update(**updates)
+
+
+class CounterBuffer:
+    """
+    Accumulates counter deltas per process and flushes them in batches, so a
+    burst of likes on one tweet becomes a single row update per interval.
+    Flushes run on a background thread, never in the request adding the
+    delta, so a slow or failing flush cannot fail a like.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = defaultdict(lambda: defaultdict(int))
+        self._last_flush = time.monotonic()
+        self._flusher = None
+        self._wake = threading.Event()
+        self.flushes = 0
+        self.flushed_deltas = 0
+        self.last_flush_seconds = None
+        self.max_flush_seconds = 0.0
+
+    def add(self, tweet_id, field, delta):
+        options = buffer_settings()
+        with self._lock:
+            self._pending[tweet_id][field] += delta
+            due = (
+                len(self._pending) >= options["MAX_PENDING"]
+                or time.monotonic() - self._last_flush >= options["INTERVAL"]
+            )
+        if due:
+            self._wake.set()
+        self._ensure_flusher(options["INTERVAL"])
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(
+                    lambda: defaultdict(int)
+                )
+                self._last_flush = time.monotonic()
+            deltas = {
+                tweet_id: {field: delta for field, delta in fields.items() if delta}
+                for tweet_id, fields in pending.items()
+            }
+            deltas = {tweet_id: fields for tweet_id, fields in deltas.items() if fields}
+            if not deltas:
+                return 0
+            started = time.perf_counter()
+            try:
+                write_deltas(deltas, buffer_settings()["BATCH_SIZE"])
+            except Exception:
+                # Put the deltas back so the next flush retries them
+                with self._lock:
+                    for tweet_id, fields in deltas.items():
+                        for field, delta in fields.items():
+                            self._pending[tweet_id][field] += delta
+                raise
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.flushed_deltas += sum(len(fields) for fields in deltas.values())
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            logger.debug(
+                "Flushed counter deltas for %d tweets in %.4fs", len(deltas), elapsed
+            )
+            return len(deltas)
+
+    def _ensure_flusher(self, interval):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        self._flusher = threading.Thread(
+            target=self._flush_forever, args=(interval,), daemon=True
+        )
+        self._flusher.start()
+
+    def _flush_forever(self, interval):
+        while True:
+            # Every interval, or sooner when add() finds a flush due
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing buffered tweet counters failed")
+            finally:
+                connection.close()
+
+    def metrics(self):
+        with self._lock:
+            pending_tweets = len(self._pending)
+            pending_deltas = sum(
+                abs(delta)
+                for fields in self._pending.values()
+                for delta in fields.values()
+            )
+        return {
+            "pending_tweets": pending_tweets,
+            "pending_deltas": pending_deltas,
+            "flushes": self.flushes,
+            "flushed_deltas": self.flushed_deltas,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+
+buffer = CounterBuffer()
+atexit.register(lambda: buffer.flush() if buffer_settings()["ENABLED"] else None)
+
+
+def increment(tweet_id, field, delta=1):
+    """Adds delta to one of a tweet's counters, buffered if configured."""
+    if field not in COUNTER_FIELDS:
+        raise ValueError(f"{field} is not a tweet counter")
+    if buffer_settings()["ENABLED"]:
+        # Deltas of a reaction whose transaction rolls back are never added
+        transaction.on_commit(lambda: buffer.add(tweet_id, field, delta))
+        return
+    tweets = sharding.tweet_queryset(tweet_id)
+    if delta < 0:
+        # Never drive a counter negative; reconcile_counters repairs any drift
+        tweets = tweets.filter(**{f"{field}__gte": -delta})
+    tweets.update(**{field: F(field) + delta})
+
+
+def decrement(tweet_id, field):
+    increment(tweet_id, field, -1)
@@ -0,0 +1,117 @@
+import re
+import unicodedata
+
+from . import sharding
+from .models import Hashtag, Mention, TweetHashtag
+from .pagination import KeysetPage, KeysetPaginator, OLDER
+from user.models import CustomUser
+
+
+# Not preceded by a word character, so "a#b" and "me@example.com" are skipped
+HASHTAG_RE = re.compile(r"(?<![\w&])#(\w{1,100})")
+# Usernames may contain . + - but a trailing "." is punctuation
+MENTION_RE = re.compile(r"(?<![\w.+-])@([\w.+-]{0,149}\w)")
+
+
+def normalize_tag(tag):
+    tag = unicodedata.normalize("NFKC", tag).casefold()
+    # Both can lengthen a tag ("ß" casefolds to "ss"); keep it storable
+    return tag[: Hashtag._meta.get_field("name").max_length]
+
+
+def extract_hashtags(body):
+    """Returns the normalized hashtags in body, in order, without repeats."""
+    tags = {}
+    for match in HASHTAG_RE.finditer(body):
+        tag = normalize_tag(match.group(1))
+        # "#1" is a number, not a tag
+        if not tag.isdigit():
+            tags.setdefault(tag, None)
+    return list(tags)
+
+
+def extract_mentions(body):
+    return list(dict.fromkeys(match.group(1) for match in MENTION_RE.finditer(body)))
+
+
+def index_entities(tweets):
+    """
+    Replaces the TweetHashtag and Mention rows of tweets with those parsed
+    from their current bodies. Mentions of unknown usernames are ignored.
+    """
+    tweets = list(tweets)
+    tweet_ids = [tweet.pk for tweet in tweets]
+    TweetHashtag.objects.filter(tweet_id__in=tweet_ids).delete()
+    Mention.objects.filter(tweet_id__in=tweet_ids).delete()
+
+    tags = {tweet.pk: extract_hashtags(tweet.body) for tweet in tweets}
+    mentions = {tweet.pk: extract_mentions(tweet.body) for tweet in tweets}
+    names = {tag for found in tags.values() for tag in found}
+    usernames = {name for found in mentions.values() for name in found}
+
+    if names:
+        Hashtag.objects.bulk_create(
+            [Hashtag(name=name) for name in names], ignore_conflicts=True
+        )
+        hashtag_ids = dict(
+            Hashtag.objects.filter(name__in=names).values_list("name", "id")
+        )
+        TweetHashtag.objects.bulk_create(
+            [
+                TweetHashtag(
+                    hashtag_id=hashtag_ids[name],
+                    tweet_id=tweet.pk,
+                    created_at=tweet.created_at,
+                )
+                for tweet in tweets
+                for name in tags[tweet.pk]
+            ],
+            ignore_conflicts=True,
+        )
+    if usernames:
+        user_ids = dict(
+            CustomUser.objects.filter(username__in=usernames).values_list(
+                "username", "id"
+            )
+        )
+        Mention.objects.bulk_create(
+            [
+                Mention(
+                    user_id=user_ids[name],
+                    tweet_id=tweet.pk,
+                    created_at=tweet.created_at,
+                )
+                for tweet in tweets
+                for name in mentions[tweet.pk]
+                if name in user_ids
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def _entity_timeline(entries, per_page, cursor, direction):
+    # Seek on the entry index, then build cursors from the tweets themselves
+    entry_paginator = KeysetPaginator(per_page, pk_field="tweet_id")
+    if sharding.is_sharded():
+        entries = entry_paginator.fetch(entries, cursor, direction)
+        tweets = sharding.gather_tweets(entry.tweet_id for entry in entries)
+        rows = [tweets[entry.tweet_id] for entry in entries if entry.tweet_id in tweets]
+    else:
+        entries = entries.select_related("tweet__user")
+        rows = [
+            entry.tweet for entry in entry_paginator.fetch(entries, cursor, direction)
+        ]
+    return KeysetPaginator(per_page).build_page(rows, cursor, direction)
+
+
+def hashtag_timeline(name, per_page, cursor=None, direction=OLDER):
+    hashtag = Hashtag.objects.filter(name=normalize_tag(name)).first()
+    if hashtag is None:
+        return KeysetPage([])
+    entries = TweetHashtag.objects.filter(hashtag=hashtag)
+    return _entity_timeline(entries, per_page, cursor, direction)
+
+
+def mention_timeline(user, per_page, cursor=None, direction=OLDER):
+    entries = Mention.objects.filter(user=user)
+    return _entity_timeline(entries, per_page, cursor, direction)
@@ -0,0 +1,83 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+from .models import Tweet
+
+
+def rendition_widths():
+    return getattr(settings, "TWEET_IMAGE_WIDTHS", (320, 640, 1280))
+
+
+def rendition_formats():
+    # WebP needs Pillow built against libwebp; JPEG is always produced
+    if features.check("webp"):
+        return ("jpeg", "webp")
+    return ("jpeg",)
+
+
+SAVE_OPTIONS = {
+    "jpeg": {"format": "JPEG", "quality": 80, "optimize": True, "progressive": True},
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+}
+EXTENSIONS = {"jpeg": "jpg", "webp": "webp"}
+
+
+def encode(image, fmt):
+    # Pixels only: no exif/icc/xmp arguments means no metadata is written
+    if fmt == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    elif fmt == "webp" and image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    buffer = BytesIO()
+    image.save(buffer, **SAVE_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+def make_renditions(field_file, widths=None):
+    """
+    Writes resized, re-encoded, metadata-free copies of an uploaded image
+    next to the original and returns a list of
+    {"width": ..., "jpeg": name, "webp": name} dicts, narrowest first.
+    """
+    storage = field_file.storage
+    with field_file.open("rb") as f:
+        original = Image.open(f)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+    base, _ = os.path.splitext(field_file.name)
+
+    renditions = []
+    for width in sorted(widths or rendition_widths()):
+        # Never upscale; the widest rendition is capped at the original size
+        width = min(width, original.width)
+        if renditions and renditions[-1]["width"] == width:
+            break
+        image = original.copy()
+        image.thumbnail((width, original.height))
+        rendition = {"width": image.width}
+        for fmt in rendition_formats():
+            name = f"{base}_{width}w.{EXTENSIONS[fmt]}"
+            rendition[fmt] = storage.save(name, ContentFile(encode(image, fmt)))
+        renditions.append(rendition)
+    return renditions
+
+
+def delete_renditions(storage, renditions):
+    for rendition in renditions:
+        for fmt in EXTENSIONS:
+            if rendition.get(fmt):
+                storage.delete(rendition[fmt])
+
+
+def process_tweet_image(tweet):
+    """(Re)builds a tweet's renditions without touching updated_at."""
+    old = tweet.renditions
+    tweet.renditions = make_renditions(tweet.image) if tweet.image else []
+    Tweet.objects.using(tweet._state.db).filter(pk=tweet.pk).update(
+        renditions=tweet.renditions
+    )
+    delete_renditions(tweet.image.storage, old)
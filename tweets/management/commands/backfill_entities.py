@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets.entities import index_entities
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "Indexes the hashtags and mentions of existing tweets"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--start-after",
+            type=int,
+            default=0,
+            help="Resume from this tweet id",
+        )
+
+    def handle(self, *args, **options):
+        tweets = Tweet.objects.order_by("pk").only("pk", "body", "created_at")
+        last_pk = options["start_after"]
+        count = 0
+        while True:
+            batch = list(tweets.filter(pk__gt=last_pk)[: options["batch_size"]])
+            if not batch:
+                break
+            # Each batch commits on its own, so an interrupted run can resume
+            with transaction.atomic():
+                index_entities(batch)
+            last_pk = batch[-1].pk
+            count += len(batch)
+            self.stdout.write(f"Indexed up to tweet {last_pk}")
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} tweets"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from tweets import timeline
+from user.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Rebuilds materialized home timelines from the follow graph"
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_ids", nargs="*", type=int)
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.order_by("pk")
+        if options["user_ids"]:
+            users = users.filter(pk__in=options["user_ids"])
+        count = 0
+        for user in users.iterator():
+            timeline.rebuild(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} timelines"))
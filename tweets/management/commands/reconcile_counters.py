@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from tweets.models import Like, Retweet, Tweet
+
+
+def count_of(queryset, field):
+    counts = (
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+class Command(BaseCommand):
+    help = "Recomputes tweet like/retweet/reply counters from their relations"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        annotated = Tweet.objects.order_by("pk").annotate(
+            actual_likes=count_of(Like.objects, "tweet"),
+            actual_retweets=count_of(Retweet.objects, "tweet"),
+            actual_replies=count_of(Tweet.objects, "reply_to"),
+        )
+        last_pk = 0
+        fixed = 0
+        while True:
+            batch = list(
+                annotated.filter(pk__gt=last_pk).values(
+                    "pk",
+                    "likes",
+                    "retweets",
+                    "replies",
+                    "actual_likes",
+                    "actual_retweets",
+                    "actual_replies",
+                )[: options["batch_size"]]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1]["pk"]
+            for row in batch:
+                for field in ("likes", "retweets", "replies"):
+                    actual = row[f"actual_{field}"]
+                    if row[field] == actual:
+                        continue
+                    # Compare-and-set so a concurrent increment is not overwritten
+                    fixed += Tweet.objects.filter(
+                        pk=row["pk"], **{field: row[field]}
+                    ).update(**{field: actual})
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} counters"))
@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand
+
+from tweets import sharding
+from tweets.models import Tweet, UserShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves users whose tweets are not on the shard the hash ring picks for "
+        "them. Run with --pin before adding a shard so that users who already "
+        "have tweets stay put until they are moved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_ids", nargs="*", type=int)
+        parser.add_argument(
+            "--pin",
+            action="store_true",
+            help="Record the current shard of every user with tweets and exit",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--group-size",
+            type=int,
+            default=100,
+            help="Users switched together, sharing one --settle wait",
+        )
+        parser.add_argument(
+            "--settle",
+            type=float,
+            default=None,
+            help="Seconds to wait for cached placements to expire after a "
+            "switch (default: TWEET_SHARD_CACHE_TIMEOUT)",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["pin"]:
+            self.pin(options["batch_size"])
+            return
+
+        ring = sharding.ring()
+        placements = UserShard.objects.order_by("pk")
+        if options["user_ids"]:
+            placements = placements.filter(pk__in=options["user_ids"])
+        users = tweets = 0
+        moves = {}
+        for placement in placements.iterator():
+            target = ring.shard_for(placement.user_id)
+            if target == placement.shard:
+                continue
+            self.stdout.write(f"{placement.user_id}: {placement.shard} -> {target}")
+            users += 1
+            moves[placement.user_id] = target
+            if len(moves) >= options["group_size"]:
+                tweets += self.move(moves, options)
+                moves = {}
+        tweets += self.move(moves, options)
+        verb = "Would move" if options["dry_run"] else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {users} users ({tweets} tweets)"))
+
+    def move(self, moves, options):
+        if options["dry_run"] or not moves:
+            return 0
+        return sharding.move_users(
+            moves, batch_size=options["batch_size"], settle=options["settle"]
+        )
+
+    def pin(self, batch_size):
+        placed = set(UserShard.objects.values_list("pk", flat=True))
+        count = 0
+        for alias in sharding.shards():
+            user_ids = (
+                Tweet.objects.using(alias)
+                .order_by("user_id")
+                .values_list("user_id", flat=True)
+                .distinct()
+            )
+            new = [
+                UserShard(user_id=user_id, shard=alias)
+                for user_id in user_ids
+                if user_id not in placed
+            ]
+            UserShard.objects.bulk_create(
+                new, batch_size=batch_size, ignore_conflicts=True
+            )
+            placed.update(placement.user_id for placement in new)
+            count += len(new)
+        self.stdout.write(self.style.SUCCESS(f"Pinned {count} users"))
@@ -0,0 +1,25 @@
+# Generated by Django 4.0.1 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0003_timelineentry_timelineentry_timeline_owner_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='tweet',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='tweet_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['-created_at', '-id'], name='tweet_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.1 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0005_tweet_counters_like_retweet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='renditions',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
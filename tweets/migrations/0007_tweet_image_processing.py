@@ -0,0 +1,18 @@
+# Generated by Django 4.0.1 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0006_tweet_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='image_processing',
+            field=models.BooleanField(default=False),
+        ),
+    ]
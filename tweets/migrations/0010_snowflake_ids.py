@@ -0,0 +1,59 @@
+# Generated by Django 4.0.1 on 2026-10-18 18:24
+
+from django.db import migrations, models
+import tweets.ids
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0009_tweet_shards'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='tweet',
+            options={'ordering': ['-id']},
+        ),
+        migrations.RemoveIndex(
+            model_name='mention',
+            name='mention_user_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='timelineentry',
+            name='timeline_owner_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tweet',
+            name='tweet_user_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tweet',
+            name='tweet_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tweethashtag',
+            name='tweet_hashtag_idx',
+        ),
+        migrations.AlterField(
+            model_name='tweet',
+            name='id',
+            field=tweets.ids.SnowflakeField(primary_key=True, serialize=False),
+        ),
+        migrations.AddIndex(
+            model_name='mention',
+            index=models.Index(fields=['user', '-tweet'], name='mention_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['owner', '-tweet'], name='timeline_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['user', '-id'], name='tweet_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweethashtag',
+            index=models.Index(fields=['hashtag', '-tweet'], name='tweet_hashtag_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.1 on 2026-10-18 18:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0010_snowflake_ids'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='usershard',
+            name='moving_to',
+        ),
+    ]
@@ -1,21 +1,197 @@
 from django.db import models
 
+from .ids import SnowflakeField, SnowflakeQuerySet
 
+
+# ContentAddressedStorage keeps only the extension of this name
 def directory_path(instance, filename):
     return f"tweets/images/user_{instance.user.id}/{filename}"
 
 
 class Tweet(models.Model):
+    # Time-ordered and minted in Python, so it is unique across shards and
+    # timelines can sort and paginate on it alone
+    id = SnowflakeField()
+    # Tweets may live on a different shard (see tweets.sharding) from the
+    # users table and from the rows below that point at them, so none of
+    # these foreign keys are enforced by the database
     user = models.ForeignKey(
-        "user.CustomUser", on_delete=models.CASCADE, blank=True, related_name="tweets"
+        "user.CustomUser",
+        on_delete=models.CASCADE,
+        blank=True,
+        related_name="tweets",
+        db_constraint=False,
     )
     body = models.TextField(max_length=280)
     image = models.ImageField(blank=True, null=True, upload_to=directory_path)
+    # Resized copies of image written by tweets.images, narrowest first
+    renditions = models.JSONField(default=list, blank=True)
+    # Set while the renditions are being generated by a background job
+    image_processing = models.BooleanField(default=False)
+    reply_to = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="reply_set",
+        db_constraint=False,
+    )
+    # Denormalized counters, kept in step with Like/Retweet/reply rows by
+    # tweets.counters and repaired by the reconcile_counters command
+    likes = models.PositiveIntegerField(default=0)
+    retweets = models.PositiveIntegerField(default=0)
+    replies = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = SnowflakeQuerySet.as_manager()
+
     class Meta:
-        ordering = ["-created_at"]
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["user", "-id"], name="tweet_user_idx"),
+        ]
 
     def __str__(self):
         return str(self.id)
+
+    def _srcset(self, fmt):
+        storage = self.image.storage
+        return ", ".join(
+            f"{storage.url(rendition[fmt])} {rendition['width']}w"
+            for rendition in self.renditions
+            if rendition.get(fmt)
+        )
+
+    @property
+    def jpeg_srcset(self):
+        return self._srcset("jpeg")
+
+    @property
+    def webp_srcset(self):
+        return self._srcset("webp")
+
+    @property
+    def image_src(self):
+        # Fall back to a mid-sized rendition rather than the full upload
+        if len(self.renditions) > 1:
+            return self.image.storage.url(self.renditions[1]["jpeg"])
+        if self.renditions:
+            return self.image.storage.url(self.renditions[0]["jpeg"])
+        return self.image.url
+
+
+class Like(models.Model):
+    user = models.ForeignKey("user.CustomUser", on_delete=models.CASCADE)
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, db_constraint=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tweet", "user"], name="unique_like"),
+        ]
+
+
+class Retweet(models.Model):
+    user = models.ForeignKey("user.CustomUser", on_delete=models.CASCADE)
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, db_constraint=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tweet", "user"], name="unique_retweet"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """
+    A tweet materialized into one user's home timeline at write time.
+    Tweet ids are time-ordered, so a timeline page is a range scan over
+    (owner, tweet) without touching tweets_tweet.
+    """
+
+    owner = models.ForeignKey(
+        "user.CustomUser", on_delete=models.CASCADE, related_name="+"
+    )
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, related_name="+", db_constraint=False
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "tweet"], name="unique_timeline_entry"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "-tweet"], name="timeline_owner_idx"),
+        ]
+
+
+class Hashtag(models.Model):
+    # Normalized by tweets.entities.normalize_tag: NFKC and casefolded
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return f"#{self.name}"
+
+
+class TweetHashtag(models.Model):
+    """
+    A hashtag used in a tweet. A tag timeline is a range scan over
+    (hashtag, tweet), as tweet ids are time-ordered.
+    """
+
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="+")
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, related_name="+", db_constraint=False
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tweet", "hashtag"], name="unique_tweet_hashtag"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["hashtag", "-tweet"], name="tweet_hashtag_idx"),
+        ]
+
+
+class Mention(models.Model):
+    """A user @mentioned in a tweet, indexed like TweetHashtag."""
+
+    user = models.ForeignKey(
+        "user.CustomUser", on_delete=models.CASCADE, related_name="+"
+    )
+    tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, related_name="+", db_constraint=False
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tweet", "user"], name="unique_mention"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-tweet"], name="mention_user_idx"),
+        ]
+
+
+class UserShard(models.Model):
+    """
+    Where a user's tweets live. Recorded on a user's first write so that
+    changing TWEET_SHARDS never silently moves anyone; reshard_tweets moves
+    users to the shard the hash ring now picks for them.
+    """
+
+    user = models.OneToOneField(
+        "user.CustomUser", on_delete=models.CASCADE, primary_key=True, related_name="+"
+    )
+    shard = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.shard}"
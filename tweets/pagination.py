@@ -0,0 +1,177 @@
+import datetime
+
+from django.db.models import Q
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+OLDER = "older"
+NEWER = "newer"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    micros = (created_at - EPOCH) // datetime.timedelta(microseconds=1)
+    return f"{micros}_{pk}"
+
+
+def decode_cursor(cursor):
+    try:
+        micros, pk = cursor.split("_")
+        created_at = EPOCH + datetime.timedelta(microseconds=int(micros))
+        return created_at, int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        raise InvalidCursor(cursor)
+
+
+class KeysetPage:
+    def __init__(self, object_list, older_cursor=None, newer_cursor=None):
+        self.object_list = object_list
+        self.older_cursor = older_cursor
+        self.newer_cursor = newer_cursor
+
+    @property
+    def has_older(self):
+        return self.older_cursor is not None
+
+    @property
+    def has_newer(self):
+        return self.newer_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginates newest-first by seeking past a cursor instead of using OFFSET,
+    so every page costs one bounded index range scan. Rows are ordered by a
+    time-ordered pk (see tweets.ids) alone, or by (created_field, pk) for
+    tables whose ids do not follow time.
+    """
+
+    def __init__(self, per_page, created_field=None, pk_field="id"):
+        self.per_page = per_page
+        self.created_field = created_field
+        self.pk_field = pk_field
+
+    def key(self, obj):
+        if self.created_field is None:
+            return (getattr(obj, self.pk_field),)
+        return getattr(obj, self.created_field), getattr(obj, self.pk_field)
+
+    def encode(self, obj):
+        if self.created_field is None:
+            return str(getattr(obj, self.pk_field))
+        return encode_cursor(*self.key(obj))
+
+    def seek(self, queryset, cursor, direction):
+        created, pk = self.created_field, self.pk_field
+        if created is None:
+            try:
+                cursor_pk = int(cursor)
+            except ValueError:
+                raise InvalidCursor(cursor)
+            lookup = "gt" if direction == NEWER else "lt"
+            return queryset.filter(**{f"{pk}__{lookup}": cursor_pk})
+        created_at, cursor_pk = decode_cursor(cursor)
+        # The redundant outer bound on created_at lets the database seek
+        # straight into the index rather than scanning the OR branches.
+        if direction == NEWER:
+            return queryset.filter(
+                Q(**{f"{created}__gte": created_at})
+                & (Q(**{f"{created}__gt": created_at}) | Q(**{f"{pk}__gt": cursor_pk}))
+            )
+        return queryset.filter(
+            Q(**{f"{created}__lte": created_at})
+            & (Q(**{f"{created}__lt": created_at}) | Q(**{f"{pk}__lt": cursor_pk}))
+        )
+
+    def fetch(self, queryset, cursor=None, direction=OLDER):
+        """
+        Returns up to per_page + 1 rows beyond the cursor, newest first.
+        The extra row only tells the caller whether another page exists.
+        """
+        fields = [self.pk_field]
+        if self.created_field is not None:
+            fields.insert(0, self.created_field)
+        if direction == NEWER:
+            ordering = fields
+        else:
+            ordering = [f"-{field}" for field in fields]
+        if cursor is not None:
+            queryset = self.seek(queryset, cursor, direction)
+        rows = list(queryset.order_by(*ordering)[: self.per_page + 1])
+        if direction == NEWER:
+            rows.reverse()
+        return rows
+
+    def build_page(self, rows, cursor=None, direction=OLDER):
+        """Turns rows from fetch() (newest first) into a KeysetPage."""
+        has_more = len(rows) > self.per_page
+        if direction == NEWER:
+            rows = rows[-self.per_page :] if has_more else rows
+            has_older, has_newer = cursor is not None, has_more
+        else:
+            rows = rows[: self.per_page]
+            has_older, has_newer = has_more, cursor is not None
+        older_cursor = newer_cursor = None
+        if rows and has_older:
+            older_cursor = self.encode(rows[-1])
+        if rows and has_newer:
+            newer_cursor = self.encode(rows[0])
+        return KeysetPage(rows, older_cursor, newer_cursor)
+
+    def paginate(self, queryset, cursor=None, direction=OLDER):
+        rows = self.fetch(queryset, cursor, direction)
+        return self.build_page(rows, cursor, direction)
+
+
+class KeysetPaginationMixin:
+    """
+    View mixin paginating by the ?older=<cursor> / ?newer=<cursor> parameters.
+    """
+
+    paginate_by = 20
+    keyset_created_field = None
+    keyset_pk_field = "id"
+
+    def get_keyset_paginator(self):
+        return KeysetPaginator(
+            self.paginate_by, self.keyset_created_field, self.keyset_pk_field
+        )
+
+    def get_cursor(self):
+        if self.request.GET.get(NEWER):
+            return self.request.GET[NEWER], NEWER
+        return self.request.GET.get(OLDER) or None, OLDER
+
+    def get_keyset_page(self, queryset, cursor, direction):
+        return self.get_keyset_paginator().paginate(queryset, cursor, direction)
+
+    def paginate_keyset(self, queryset):
+        cursor, direction = self.get_cursor()
+        try:
+            return self.get_keyset_page(queryset, cursor, direction)
+        except InvalidCursor:
+            return self.get_keyset_page(queryset, None, OLDER)
+
+
+class KeysetListMixin(KeysetPaginationMixin):
+    """ListView mixin rendering object_list as one keyset page."""
+
+    def get_context_data(self, **kwargs):
+        page = self.paginate_keyset(self.object_list)
+        kwargs.setdefault("page", page)
+        kwargs.setdefault("object_list", page.object_list)
+        return super().get_context_data(**kwargs)
+
+    def get_paginate_by(self, queryset):
+        # Pagination is done by paginate_keyset(), not MultipleObjectMixin.
+        return None
@@ -0,0 +1,391 @@
+import bisect
+import functools
+import hashlib
+import heapq
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import signals
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.utils import timezone
+
+from .models import Tweet, UserShard
+from .pagination import NEWER, OLDER
+from user.models import CustomUser
+
+
+def shards():
+    """Database aliases holding tweets, from TWEET_SHARDS."""
+    return list(getattr(settings, "TWEET_SHARDS", [DEFAULT_DB_ALIAS]))
+
+
+def is_sharded():
+    return len(shards()) > 1
+
+
+def placement_cache_timeout():
+    return getattr(settings, "TWEET_SHARD_CACHE_TIMEOUT", 60)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+class ShardMap:
+    """
+    Consistent-hash ring over shard aliases. Each alias owns vnodes points
+    on the ring, so adding a shard to N others only claims about 1/(N + 1)
+    of the users, all of them taken from the existing shards evenly.
+    """
+
+    def __init__(self, aliases, vnodes=64):
+        points = sorted(
+            (_hash(f"{alias}#{i}"), alias) for alias in aliases for i in range(vnodes)
+        )
+        self._points = [point for point, _ in points]
+        self._aliases = [alias for _, alias in points]
+
+    def shard_for(self, user_id):
+        i = bisect.bisect(self._points, _hash(f"user:{user_id}"))
+        return self._aliases[i % len(self._points)]
+
+
+@functools.lru_cache(maxsize=8)
+def _ring(aliases, vnodes):
+    return ShardMap(aliases, vnodes)
+
+
+def ring():
+    return _ring(tuple(shards()), getattr(settings, "TWEET_SHARD_VNODES", 64))
+
+
+def _cache_key(user_id):
+    return f"tweets:shard:{user_id}"
+
+
+def shard_for_user(user_id):
+    """Alias of the shard holding user_id's tweets."""
+    aliases = shards()
+    if len(aliases) == 1:
+        return aliases[0]
+    alias = cache.get(_cache_key(user_id))
+    if alias is None:
+        placement = UserShard.objects.filter(user_id=user_id)
+        alias = placement.values_list("shard", flat=True).first()
+        alias = alias or ring().shard_for(user_id)
+        cache.set(_cache_key(user_id), alias, placement_cache_timeout())
+    return alias
+
+
+def place_user(user_id):
+    """
+    Like shard_for_user(), but records the placement of a user writing for
+    the first time, so later changes to the ring leave them where they are.
+    """
+    aliases = shards()
+    if len(aliases) == 1:
+        return aliases[0]
+    alias = cache.get(_cache_key(user_id))
+    if alias is None:
+        placement, _ = UserShard.objects.get_or_create(
+            user_id=user_id, defaults={"shard": ring().shard_for(user_id)}
+        )
+        alias = placement.shard
+        cache.set(_cache_key(user_id), alias, placement_cache_timeout())
+    return alias
+
+
+def tweets_on(alias):
+    # Unsharded querysets are left to the other routers (replicas)
+    if is_sharded():
+        return Tweet.objects.using(alias)
+    return Tweet.objects.all()
+
+
+def user_tweets(user):
+    """The user's tweets, read from the shard that owns them."""
+    return tweets_on(shard_for_user(user.pk)).filter(user=user)
+
+
+def group_by_shard(user_ids):
+    """{alias: [user_id, ...]} for the shards owning user_ids."""
+    groups = defaultdict(list)
+    for user_id in user_ids:
+        groups[shard_for_user(user_id)].append(user_id)
+    return dict(groups)
+
+
+def attach_users(tweets):
+    """
+    Sets tweet.user from one query on default, in place of the
+    select_related("user") join that cannot cross databases. Returns the
+    tweets whose author still exists: one deleted meanwhile leaves tweets
+    on the other shards until delete_user_tweets() gets to them.
+    """
+    users = CustomUser.objects.in_bulk({tweet.user_id for tweet in tweets})
+    found = []
+    for tweet in tweets:
+        if tweet.user_id in users:
+            tweet.user = users[tweet.user_id]
+            found.append(tweet)
+    return found
+
+
+def gather_tweets(ids):
+    """{id: tweet} for tweets on any shard, with users attached."""
+    ids = list(ids)
+    if not is_sharded():
+        return Tweet.objects.select_related("user").in_bulk(ids)
+    tweets = {}
+    for alias in shards():
+        tweets.update(Tweet.objects.using(alias).in_bulk(ids))
+    return {tweet.pk: tweet for tweet in attach_users(tweets.values())}
+
+
+def _author_key(tweet_id):
+    return f"tweets:author:{tweet_id}"
+
+
+def author_of(tweet_id):
+    """
+    user_id of the tweet on any shard, or None. A tweet never changes
+    author, so the answer is cached for good and later lookups skip the
+    probing.
+    """
+    user_id = cache.get(_author_key(tweet_id))
+    if user_id is None:
+        for alias in shards():
+            tweets = Tweet.objects.using(alias).filter(pk=tweet_id)
+            user_id = tweets.values_list("user_id", flat=True).first()
+            if user_id is not None:
+                cache.set(_author_key(tweet_id), user_id, None)
+                break
+    return user_id
+
+
+def shard_of_tweet(tweet_id):
+    """Alias of the shard holding tweet_id, or None if no shard has it."""
+    if not is_sharded():
+        return shards()[0]
+    user_id = author_of(tweet_id)
+    return None if user_id is None else shard_for_user(user_id)
+
+
+def tweet_queryset(tweet_id):
+    """A queryset of the one tweet, on the shard holding it."""
+    alias = shard_of_tweet(tweet_id)
+    if alias is None:
+        return Tweet.objects.none()
+    return tweets_on(alias).filter(pk=tweet_id)
+
+
+def find_tweet(pk):
+    """The tweet with its user attached, or None."""
+    if not is_sharded():
+        return Tweet.objects.select_related("user").filter(pk=pk).first()
+    tweet = tweet_queryset(pk).first()
+    if tweet is not None and not attach_users([tweet]):
+        return None
+    return tweet
+
+
+def delete_tweet(tweet):
+    """
+    tweet.delete() for a tweet on any shard. Django cascades on the
+    tweet's own database only, but likes, timeline entries and the other
+    rows pointing at it live on default and replies on every shard, so the
+    cascade is done here one database at a time.
+    """
+    if not is_sharded():
+        tweet.delete()
+        return
+    alias = tweet._state.db or shard_for_user(tweet.user_id)
+    signals.pre_delete.send(sender=Tweet, instance=tweet, using=alias)
+    _delete(alias, tweet.user_id, [tweet.pk])
+    for relation in get_candidate_relations_to_delete(Tweet._meta):
+        if relation.related_model is Tweet:
+            # reply_to is SET_NULL
+            for shard in shards():
+                Tweet.objects.using(shard).filter(reply_to_id=tweet.pk).update(
+                    reply_to=None
+                )
+            continue
+        dependants = relation.related_model._base_manager.using(DEFAULT_DB_ALIAS)
+        dependants.filter(**{relation.field.name: tweet.pk}).delete()
+    signals.post_delete.send(sender=Tweet, instance=tweet, using=alias)
+
+
+def delete_user_tweets(user_id):
+    """
+    Deletes a user's tweets from the shards other than default, where
+    deleting the user cascades by itself, and forgets their placement.
+    """
+    if not is_sharded():
+        return
+    for alias in shards():
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        for tweet in Tweet.objects.using(alias).filter(user_id=user_id).iterator():
+            delete_tweet(tweet)
+    UserShard.objects.filter(user_id=user_id).delete()
+    cache.delete(_cache_key(user_id))
+
+
+def scatter_gather(paginator, querysets, cursor=None, direction=OLDER):
+    """
+    Runs the same keyset fetch against each queryset (usually one per shard)
+    and merges the results newest first. Every shard returns at most
+    per_page + 1 rows, so the merge never holds more than
+    shards * (per_page + 1) of them.
+    """
+    runs = [paginator.fetch(queryset, cursor, direction) for queryset in querysets]
+    rows = list(heapq.merge(*runs, key=paginator.key, reverse=True))
+    if direction == NEWER:
+        return rows[-(paginator.per_page + 1) :]
+    return rows[: paginator.per_page + 1]
+
+
+class ShardRouter:
+    """
+    Sends a Tweet to its author's shard when Django passes the instance as
+    a hint: saves, deletes and refresh_from_db(). Querysets cannot be routed
+    by their filters, so views choose the shard with user_tweets() or
+    tweets_on(). Shards other than default only get the tweets_tweet table,
+    so other models reached from a tweet are read from default.
+    """
+
+    def _shard(self, model, hints, place):
+        instance = hints.get("instance")
+        if not isinstance(instance, Tweet) or not is_sharded():
+            return None
+        if model is not Tweet:
+            # tweet.user, tweet.like_set and so on: those rows are on default,
+            # not on the shard Django would otherwise take from the tweet
+            return DEFAULT_DB_ALIAS
+        if instance.user_id is None:
+            return None
+        return (
+            place_user(instance.user_id) if place else shard_for_user(instance.user_id)
+        )
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints, place=False)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints, place=True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in shards():
+            return None
+        return app_label == "tweets" and model_name == "tweet"
+
+
+def _copy_fields():
+    return [f.attname for f in Tweet._meta.concrete_fields if not f.primary_key]
+
+
+def _upsert(tweets, alias):
+    # Only newer versions win, so an edit made on the target since the
+    # switch is not overwritten by a stale one from the source
+    fields = _copy_fields()
+    for tweet in tweets:
+        existing = Tweet.objects.using(alias).filter(pk=tweet.pk)
+        values = {name: getattr(tweet, name) for name in fields}
+        if existing.filter(updated_at__lt=tweet.updated_at).update(**values):
+            continue
+        if not existing.exists():
+            Tweet.objects.using(alias).bulk_create([tweet], ignore_conflicts=True)
+
+
+def _delete(alias, user_id, pks):
+    # A raw DELETE: Django's cascade would also remove likes, timeline
+    # entries and so on where the source shard is default, but those rows
+    # still belong to the tweets, which now live on the target shard
+    placeholders = ", ".join(["%s"] * len(pks))
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {Tweet._meta.db_table} "
+            f"WHERE user_id = %s AND id IN ({placeholders})",
+            [user_id, *pks],
+        )
+
+
+def _batches(pks, batch_size):
+    pks = list(pks)
+    for start in range(0, len(pks), batch_size):
+        yield pks[start : start + batch_size]
+
+
+def _copy(user_id, source, target, batch_size):
+    """Copies the user's tweets in keyset batches; returns the copied pks."""
+    source_tweets = Tweet.objects.using(source).filter(user_id=user_id)
+    copied = set()
+    last_pk = 0
+    while True:
+        batch = list(source_tweets.filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+        if not batch:
+            break
+        Tweet.objects.using(target).bulk_create(batch, ignore_conflicts=True)
+        copied.update(tweet.pk for tweet in batch)
+        last_pk = batch[-1].pk
+    return copied
+
+
+def _finish(user_id, source, target, copied, started, batch_size):
+    """Replays what happened on source during the move; returns tweets moved."""
+    source_tweets = Tweet.objects.using(source).filter(user_id=user_id)
+    _upsert(source_tweets.filter(updated_at__gte=started).iterator(), target)
+    remaining = set(source_tweets.values_list("pk", flat=True))
+    # Copied, then deleted on the source before the switch took effect
+    for batch in _batches(copied - remaining, batch_size):
+        _delete(target, user_id, batch)
+    for batch in _batches(sorted(remaining), batch_size):
+        _delete(source, user_id, batch)
+    return len(remaining)
+
+
+def move_users(moves, batch_size=500, settle=None):
+    """
+    Moves each user in {user_id: target} to their target shard while they
+    keep tweeting: copy their tweets, switch all the placements so new
+    writes go to the targets, wait once for other processes' cached
+    placements to expire, then replay the inserts, edits and deletes made
+    on the sources meanwhile and delete the sources' copies. Returns the
+    number of tweets moved.
+    """
+    sources = dict(
+        UserShard.objects.filter(pk__in=list(moves)).values_list("pk", "shard")
+    )
+    moves = {
+        user_id: target
+        for user_id, target in moves.items()
+        if sources.get(user_id, target) != target
+    }
+    if not moves:
+        return 0
+    started = timezone.now()
+    copied = {
+        user_id: _copy(user_id, sources[user_id], target, batch_size)
+        for user_id, target in moves.items()
+    }
+
+    for target in set(moves.values()):
+        user_ids = [user_id for user_id, alias in moves.items() if alias == target]
+        UserShard.objects.filter(pk__in=user_ids).update(shard=target)
+    cache.delete_many([_cache_key(user_id) for user_id in moves])
+    time.sleep(placement_cache_timeout() if settle is None else settle)
+
+    return sum(
+        _finish(user_id, sources[user_id], target, copied[user_id], started, batch_size)
+        for user_id, target in moves.items()
+    )
+
+
+def move_user(user_id, target, batch_size=500, settle=None):
+    return move_users({user_id: target}, batch_size=batch_size, settle=settle)
@@ -0,0 +1,128 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import counters, sharding, timeline
+from .cards import invalidate_card
+from .images import delete_renditions
+from .models import Like, Retweet, Tweet
+from user.models import CustomUser
+
+
+# Keeps the denormalized counters on Tweet in step with their relations
+@receiver(post_save, sender=Like)
+def count_like(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.tweet_id, "likes")
+
+
+@receiver(post_delete, sender=Like)
+def uncount_like(sender, instance, **kwargs):
+    counters.decrement(instance.tweet_id, "likes")
+
+
+@receiver(post_save, sender=Retweet)
+def count_retweet(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.tweet_id, "retweets")
+
+
+@receiver(post_delete, sender=Retweet)
+def uncount_retweet(sender, instance, **kwargs):
+    counters.decrement(instance.tweet_id, "retweets")
+
+
+@receiver(post_save, sender=Tweet)
+def count_reply(sender, instance, created, **kwargs):
+    if created and instance.reply_to_id:
+        counters.increment(instance.reply_to_id, "replies")
+
+
+@receiver(post_delete, sender=Tweet)
+def uncount_reply(sender, instance, **kwargs):
+    if instance.reply_to_id:
+        counters.decrement(instance.reply_to_id, "replies")
+
+
+# Drops cached tweet cards rendered from the previous version of a tweet
+@receiver(pre_save, sender=Tweet)
+def invalidate_edited_card(sender, instance, raw, **kwargs):
+    if not raw and instance.pk and not instance._state.adding:
+        invalidate_card(instance)
+
+
+@receiver(post_delete, sender=Tweet)
+def invalidate_deleted_card(sender, instance, **kwargs):
+    # Skip the author lookup during cascades; versioned keys simply expire
+    if Tweet.user.is_cached(instance):
+        invalidate_card(instance)
+
+
+# Drops the cached first pages of the author's home and profile timelines;
+# followers' cached home pages catch up within HOME_TIMELINE_CACHE_TIMEOUT
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def invalidate_timeline_pages(sender, instance, **kwargs):
+    timeline.invalidate_user_pages(instance.user_id)
+
+
+# Likes and retweets change the counters shown on the reacting user's
+# pages and the author's profile
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Retweet)
+@receiver(post_delete, sender=Retweet)
+def invalidate_reaction_pages(sender, instance, **kwargs):
+    author_id = None
+    if sender.tweet.is_cached(instance):
+        author_id = instance.tweet.user_id
+    timeline.invalidate_reaction_pages(instance.user_id, instance.tweet_id, author_id)
+
+
+# Deleting a user cascades on default only; their tweets on other shards
+# are deleted here
+@receiver(pre_delete, sender=CustomUser)
+def delete_sharded_tweets(sender, instance, **kwargs):
+    sharding.delete_user_tweets(instance.pk)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_new_user_pages(sender, instance, created, raw, **kwargs):
+    # A new account must not inherit pages cached under a reused id
+    if created and not raw:
+        timeline.invalidate_user_pages(instance.pk)
+
+
+# Gives back the stored files of a replaced or deleted image once the
+# change commits, so a rolled back save keeps its file; unreferenced content
+# is removed later by the gc_media command
+@receiver(pre_save, sender=Tweet)
+def find_replaced_image(sender, instance, raw, using, **kwargs):
+    instance._replaced_image = None
+    if raw or not instance.pk or instance._state.adding:
+        return
+    old = Tweet.objects.using(using).filter(pk=instance.pk)
+    old = old.values_list("image", flat=True).first()
+    if old and old != instance.image.name:
+        instance._replaced_image = old
+
+
+@receiver(post_save, sender=Tweet)
+def release_replaced_image(sender, instance, using, **kwargs):
+    old = getattr(instance, "_replaced_image", None)
+    if old:
+        storage = instance.image.storage
+        transaction.on_commit(lambda: storage.delete(old), using=using)
+
+
+@receiver(post_delete, sender=Tweet)
+def release_deleted_image(sender, instance, using, **kwargs):
+    if instance.image:
+        storage = instance.image.storage
+        name, renditions = instance.image.name, instance.renditions
+
+        def release():
+            storage.delete(name)
+            delete_renditions(storage, renditions)
+
+        transaction.on_commit(release, using=using)
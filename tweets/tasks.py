@@ -0,0 +1,28 @@
+from jobs.queue import task
+
+from .images import process_tweet_image
+from .sharding import tweet_queryset
+from .timeline import invalidate_user_pages
+
+
+def finish_processing(tweet_id):
+    tweet = tweet_queryset(tweet_id)
+    tweet.update(image_processing=False)
+    # Cached timeline pages still show the tweet as processing
+    user_id = tweet.values_list("user_id", flat=True).first()
+    if user_id is not None:
+        invalidate_user_pages(user_id)
+
+
+def image_failed(tweet_id):
+    # Give up on renditions; templates fall back to the original upload
+    finish_processing(tweet_id)
+
+
+@task("tweets.process_image", on_failure=image_failed)
+def process_image(tweet_id):
+    tweet = tweet_queryset(tweet_id).first()
+    if tweet is None:
+        return
+    process_tweet_image(tweet)
+    finish_processing(tweet_id)
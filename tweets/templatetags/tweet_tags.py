@@ -0,0 +1,40 @@
+import re
+
+from django import template
+from django.urls import reverse
+from django.utils.html import escape, format_html
+from django.utils.safestring import mark_safe
+
+from tweets.cards import render_card
+from tweets.entities import HASHTAG_RE, MENTION_RE
+
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def tweet_card(context, tweet):
+    return mark_safe(render_card(tweet, context.get("user"), context.get("csrf_token")))
+
+
+ENTITY_RE = re.compile(f"{HASHTAG_RE.pattern}|{MENTION_RE.pattern}")
+
+
+@register.filter
+def link_entities(body):
+    """Escapes body and links its #hashtags and @mentions to their timelines."""
+    parts = []
+    position = 0
+    for match in ENTITY_RE.finditer(body):
+        tag, username = match.groups()
+        if tag is not None and tag.isdigit():
+            continue
+        if tag is not None:
+            url = reverse("tweets:hashtag", kwargs={"tag": tag})
+        else:
+            url = reverse("tweets:mention", kwargs={"username": username})
+        parts.append(escape(body[position : match.start()]))
+        parts.append(format_html('<a href="{}">{}</a>', url, match.group()))
+        position = match.end()
+    parts.append(escape(body[position:]))
+    return mark_safe("".join(parts))
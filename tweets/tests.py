@@ -1,8 +1,42 @@
+import datetime
+import time
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.core.files.images import ImageFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
 from django.shortcuts import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
 
-from .models import Tweet
+from .cards import CSRF_PLACEHOLDER, card_cache_key
+from .counters import CounterBuffer
+from .images import process_tweet_image
+from .entities import extract_hashtags, extract_mentions
+from .ids import SnowflakeGenerator, datetime_to_id, id_to_datetime
+from .models import (
+    Hashtag,
+    Like,
+    Mention,
+    Retweet,
+    Tweet,
+    TimelineEntry,
+    TweetHashtag,
+    UserShard,
+)
+from .pagination import KeysetPaginator, NEWER
+from . import sharding
+from jobs.queue import work
+from mediastore.models import Blob
+from .timeline import fan_out, home_timeline
+from .views import TweetEditView
 from user.models import CustomUser
 
 
@@ -121,6 +155,30 @@ class EditTweetTests(TestCase):
         self.assertTrue(self.tweet.image, data["image"])
         self.assertRedirects(response, reverse("user:home"))
 
+    def test_edit_keeps_concurrent_counter_and_image_updates(self):
+        """
+        POST: tweets/<int:pk>/edit/
+        詳細: a like and a finished image job land after the edit loads the
+              tweet and before it saves
+        効果: the edit keeps both
+        """
+        get_object = TweetEditView.get_object
+        tweets = Tweet.objects.filter(pk=self.tweet.pk)
+
+        def get_object_then_like(view, queryset=None):
+            tweets.update(image_processing=True)
+            tweet = get_object(view, queryset)
+            tweets.update(likes=F("likes") + 1, image_processing=False)
+            return tweet
+
+        with mock.patch.object(TweetEditView, "get_object", get_object_then_like):
+            self.client.post(self.url, {"body": "edited", "image": ""})
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.body, "edited")
+        # One like per load: the permission check and the edit itself
+        self.assertEqual(self.tweet.likes, 2)
+        self.assertFalse(self.tweet.image_processing)
+
     def test_edit_fails_if_unauthorized(self):
         """
         POST: tweets/<int:pk>/edit/
@@ -345,3 +403,1108 @@ class DeleteTweetTests(TestCase):
                 kwargs={"pk": self.tweet.id},
             ),
         )
+
+
+class TimelineFanoutTests(TestCase):
+    def setUp(self):
+        self.author = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.author.set_password("12345")
+        self.author.save()
+        self.follower = CustomUser.objects.create(
+            username="test2",
+            email="test2@test.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+        self.stranger = CustomUser.objects.create(
+            username="test3",
+            email="test3@test.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+        self.follower.follow(self.author)
+        self.client.login(username="test", password="12345")
+
+    def test_post_fans_out_to_followers(self):
+        """
+        POST: tweets/post/
+        詳細: new tweet is written to the author's and followers' timelines
+        効果: 302
+        """
+        self.client.post(reverse("tweets:tweet"), {"body": "hello"})
+        tweet = Tweet.objects.get(user=self.author)
+
+        owners = TimelineEntry.objects.filter(tweet=tweet).values_list(
+            "owner_id", flat=True
+        )
+        self.assertCountEqual(owners, [self.author.id, self.follower.id])
+        self.assertEqual(list(home_timeline(self.follower, 20)), [tweet])
+        self.assertEqual(list(home_timeline(self.stranger, 20)), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_large_accounts_are_merged_on_read(self):
+        """
+        POST: tweets/post/
+        詳細: authors over the fan-out limit are only read-merged
+        効果: 302
+        """
+        self.client.post(reverse("tweets:tweet"), {"body": "hello"})
+        tweet = Tweet.objects.get(user=self.author)
+
+        owners = TimelineEntry.objects.filter(tweet=tweet).values_list(
+            "owner_id", flat=True
+        )
+        self.assertEqual(list(owners), [self.author.id])
+        self.assertEqual(list(home_timeline(self.follower, 20)), [tweet])
+        self.assertEqual(list(home_timeline(self.stranger, 20)), [])
+
+    def test_delete_removes_timeline_entries(self):
+        self.client.post(reverse("tweets:tweet"), {"body": "hello"})
+        tweet = Tweet.objects.get(user=self.author)
+        self.client.post(reverse("tweets:tweet_delete", kwargs={"pk": tweet.id}))
+        self.assertFalse(TimelineEntry.objects.exists())
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output is SQLite's")
+class TimelineQueryPlanTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.another_user = CustomUser.objects.create(
+            username="test2",
+            email="test2@test.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+        self.user.follow(self.another_user)
+        self.client.login(username="test", password="12345")
+        for i in range(30):
+            for author in (self.user, self.another_user):
+                fan_out(Tweet.objects.create(user=author, body=f"tweet {i}"))
+
+    def query_plans(self, url, table, data=None):
+        # Re-runs every captured query touching `table` under EXPLAIN QUERY PLAN
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if f'FROM "{table}"' in query["sql"]:
+                    cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                    plans.append(" / ".join(row[-1] for row in cursor.fetchall()))
+        self.assertTrue(plans)
+        return plans
+
+    def assertIndexScan(self, plans, index):
+        for plan in plans:
+            self.assertIn(f"INDEX {index}", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_profile_tweets_use_user_index(self):
+        url = reverse("user:user_profile", kwargs={"pk": self.another_user.id})
+        plans = self.query_plans(url, "tweets_tweet")
+        self.assertIndexScan(plans, "tweet_user_idx")
+
+    def test_home_timeline_uses_owner_index(self):
+        url = reverse("user:home")
+        self.assertIndexScan(
+            self.query_plans(url, "tweets_timelineentry"), "timeline_owner_idx"
+        )
+        cursor = self.client.get(url).context["page"].older_cursor
+        self.assertIndexScan(
+            self.query_plans(url, "tweets_timelineentry", {"older": cursor}),
+            "timeline_owner_idx",
+        )
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_merged_home_timeline_uses_created_index(self):
+        url = reverse("user:home")
+        cursor = self.client.get(url).context["page"].older_cursor
+        plans = [
+            plan
+            for plan in self.query_plans(url, "tweets_tweet", {"older": cursor})
+            if "timelineentry" not in plan.lower()
+        ]
+        self.assertIndexScan(plans, "tweet_")
+
+
+class ReactionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.client.login(username="test", password="12345")
+        self.tweet = Tweet.objects.create(user=self.user, body="test")
+
+    def test_like_toggles_counter(self):
+        """
+        POST: tweets/<int:pk>/like/
+        詳細: like then unlike updates the counter
+        効果: 302
+        """
+        url = reverse("tweets:tweet_like", kwargs={"pk": self.tweet.id})
+        response = self.client.post(url, {"next": reverse("user:home")})
+        self.tweet.refresh_from_db()
+
+        self.assertRedirects(response, reverse("user:home"))
+        self.assertEqual(self.tweet.likes, 1)
+        self.assertTrue(Like.objects.filter(user=self.user, tweet=self.tweet).exists())
+
+        self.client.post(url)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes, 0)
+        self.assertFalse(Like.objects.exists())
+
+    def test_retweet_toggles_counter(self):
+        """
+        POST: tweets/<int:pk>/retweet/
+        詳細: retweet updates the counter and ignores unsafe redirects
+        効果: 302
+        """
+        url = reverse("tweets:tweet_retweet", kwargs={"pk": self.tweet.id})
+        response = self.client.post(url, {"next": "https://example.com/"})
+        self.tweet.refresh_from_db()
+
+        self.assertRedirects(
+            response, reverse("tweets:tweet_detail", kwargs={"pk": self.tweet.id})
+        )
+        self.assertEqual(self.tweet.retweets, 1)
+        self.assertTrue(Retweet.objects.exists())
+
+    def test_like_fails_if_unauthorized(self):
+        """
+        POST: tweets/<int:pk>/like/
+        詳細: unauthorized access redirects to signin page
+        効果: 302
+        """
+        self.client.logout()
+        url = reverse("tweets:tweet_like", kwargs={"pk": self.tweet.id})
+        response = self.client.post(url)
+        self.tweet.refresh_from_db()
+
+        self.assertRedirects(response, reverse("user:signin") + "?next=" + url)
+        self.assertEqual(self.tweet.likes, 0)
+
+    def test_double_submitted_like_is_one_like(self):
+        """
+        POST: tweets/<int:pk>/like/
+        詳細: a second submit of the form loses the race to the unique constraint
+        効果: 302
+        """
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        url = reverse("tweets:tweet_like", kwargs={"pk": self.tweet.id})
+        with mock.patch.object(
+            Like.objects, "get_or_create", side_effect=IntegrityError
+        ):
+            response = self.client.post(url, {"next": reverse("user:home")})
+        self.assertRedirects(response, reverse("user:home"))
+        self.assertTrue(Like.objects.filter(user=self.user, tweet=self.tweet).exists())
+
+    def test_reply_redirects_anonymous_users_before_the_lookup(self):
+        """
+        GET: tweets/<int:pk>/reply/
+        詳細: signed out, for a missing tweet
+        効果: 302 to signin, without reading the tweet
+        """
+        self.client.logout()
+        url = reverse("tweets:tweet_reply", kwargs={"pk": "555"})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertRedirects(response, reverse("user:signin") + "?next=" + url)
+        self.assertFalse([q for q in queries if Tweet._meta.db_table in q["sql"]])
+
+    def test_reply_counts_and_uncounts(self):
+        """
+        POST: tweets/<int:pk>/reply/
+        詳細: replying increments and deleting the reply decrements
+        効果: 302
+        """
+        url = reverse("tweets:tweet_reply", kwargs={"pk": self.tweet.id})
+        response = self.client.post(url, {"body": "reply"})
+        self.tweet.refresh_from_db()
+
+        self.assertRedirects(response, reverse("user:home"))
+        self.assertEqual(self.tweet.replies, 1)
+        reply = Tweet.objects.get(reply_to=self.tweet)
+        self.assertEqual(reply.user, self.user)
+
+        reply.delete()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.replies, 0)
+
+    def test_reply_fails_with_invalid_pk(self):
+        """
+        POST: tweets/<int:pk>/reply/
+        詳細: pk is invalid
+        効果: 404
+        """
+        url = reverse("tweets:tweet_reply", kwargs={"pk": "555"})
+        response = self.client.post(url, {"body": "reply"})
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Tweet.objects.count(), 1)
+
+    def test_reconcile_counters(self):
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        Tweet.objects.filter(pk=self.tweet.pk).update(likes=7, retweets=3)
+        call_command("reconcile_counters", stdout=StringIO())
+        self.tweet.refresh_from_db()
+
+        self.assertEqual(self.tweet.likes, 1)
+        self.assertEqual(self.tweet.retweets, 0)
+        self.assertEqual(self.tweet.replies, 0)
+
+
+@override_settings(TWEET_COUNTER_BUFFER={"ENABLED": True, "INTERVAL": 3600})
+class CounterBufferTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.tweets = [
+            Tweet.objects.create(user=self.user, body=f"tweet {i}") for i in range(3)
+        ]
+        self.buffer = CounterBuffer()
+
+    def test_deltas_are_held_until_flush(self):
+        for _ in range(5):
+            self.buffer.add(self.tweets[0].id, "likes", 1)
+        self.buffer.add(self.tweets[0].id, "retweets", 2)
+        self.buffer.add(self.tweets[1].id, "likes", 1)
+        self.tweets[0].refresh_from_db()
+        self.assertEqual(self.tweets[0].likes, 0)
+        self.assertEqual(self.buffer.metrics()["pending_tweets"], 2)
+        self.assertEqual(self.buffer.metrics()["pending_deltas"], 8)
+
+        with self.assertNumQueries(1):
+            self.buffer.flush()
+        for tweet in self.tweets:
+            tweet.refresh_from_db()
+        self.assertEqual(self.tweets[0].likes, 5)
+        self.assertEqual(self.tweets[0].retweets, 2)
+        self.assertEqual(self.tweets[1].likes, 1)
+        self.assertEqual(self.tweets[2].likes, 0)
+
+        metrics = self.buffer.metrics()
+        self.assertEqual(metrics["pending_tweets"], 0)
+        self.assertEqual(metrics["flushes"], 1)
+        self.assertIsNotNone(metrics["last_flush_seconds"])
+
+    def test_counters_never_go_negative(self):
+        self.buffer.add(self.tweets[0].id, "likes", -3)
+        self.buffer.flush()
+        self.tweets[0].refresh_from_db()
+        self.assertEqual(self.tweets[0].likes, 0)
+
+    @override_settings(
+        TWEET_COUNTER_BUFFER={"ENABLED": True, "INTERVAL": 3600, "MAX_PENDING": 2}
+    )
+    def test_wakes_the_flusher_when_too_many_pending(self):
+        with mock.patch.object(self.buffer, "_ensure_flusher"):
+            # Adding never writes, even once a flush is due
+            with self.assertNumQueries(0):
+                self.buffer.add(self.tweets[0].id, "likes", 1)
+                self.assertFalse(self.buffer._wake.is_set())
+                self.buffer.add(self.tweets[1].id, "likes", 1)
+        self.assertTrue(self.buffer._wake.is_set())
+        self.assertEqual(self.buffer.metrics()["pending_tweets"], 2)
+
+    def test_failed_flush_keeps_the_deltas(self):
+        self.buffer.add(self.tweets[0].id, "likes", 1)
+        with mock.patch("tweets.counters.write_deltas", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.metrics()["pending_deltas"], 1)
+
+    def test_rolled_back_reactions_are_not_buffered(self):
+        with mock.patch("tweets.counters.buffer", self.buffer):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError):
+                    with transaction.atomic():
+                        Like.objects.create(user=self.user, tweet=self.tweets[0])
+                        raise RuntimeError
+                Like.objects.create(user=self.user, tweet=self.tweets[1])
+        self.buffer.flush()
+        for tweet in self.tweets:
+            tweet.refresh_from_db()
+        self.assertEqual([tweet.likes for tweet in self.tweets], [0, 1, 0])
+
+    def test_metrics_view_is_staff_only(self):
+        self.user.set_password("12345")
+        self.user.save()
+        self.client.login(username="test", password="12345")
+        url = reverse("tweets:counter_metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("pending_deltas", response.json())
+
+
+class TweetCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.client.login(username="test", password="12345")
+        self.client.post(reverse("tweets:tweet"), {"body": "first version"})
+        self.tweet = Tweet.objects.select_related("user").get()
+
+    def test_card_is_cached_per_owner(self):
+        response = self.client.get(reverse("user:home"))
+        self.assertContains(response, "first version")
+
+        cached = cache.get(card_cache_key(self.tweet, True))
+        self.assertIn("first version", cached)
+        self.assertIn(CSRF_PLACEHOLDER, cached)
+        self.assertIsNone(cache.get(card_cache_key(self.tweet, False)))
+
+        # The cached owner card is served with this request's CSRF token
+        response = self.client.get(reverse("user:home"))
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+        self.assertContains(response, str(response.context["csrf_token"]))
+
+    def test_tweet_text_is_never_given_the_csrf_token(self):
+        body = f'{CSRF_PLACEHOLDER} value="{CSRF_PLACEHOLDER}"'
+        self.client.post(reverse("tweets:tweet"), {"body": body})
+        self.client.get(reverse("user:home"))
+        # Served from the cache: both copies in the text survive
+        response = self.client.get(reverse("user:home"))
+        self.assertContains(response, CSRF_PLACEHOLDER, count=2)
+        self.assertContains(response, str(response.context["csrf_token"]))
+
+    def test_edit_invalidates_card(self):
+        self.client.get(reverse("user:home"))
+        self.client.post(
+            reverse("tweets:tweet_edit", kwargs={"pk": self.tweet.id}),
+            {"body": "second version"},
+        )
+        self.assertIsNone(cache.get(card_cache_key(self.tweet, True)))
+
+        response = self.client.get(reverse("user:home"))
+        self.assertContains(response, "second version")
+        self.assertNotContains(response, "first version")
+
+    def test_delete_invalidates_card(self):
+        self.client.get(reverse("user:home"))
+        self.tweet.delete()
+        self.assertIsNone(cache.get(card_cache_key(self.tweet, True)))
+
+    def test_other_viewers_get_the_read_only_card(self):
+        viewer = CustomUser.objects.create(
+            username="test2",
+            email="test2@test.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+        viewer.follow(self.user)
+        self.client.force_login(viewer)
+        response = self.client.get(
+            reverse("user:user_profile", kwargs={"pk": self.user.id})
+        )
+        self.assertContains(response, "first version")
+        self.assertNotContains(
+            response, reverse("tweets:tweet_edit", kwargs={"pk": self.tweet.id})
+        )
+        self.assertIsNotNone(cache.get(card_cache_key(self.tweet, False)))
+
+
+class TweetDetailConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.tweet = Tweet.objects.create(user=self.user, body="test")
+        self.url = reverse("tweets:tweet_detail", kwargs={"pk": self.tweet.id})
+
+    def test_unchanged_tweet_returns_304(self):
+        """
+        GET: tweets/<int:pk>/
+        詳細: revalidating with the ETag of an unchanged tweet
+        効果: 304
+        """
+        self.client.login(username="test", password="12345")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_edited_tweet_returns_200(self):
+        """
+        GET: tweets/<int:pk>/
+        詳細: revalidating after the tweet was edited
+        効果: 200
+        """
+        self.client.login(username="test", password="12345")
+        etag = self.client.get(self.url)["ETag"]
+        self.client.post(
+            reverse("tweets:tweet_edit", kwargs={"pk": self.tweet.id}),
+            {"body": "edited"},
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "edited")
+
+    def test_if_modified_since_does_not_hide_counter_changes(self):
+        """
+        GET: tweets/<int:pk>/
+        詳細: revalidating by date after a like, which leaves updated_at alone
+        効果: 200
+        """
+        response = self.client.get(self.url)
+        self.assertNotIn("Last-Modified", response)
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_changes_with_counters_and_viewer(self):
+        etag = self.client.get(self.url)["ETag"]
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        self.assertNotEqual(self.client.get(self.url)["ETag"], etag)
+
+        etag = self.client.get(self.url)["ETag"]
+        self.client.login(username="test", password="12345")
+        self.assertNotEqual(self.client.get(self.url)["ETag"], etag)
+
+    def test_anonymous_page_is_served_from_cache(self):
+        """
+        GET: tweets/<int:pk>/
+        詳細: anonymous viewers get the cached page after the first hit
+        効果: 200
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "test")
+
+        # Only the version lookup reaches the database
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "test")
+
+    def test_anonymous_cache_is_keyed_by_query_string(self):
+        """
+        GET: tweets/<int:pk>/?next=...
+        詳細: the query the page can reflect is part of the cache key
+        効果: 200, the plain permalink is cached separately
+        """
+        self.client.get(self.url, {"next": "/elsewhere/", "a": "1"})
+        self.assertIsNone(cache.get(f"tweet_detail:{self.tweet.id}"))
+        # The same query in another order is the same page
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url + "?a=1&next=/elsewhere/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_and_delete_invalidate_anonymous_cache(self):
+        self.client.get(self.url)
+        self.client.login(username="test", password="12345")
+        self.client.post(
+            reverse("tweets:tweet_edit", kwargs={"pk": self.tweet.id}),
+            {"body": "edited"},
+        )
+        self.assertIsNone(cache.get(f"tweet_detail:{self.tweet.id}"))
+        self.client.logout()
+        self.assertContains(self.client.get(self.url), "edited")
+
+        self.client.login(username="test", password="12345")
+        self.client.post(reverse("tweets:tweet_delete", kwargs={"pk": self.tweet.id}))
+        self.assertIsNone(cache.get(f"tweet_detail:{self.tweet.id}"))
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class TweetImageRenditionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.client.login(username="test", password="12345")
+        path = "./media/test/test_img.jpg"
+        data = {"body": "test", "image": ImageFile(open(path, "rb"))}
+        self.client.post(reverse("tweets:tweet"), data)
+        work()
+        self.tweet = Tweet.objects.get()
+
+    def tearDown(self):
+        for rendition in self.tweet.renditions:
+            for name in rendition.values():
+                if isinstance(name, str):
+                    self.tweet.image.storage.delete(name)
+
+    def test_post_generates_renditions(self):
+        """
+        POST: tweets/post/
+        詳細: resized progressive JPEGs without EXIF are stored content-addressed
+        効果: 302
+        """
+        widths = [rendition["width"] for rendition in self.tweet.renditions]
+        self.assertEqual(widths, [320, 640, 1280])
+        storage = self.tweet.image.storage
+        for rendition in self.tweet.renditions:
+            self.assertTrue(rendition["jpeg"].startswith("cas/"))
+            with storage.open(rendition["jpeg"]) as f:
+                image = Image.open(f)
+                self.assertEqual(image.width, rendition["width"])
+                self.assertTrue(image.info.get("progressive"))
+                self.assertNotIn("exif", image.info)
+
+    def test_templates_emit_srcset(self):
+        response = self.client.get(reverse("user:home"))
+        self.assertContains(response, "srcset=")
+        self.assertContains(response, self.tweet.jpeg_srcset)
+        self.assertNotContains(response, f"src='{self.tweet.image.url}'")
+
+    def test_edit_replaces_renditions(self):
+        """
+        POST: tweets/<int:pk>/edit/
+        詳細: clearing the image removes its renditions
+        効果: 302
+        """
+        old = self.tweet.renditions
+        self.client.post(
+            reverse("tweets:tweet_edit", kwargs={"pk": self.tweet.id}),
+            {"body": "test", "image-clear": "on"},
+        )
+        work()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.renditions, [])
+        self.assertFalse(self.tweet.image)
+        for rendition in old:
+            self.assertEqual(Blob.objects.get(name=rendition["jpeg"]).refs, 0)
+
+    def test_tweet_is_processing_until_job_runs(self):
+        """
+        POST: tweets/post/
+        詳細: the tweet shows a placeholder until its renditions are ready
+        効果: 302
+        """
+        path = "./media/test/test_img.jpg"
+        data = {"body": "second", "image": ImageFile(open(path, "rb"))}
+        self.client.post(reverse("tweets:tweet"), data)
+        tweet = Tweet.objects.get(body="second")
+        self.assertTrue(tweet.image_processing)
+        self.assertEqual(tweet.renditions, [])
+        self.assertContains(self.client.get(reverse("user:home")), "Processing image")
+
+        work()
+        tweet.refresh_from_db()
+        self.assertFalse(tweet.image_processing)
+        self.assertEqual(len(tweet.renditions), 3)
+        response = self.client.get(reverse("user:home"))
+        self.assertNotContains(response, "Processing image")
+        self.assertContains(response, tweet.jpeg_srcset)
+        for rendition in tweet.renditions:
+            default_storage.delete(rendition["jpeg"])
+
+    def test_processing_does_not_touch_updated_at(self):
+        updated_at = self.tweet.updated_at
+        process_tweet_image(self.tweet)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.updated_at, updated_at)
+
+
+class EntityIndexTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.another_user = CustomUser.objects.create(
+            username="test2",
+            email="test2@test.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+        self.client.login(username="test", password="12345")
+
+    def post(self, body):
+        self.client.post(reverse("tweets:tweet"), {"body": body})
+        return Tweet.objects.latest("id")
+
+    def test_extraction(self):
+        body = "#Django and #ＤＪＡＮＧＯ, #1 a#b mail me@example.com @test2. @Test2"
+        self.assertEqual(extract_hashtags(body), ["django"])
+        self.assertEqual(extract_mentions(body), ["test2", "Test2"])
+
+    def test_tags_longer_once_normalized_are_truncated(self):
+        """
+        POST: tweets/post/
+        詳細: a 100 character tag that casefolds to 200 characters
+        効果: 302
+        """
+        self.post("#" + "ß" * 100)
+        self.assertEqual(Hashtag.objects.get().name, "s" * 100)
+
+    def test_post_and_edit_index_entities(self):
+        """
+        POST: tweets/post/, tweets/<int:pk>/edit/
+        詳細: hashtags and mentions are indexed on save and re-indexed on edit
+        効果: 302
+        """
+        tweet = self.post("hello #Python @test2 @nobody")
+        self.assertEqual(
+            list(TweetHashtag.objects.values_list("hashtag__name", flat=True)),
+            ["python"],
+        )
+        self.assertEqual(
+            list(Mention.objects.values_list("user", flat=True)),
+            [self.another_user.id],
+        )
+        self.client.post(
+            reverse("tweets:tweet_edit", kwargs={"pk": tweet.id}),
+            {"body": "now #django only"},
+        )
+        self.assertEqual(
+            list(TweetHashtag.objects.values_list("hashtag__name", flat=True)),
+            ["django"],
+        )
+        self.assertFalse(Mention.objects.exists())
+
+    def test_timelines(self):
+        """
+        GET: tweets/tags/<str:tag>/, tweets/mentions/<str:username>/
+        詳細: tag and mention timelines list matching tweets, newest first
+        効果: 200 (404 for unknown users)
+        """
+        tweets = [self.post(f"#Tag tweet {i} @test2") for i in range(25)]
+        self.post("untagged")
+        response = self.client.get(reverse("tweets:hashtag", kwargs={"tag": "TAG"}))
+        self.assertEqual(
+            [tweet.id for tweet in response.context["object_list"]],
+            [tweet.id for tweet in reversed(tweets[-20:])],
+        )
+        cursor = response.context["page"].older_cursor
+        response = self.client.get(
+            reverse("tweets:hashtag", kwargs={"tag": "tag"}), {"older": cursor}
+        )
+        self.assertEqual(
+            [tweet.id for tweet in response.context["object_list"]],
+            [tweet.id for tweet in reversed(tweets[:5])],
+        )
+        url = reverse("tweets:mention", kwargs={"username": "test2"})
+        self.assertEqual(len(self.client.get(url).context["object_list"]), 20)
+        url = reverse("tweets:mention", kwargs={"username": "nobody"})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse("tweets:hashtag", kwargs={"tag": "unused"})
+        self.assertContains(self.client.get(url), "No tweets yet")
+
+    def test_tag_timeline_uses_index(self):
+        for i in range(30):
+            self.post(f"#tag {i}")
+        url = reverse("tweets:hashtag", kwargs={"tag": "tag"})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        sql = next(
+            q["sql"] for q in queries if 'FROM "tweets_tweethashtag"' in q["sql"]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            plan = " / ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("INDEX tweet_hashtag_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_detail_links_entities(self):
+        tweet = self.post("<b>#Tag</b> for @test2")
+        response = self.client.get(
+            reverse("tweets:tweet_detail", kwargs={"pk": tweet.id})
+        )
+        self.assertContains(response, "&lt;b&gt;")
+        self.assertContains(
+            response,
+            f'<a href="{reverse("tweets:hashtag", kwargs={"tag": "Tag"})}">#Tag</a>',
+        )
+        self.assertContains(
+            response,
+            f'<a href="{reverse("tweets:mention", kwargs={"username": "test2"})}">'
+            "@test2</a>",
+        )
+
+    def test_backfill_entities(self):
+        tweet = Tweet.objects.create(user=self.user, body="old #backlog @test2")
+        out = StringIO()
+        call_command("backfill_entities", "--batch-size", "1", stdout=out)
+        self.assertIn("Indexed 1 tweets", out.getvalue())
+        self.assertTrue(TweetHashtag.objects.filter(tweet=tweet).exists())
+        self.assertTrue(Mention.objects.filter(tweet=tweet).exists())
+
+
+class ShardingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            CustomUser.objects.create(
+                username=f"test{i}",
+                email=f"test{i}@test.com",
+                phone="",
+                date_of_birth="1901-01-01",
+            )
+            for i in range(10)
+        ]
+
+    def test_adding_a_shard_moves_a_fraction_of_users(self):
+        """
+        詳細: consistent hashing only moves users onto the new shard
+        効果: about a third of users move, all to shard2
+        """
+        before = sharding.ShardMap(["default", "shard1"])
+        after = sharding.ShardMap(["default", "shard1", "shard2"])
+        moved = [
+            user_id
+            for user_id in range(3000)
+            if before.shard_for(user_id) != after.shard_for(user_id)
+        ]
+        self.assertTrue(700 < len(moved) < 1300, len(moved))
+        self.assertEqual({after.shard_for(user_id) for user_id in moved}, {"shard2"})
+
+    def test_single_shard_needs_no_lookups(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(sharding.shard_for_user(self.users[0].pk), "default")
+            self.assertEqual(sharding.place_user(self.users[0].pk), "default")
+
+    @override_settings(TWEET_SHARDS=["default", "shard1"])
+    def test_first_write_records_placement(self):
+        """
+        詳細: the router places a new author on the ring and remembers it
+        効果: later lookups use the placement, not the ring
+        """
+        user = self.users[0]
+        router = sharding.ShardRouter()
+        alias = router.db_for_write(Tweet, instance=Tweet(user=user))
+        self.assertEqual(alias, sharding.ring().shard_for(user.pk))
+        self.assertEqual(UserShard.objects.get(user=user).shard, alias)
+
+        UserShard.objects.filter(user=user).update(shard="elsewhere")
+        cache.clear()
+        self.assertEqual(sharding.shard_for_user(user.pk), "elsewhere")
+        self.assertEqual(
+            router.db_for_read(Tweet, instance=Tweet(user=user)), "elsewhere"
+        )
+        self.assertIsNone(router.db_for_read(Like, instance=Like(user=user)))
+        self.assertFalse(router.allow_migrate("shard1", "user", "customuser"))
+        self.assertTrue(router.allow_migrate("shard1", "tweets", "tweet"))
+
+    def test_scatter_gather_merges_shards_in_order(self):
+        """
+        詳細: per-shard keyset pages merge into one timeline page
+        効果: same rows as paginating all the tweets at once
+        """
+        for i in range(12):
+            Tweet.objects.create(user=self.users[i % 3], body=f"tweet {i}")
+        paginator = KeysetPaginator(5)
+        querysets = [Tweet.objects.filter(user=user) for user in self.users[:3]]
+        everyone = Tweet.objects.filter(user__in=self.users[:3])
+
+        rows = sharding.scatter_gather(paginator, querysets)
+        self.assertEqual(rows, paginator.fetch(everyone))
+        cursor = paginator.build_page(rows).older_cursor
+        rows = sharding.scatter_gather(paginator, querysets, cursor)
+        self.assertEqual(rows, paginator.fetch(everyone, cursor))
+        cursor = paginator.build_page(rows, cursor).newer_cursor
+        self.assertEqual(
+            sharding.scatter_gather(paginator, querysets, cursor, NEWER),
+            paginator.fetch(everyone, cursor, NEWER),
+        )
+
+    def test_pin_and_plan_reshard(self):
+        for user in self.users:
+            Tweet.objects.create(user=user, body="hello")
+        call_command("reshard_tweets", "--pin", stdout=StringIO())
+        self.assertEqual(
+            set(UserShard.objects.values_list("shard", flat=True)), {"default"}
+        )
+
+        out = StringIO()
+        with override_settings(TWEET_SHARDS=["default", "shard1"]):
+            ring = sharding.ring()
+            expected = sum(ring.shard_for(user.pk) == "shard1" for user in self.users)
+            call_command("reshard_tweets", "--dry-run", stdout=out)
+        self.assertIn(f"Would move {expected} users", out.getvalue())
+        self.assertEqual(Tweet.objects.count(), 10)
+
+
+@override_settings(TWEET_SHARDS=["default", "shard1"])
+class ShardedTweetTests(TestCase):
+    databases = {"default", "shard1"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        UserShard.objects.create(user=self.user, shard="shard1")
+        self.client.login(username="test", password="12345")
+        self.client.post(reverse("tweets:tweet"), {"body": "on a shard"})
+        self.tweet = Tweet.objects.using("shard1").get()
+
+    def test_tweet_is_written_to_the_author_shard(self):
+        """
+        POST: tweets/post/
+        詳細: the author is placed on shard1
+        効果: the tweet is only on shard1 and shows on the permalink
+        """
+        self.assertFalse(Tweet.objects.using("default").exists())
+        response = self.client.get(
+            reverse("tweets:tweet_detail", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertContains(response, "on a shard")
+
+    def test_reactions_and_replies_count_on_the_shard(self):
+        """
+        POST: tweets/<int:pk>/like/, retweet/, reply/
+        詳細: counters are updated on the shard holding the tweet
+        効果: likes, retweets and replies move
+        """
+        kwargs = {"pk": self.tweet.pk}
+        self.client.post(reverse("tweets:tweet_like", kwargs=kwargs))
+        self.client.post(reverse("tweets:tweet_retweet", kwargs=kwargs))
+        self.client.post(reverse("tweets:tweet_reply", kwargs=kwargs), {"body": "re"})
+        self.tweet.refresh_from_db()
+        self.assertEqual(
+            (self.tweet.likes, self.tweet.retweets, self.tweet.replies), (1, 1, 1)
+        )
+
+        self.client.post(reverse("tweets:tweet_like", kwargs=kwargs))
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes, 0)
+
+    @override_settings(TWEET_COUNTER_BUFFER={"ENABLED": True, "INTERVAL": 60})
+    def test_buffered_counters_flush_to_the_shard(self):
+        buffer = CounterBuffer()
+        buffer.add(self.tweet.pk, "likes", 3)
+        buffer.flush()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes, 3)
+
+    def test_edit_and_delete(self):
+        """
+        POST: tweets/<int:pk>/edit/, delete/
+        詳細: the tweet is edited and deleted on shard1
+        効果: its likes and timeline entries on default go with it
+        """
+        kwargs = {"pk": self.tweet.pk}
+        self.client.post(
+            reverse("tweets:tweet_edit", kwargs=kwargs), {"body": "edited"}
+        )
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.body, "edited")
+
+        self.client.post(reverse("tweets:tweet_like", kwargs=kwargs))
+        self.assertTrue(TimelineEntry.objects.filter(tweet_id=self.tweet.pk).exists())
+        response = self.client.post(reverse("tweets:tweet_delete", kwargs=kwargs))
+        self.assertRedirects(response, reverse("user:home"))
+        self.assertFalse(Tweet.objects.using("shard1").exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.client.get(reverse("tweets:tweet_detail", kwargs=kwargs))
+        self.assertEqual(response.status_code, 404)
+
+    def test_home_timeline_gathers_from_shards(self):
+        other = CustomUser.objects.create(
+            username="other", email="other@test.com", date_of_birth="1901-01-01"
+        )
+        UserShard.objects.create(user=other, shard="default")
+        self.user.follow(other)
+        fan_out(Tweet.objects.create(user=other, body="on default"))
+        rows = home_timeline(self.user, 10).object_list
+        self.assertEqual([tweet.body for tweet in rows], ["on default", "on a shard"])
+
+    def test_deleting_a_user_deletes_their_tweets_on_every_shard(self):
+        """
+        GET: home/
+        詳細: the author of a tweet on shard1 is deleted
+        効果: the tweet goes too and the follower's home timeline still loads
+        """
+        follower = CustomUser.objects.create(
+            username="follower", email="follower@test.com", date_of_birth="1901-01-01"
+        )
+        follower.follow(self.user)
+        fan_out(self.tweet)
+        self.user.delete()
+        self.assertFalse(Tweet.objects.using("shard1").exists())
+        self.assertFalse(UserShard.objects.exists())
+        self.client.force_login(follower)
+        response = self.client.get(reverse("user:home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "on a shard")
+
+    def test_tweets_of_missing_authors_are_skipped(self):
+        tweet = Tweet(pk=1, user_id=self.user.pk + 1, body="orphan")
+        self.assertEqual(sharding.attach_users([tweet, self.tweet]), [self.tweet])
+
+
+@override_settings(TWEET_SHARDS=["default", "shard1"])
+class MoveUserTests(TestCase):
+    databases = {"default", "shard1"}
+
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            CustomUser.objects.create(
+                username=f"test{i}",
+                email=f"test{i}@test.com",
+                phone="",
+                date_of_birth="1901-01-01",
+            )
+            for i in range(2)
+        ]
+        for user in self.users:
+            UserShard.objects.create(user=user, shard="default")
+        self.tweets = [
+            Tweet.objects.create(user=user, body=f"tweet {i}")
+            for i in range(3)
+            for user in self.users
+        ]
+        Like.objects.create(user=self.users[1], tweet=self.tweets[0])
+
+    def test_users_move_with_one_settle(self):
+        """
+        詳細: two users move to shard1 in one group
+        効果: one wait, tweets only on shard1, likes still count
+        """
+        moves = {user.pk: "shard1" for user in self.users}
+        with mock.patch("tweets.sharding.time.sleep") as sleep:
+            self.assertEqual(sharding.move_users(moves, batch_size=2, settle=5), 6)
+        sleep.assert_called_once_with(5)
+
+        self.assertFalse(Tweet.objects.using("default").exists())
+        self.assertEqual(Tweet.objects.using("shard1").count(), 6)
+        self.assertEqual(
+            set(UserShard.objects.values_list("shard", flat=True)), {"shard1"}
+        )
+        self.assertEqual(sharding.find_tweet(self.tweets[0].pk).likes, 1)
+        self.assertEqual(sharding.move_users(moves, settle=0), 0)
+
+    def test_writes_during_the_move_are_replayed(self):
+        """
+        詳細: a process with a stale placement writes to default while the
+              placement switches
+        効果: its new tweet and edit reach shard1, and its delete too
+        """
+        user = self.users[0]
+        edited, deleted = self.tweets[0], self.tweets[2]
+
+        def stale_writes(seconds):
+            Tweet.objects.using("default").filter(pk=edited.pk).update(
+                body="edited", updated_at=timezone.now()
+            )
+            Tweet.objects.using("default").filter(pk=deleted.pk).delete()
+            Tweet.objects.using("default").create(user=user, body="late")
+
+        with mock.patch("tweets.sharding.time.sleep", side_effect=stale_writes):
+            sharding.move_user(user.pk, "shard1", settle=0)
+
+        moved = Tweet.objects.using("shard1").filter(user=user)
+        self.assertEqual(
+            sorted(moved.values_list("body", flat=True)), ["edited", "late", "tweet 2"]
+        )
+        self.assertFalse(Tweet.objects.using("default").filter(user=user).exists())
+
+    def test_gather_and_home_timeline_across_shards(self):
+        with mock.patch("tweets.sharding.time.sleep"):
+            sharding.move_user(self.users[0].pk, "shard1")
+        ids = [tweet.pk for tweet in self.tweets]
+        gathered = sharding.gather_tweets(ids)
+        self.assertEqual(set(gathered), set(ids))
+        self.assertEqual(gathered[ids[0]].user, self.users[0])
+
+        self.users[0].follow(self.users[1])
+        for tweet in self.tweets:
+            fan_out(tweet)
+        page = home_timeline(self.users[0], 10)
+        self.assertEqual(
+            [tweet.pk for tweet in page.object_list],
+            sorted((tweet.pk for tweet in self.tweets), reverse=True),
+        )
+
+    def test_reshard_command(self):
+        out = StringIO()
+        with mock.patch("tweets.sharding.time.sleep") as sleep:
+            call_command("reshard_tweets", "--settle", "0", stdout=out)
+        ring = sharding.ring()
+        expected = [user for user in self.users if ring.shard_for(user.pk) == "shard1"]
+        self.assertIn(
+            f"Moved {len(expected)} users ({3 * len(expected)} tweets)", out.getvalue()
+        )
+        self.assertEqual(sleep.call_count, 1 if expected else 0)
+
+
+class SnowflakeIdTests(TestCase):
+    def test_ids_increase_within_a_millisecond(self):
+        """
+        詳細: one generator hands out more ids than fit in a millisecond
+        効果: ids strictly increase and carry the node number
+        """
+        generator = SnowflakeGenerator(node=5, clock=lambda: 1700000000.0)
+        ids = [generator.next_id() for _ in range(5000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual({(i >> 12) & 1023 for i in ids}, {5})
+
+    def test_clock_going_backwards(self):
+        now = [1700000000.0]
+        generator = SnowflakeGenerator(node=0, clock=lambda: now[0])
+        first = generator.next_id()
+        now[0] -= 5
+        self.assertGreater(generator.next_id(), first)
+
+    def test_ids_are_minted_on_insert(self):
+        """
+        詳細: a tweet built first but saved last
+        効果: it gets the newest id, in insert order
+        """
+        user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        slow = Tweet(user=user, body="slow")
+        self.assertIsNone(slow.pk)
+        fast = Tweet.objects.create(user=user, body="fast")
+        slow.save()
+        self.assertGreater(slow.pk, fast.pk)
+        bulk = Tweet.objects.bulk_create([Tweet(user=user, body="bulk")])
+        self.assertGreater(bulk[0].pk, slow.pk)
+        self.assertTrue(Tweet.objects.filter(pk=bulk[0].pk).exists())
+
+    def test_datetime_round_trip(self):
+        tweet = Tweet.objects.create(
+            user=CustomUser.objects.create(
+                username="test",
+                email="test@test.com",
+                phone="",
+                date_of_birth="1901-01-01",
+            ),
+            body="test",
+        )
+        minted = id_to_datetime(tweet.id)
+        self.assertLess(abs(minted - tweet.created_at), datetime.timedelta(seconds=1))
+        self.assertLessEqual(datetime_to_id(minted), tweet.id)
+        later = Tweet.objects.create(user=tweet.user, body="later")
+        self.assertGreater(later.id, tweet.id)
+        self.assertEqual(list(Tweet.objects.all()), [later, tweet])
+
+    def test_invalid_node(self):
+        with self.assertRaises(ValueError):
+            SnowflakeGenerator(node=1024)
@@ -0,0 +1,158 @@
+import itertools
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import sharding
+from .models import Tweet, TimelineEntry
+from .pagination import KeysetPaginator, NEWER, OLDER
+from user.models import Follow
+
+
+# Authors with more followers than the fan-out limit are not fanned out on
+# write; their tweets are merged into followers' timelines at read time instead.
+def fanout_limit():
+    return getattr(settings, "TIMELINE_FANOUT_LIMIT", 10000)
+
+
+def fanout_batch_size():
+    return getattr(settings, "TIMELINE_FANOUT_BATCH_SIZE", 1000)
+
+
+# How many of a followee's recent tweets are copied in on follow
+def backfill_size():
+    return getattr(settings, "TIMELINE_BACKFILL_SIZE", 200)
+
+
+# First pages of home and profile timelines are cached (see HomeView and
+# ProfileView) and dropped whenever a write changes them
+def home_cache_key(user_id):
+    return f"home_timeline:{user_id}"
+
+
+def profile_cache_key(user_id):
+    return f"profile_tweets:{user_id}"
+
+
+def invalidate_user_pages(user_id):
+    cache.delete_many([home_cache_key(user_id), profile_cache_key(user_id)])
+
+
+def invalidate_reaction_pages(user_id, tweet_id, author_id=None):
+    """
+    Drops the cached pages a like or retweet by user_id is most likely seen
+    on: the user's own, whose counters would otherwise lag behind their
+    action, and the tweet author's profile.
+    """
+    keys = [home_cache_key(user_id), profile_cache_key(user_id)]
+    if author_id is None:
+        author_id = sharding.author_of(tweet_id)
+    if author_id is not None:
+        keys.append(profile_cache_key(author_id))
+    cache.delete_many(keys)
+
+
+def _insert(entries):
+    entries = list(entries)
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=fanout_batch_size(), ignore_conflicts=True
+    )
+    cache.delete_many({home_cache_key(entry.owner_id) for entry in entries})
+
+
+def fan_out(tweet):
+    """Pushes a new tweet into its author's and followers' home timelines."""
+    entries = [
+        TimelineEntry(owner_id=tweet.user_id, tweet=tweet, created_at=tweet.created_at)
+    ]
+    batch_size = fanout_batch_size()
+    if tweet.user.followers_count <= fanout_limit():
+        followers = Follow.objects.filter(followee_id=tweet.user_id).values_list(
+            "follower_id", flat=True
+        )
+        for follower_id in followers.iterator(chunk_size=batch_size):
+            entries.append(
+                TimelineEntry(
+                    owner_id=follower_id, tweet=tweet, created_at=tweet.created_at
+                )
+            )
+            if len(entries) >= batch_size:
+                _insert(entries)
+                entries = []
+    _insert(entries)
+
+
+def backfill(user, followee):
+    """Copies a newly followed user's recent tweets into user's timeline."""
+    if followee.pk != user.pk and followee.followers_count > fanout_limit():
+        return
+    tweets = sharding.user_tweets(followee).order_by("-id")
+    _insert(
+        TimelineEntry(owner=user, tweet_id=tweet_id, created_at=created_at)
+        for tweet_id, created_at in tweets.values_list("id", "created_at")[
+            : backfill_size()
+        ]
+    )
+
+
+def unfollow(user, followee):
+    entries = TimelineEntry.objects.filter(owner=user)
+    if not sharding.is_sharded():
+        entries.filter(tweet__user=followee).delete()
+    else:
+        # The followee's tweets cannot be joined in from their shard
+        tweet_ids = sharding.user_tweets(followee).values_list("pk", flat=True)
+        tweet_ids = tweet_ids.iterator(chunk_size=fanout_batch_size())
+        while batch := list(itertools.islice(tweet_ids, fanout_batch_size())):
+            entries.filter(tweet_id__in=batch).delete()
+    cache.delete(home_cache_key(user.pk))
+
+
+def rebuild(user):
+    """Recomputes a user's timeline from their own and followees' tweets."""
+    TimelineEntry.objects.filter(owner=user).delete()
+    cache.delete(home_cache_key(user.pk))
+    backfill(user, user)
+    for followee in user.following_set.select_related("followee"):
+        backfill(user, followee.followee)
+
+
+def home_timeline(user, per_page, cursor=None, direction=OLDER):
+    paginator = KeysetPaginator(per_page)
+    entries = TimelineEntry.objects.filter(owner=user)
+    entry_paginator = KeysetPaginator(per_page, pk_field="tweet_id")
+    if sharding.is_sharded():
+        # Tweets may live on other databases, so they cannot be joined in
+        entries = entry_paginator.fetch(entries, cursor, direction)
+        tweets = sharding.gather_tweets(entry.tweet_id for entry in entries)
+        rows = [tweets[entry.tweet_id] for entry in entries if entry.tweet_id in tweets]
+    else:
+        entries = entries.select_related("tweet__user")
+        rows = [
+            entry.tweet for entry in entry_paginator.fetch(entries, cursor, direction)
+        ]
+
+    # Fan-out-on-read for followees too large to have been fanned out on write
+    celebrities = Follow.objects.filter(
+        follower=user, followee__followers_count__gt=fanout_limit()
+    ).values_list("followee_id", flat=True)
+    celebrities = list(celebrities)
+    if celebrities:
+        # Scatter to the shards owning the celebrities, then gather newest first
+        querysets = [
+            sharding.tweets_on(alias).filter(user_id__in=user_ids)
+            for alias, user_ids in sharding.group_by_shard(celebrities).items()
+        ]
+        if not sharding.is_sharded():
+            querysets = [queryset.select_related("user") for queryset in querysets]
+        tweets = sharding.scatter_gather(paginator, querysets, cursor, direction)
+        if sharding.is_sharded():
+            tweets = sharding.attach_users(tweets)
+        seen = {tweet.id for tweet in rows}
+        rows += [tweet for tweet in tweets if tweet.id not in seen]
+        rows.sort(key=paginator.key, reverse=True)
+        if direction == NEWER:
+            rows = rows[-(per_page + 1) :]
+        else:
+            rows = rows[: per_page + 1]
+    return paginator.build_page(rows, cursor, direction)
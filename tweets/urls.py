@@ -6,7 +6,22 @@ from . import views
 app_name = "tweets"
 urlpatterns = [
     path("post/", views.TweetCreateView.as_view(), name="tweet"),
+    path(
+        "metrics/counters/",
+        views.CounterMetricsView.as_view(),
+        name="counter_metrics",
+    ),
+    path("metrics/cache/", views.CacheMetricsView.as_view(), name="cache_metrics"),
+    path("tags/<str:tag>/", views.HashtagTimelineView.as_view(), name="hashtag"),
+    path(
+        "mentions/<str:username>/",
+        views.MentionTimelineView.as_view(),
+        name="mention",
+    ),
     path("<int:pk>/edit/", views.TweetEditView.as_view(), name="tweet_edit"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="tweet_delete"),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="tweet_detail"),
+    path("<int:pk>/reply/", views.TweetReplyView.as_view(), name="tweet_reply"),
+    path("<int:pk>/like/", views.LikeView.as_view(), name="tweet_like"),
+    path("<int:pk>/retweet/", views.RetweetView.as_view(), name="tweet_retweet"),
 ]
@@ -1,19 +1,42 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from django.shortcuts import redirect
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
 from django.views.generic import (
     CreateView,
     DetailView,
     UpdateView,
     DeleteView,
+    ListView,
+    View,
 )
 from django.urls import reverse_lazy
 
-from .models import Tweet
+from . import counters
+from .entities import hashtag_timeline, index_entities, mention_timeline
+from .models import Like, Retweet, Tweet
+from .pagination import KeysetListMixin
+from .sharding import delete_tweet, find_tweet, is_sharded, tweet_queryset
+from .timeline import fan_out
+from jobs.queue import enqueue
+from mytwitter.cache import cache_aside, cache_stats
+from user.models import CustomUser
 
 
 # Views for tweeting
 class TweetCreateView(LoginRequiredMixin, CreateView):
+    # Saved to the author's shard by tweets.sharding.ShardRouter
     model = Tweet
     template_name = "tweets/tweet.html"
     fields = ["user", "body", "image"]
@@ -21,6 +44,31 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user
+        form.instance.image_processing = bool(form.instance.image)
+        response = super().form_valid(form)
+        if self.object.image_processing:
+            enqueue("tweets.process_image", tweet_id=self.object.pk)
+        index_entities([self.object])
+        fan_out(self.object)
+        return response
+
+
+class TweetReplyView(TweetCreateView):
+    def dispatch(self, request, *args, **kwargs):
+        # LoginRequiredMixin's check, before looking the tweet up
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        self.reply_to = find_tweet(kwargs["pk"])
+        if self.reply_to is None:
+            raise Http404("No tweet found matching the query")
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault("reply_to", self.reply_to)
+        return super().get_context_data(**kwargs)
+
+    def form_valid(self, form):
+        form.instance.reply_to = self.reply_to
         return super().form_valid(form)
 
 
@@ -30,12 +78,33 @@ class TweetEditView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     fields = ["body", "image"]
     success_url = reverse_lazy("user:home")
 
+    def get_queryset(self):
+        # Read from, and so saved back to, the author's shard
+        return tweet_queryset(self.kwargs["pk"])
+
     def test_func(self):
         tweet = self.get_object()
-        if not (tweet.user == self.request.user):
+        if not (tweet.user_id == self.request.user.pk):
             raise PermissionDenied
         return True
 
+    def form_valid(self, form):
+        # Only the edited columns are written, so likes, flushed counter
+        # deltas and a finishing image job that land meanwhile are kept
+        fields = [*form.changed_data, "updated_at"]
+        self.object = form.save(commit=False)
+        if "image" in form.changed_data:
+            self.object.image_processing = bool(self.object.image)
+            fields.append("image_processing")
+        self.object.save(update_fields=fields)
+        response = HttpResponseRedirect(self.get_success_url())
+        if "image" in form.changed_data:
+            enqueue("tweets.process_image", tweet_id=self.object.pk)
+        if "body" in form.changed_data:
+            index_entities([self.object])
+        cache.delete(detail_cache_key(self.object.pk))
+        return response
+
 
 class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     model = Tweet
@@ -44,13 +113,178 @@ class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def get(self, **kwargs):
         return redirect("tweets:tweet_detail", pk=kwargs["pk"])
 
+    def get_queryset(self):
+        return tweet_queryset(self.kwargs["pk"])
+
     def test_func(self):
         tweet = self.get_object()
-        if not (tweet.user == self.request.user):
+        if not (tweet.user_id == self.request.user.pk):
             raise PermissionDenied
         return True
 
+    def form_valid(self, form):
+        cache.delete(detail_cache_key(self.object.pk))
+        delete_tweet(self.object)
+        return HttpResponseRedirect(self.get_success_url())
+
 
+# Conditional GET for tweet permalinks
+def detail_cache_key(pk, query=None):
+    """
+    The anonymous detail page of pk as requested with query (a QueryDict),
+    which the page can reflect. Deleting the key without a query drops the
+    plain permalink; other variants are checked against the ETag anyway.
+    """
+    if not query:
+        return f"tweet_detail:{pk}"
+    normalized = urlencode(sorted(query.lists()), doseq=True)
+    return f"tweet_detail:{pk}:{hashlib.md5(normalized.encode()).hexdigest()}"
+
+
+def tweet_version(request, pk):
+    # Everything the detail page renders from, fetched once per request
+    if not hasattr(request, "_tweet_version"):
+        tweets = tweet_queryset(pk)
+        fields = ["updated_at", "image_processing", "likes", "retweets", "replies"]
+        if is_sharded():
+            # The author is on default, so it cannot be joined in
+            version = tweets.values_list(*fields, "user_id").first()
+            if version is not None:
+                authors = CustomUser.objects.filter(pk=version[-1])
+                author_updated_at = authors.values_list("updated_at", flat=True)
+                version = (*version[:-1], author_updated_at.first())
+        else:
+            version = tweets.values_list(*fields, "user__updated_at").first()
+        request._tweet_version = version
+    return request._tweet_version
+
+
+def tweet_etag(request, pk):
+    version = tweet_version(request, pk)
+    if version is None:
+        return None
+    viewer = request.user.pk if request.user.is_authenticated else 0
+    return hashlib.md5(f"{pk}:{viewer}:{version}".encode()).hexdigest()
+
+
+@method_decorator(vary_on_cookie, name="dispatch")
+@method_decorator(
+    # No Last-Modified: counters and the viewer change the page without
+    # changing any timestamp, so only the ETag can tell
+    condition(etag_func=tweet_etag),
+    name="get",
+)
 class TweetDetailView(DetailView):
-    queryset = Tweet.objects.select_related("user")
+    use_read_replica = True
+    model = Tweet
     template_name = "tweets/tweet_detail.html"
+
+    def get_object(self, queryset=None):
+        # Keyed by the version behind the ETag, so any change is a miss
+        pk = self.kwargs["pk"]
+        version = tweet_version(self.request, pk)
+        if version is None:
+            raise Http404("No tweet found matching the query")
+        digest = hashlib.md5(str(version).encode()).hexdigest()
+        return cache_aside(
+            f"tweet:{pk}:{digest}",
+            lambda: find_tweet(pk),
+            getattr(settings, "TWEET_CACHE_TIMEOUT", 300),
+        )
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            response = super().get(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        # Anonymous viewers all see the same page, so serve it from the cache
+        key = detail_cache_key(kwargs["pk"], request.GET)
+        etag = tweet_etag(request, kwargs["pk"])
+        cached = cache.get(key)
+        if cached is not None and cached[0] == etag:
+            response = HttpResponse(cached[1])
+        else:
+            response = super().get(request, *args, **kwargs)
+            response.render()
+            timeout = getattr(settings, "TWEET_DETAIL_CACHE_TIMEOUT", 300)
+            cache.set(key, (etag, response.content), timeout)
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+# Views for reacting to tweets
+class ToggleReactionView(LoginRequiredMixin, View):
+    model = None
+
+    def post(self, request, pk):
+        tweet = tweet_queryset(pk).first()
+        if tweet is None:
+            raise Http404("No tweet found matching the query")
+        try:
+            reaction, created = self.model.objects.get_or_create(
+                user=request.user, tweet=tweet
+            )
+        except IntegrityError:
+            # A double submit of the same form won the race to the unique
+            # constraint; this request is the same click
+            pass
+        else:
+            if not created:
+                reaction.delete()
+        next_url = request.POST.get("next")
+        if url_has_allowed_host_and_scheme(next_url, {request.get_host()}):
+            return redirect(next_url)
+        return redirect("tweets:tweet_detail", pk=pk)
+
+
+class LikeView(ToggleReactionView):
+    model = Like
+
+
+class RetweetView(ToggleReactionView):
+    model = Retweet
+
+
+# Views for monitoring
+class CounterMetricsView(LoginRequiredMixin, UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return JsonResponse(counters.buffer.metrics())
+
+
+class CacheMetricsView(CounterMetricsView):
+    def get(self, request):
+        return JsonResponse(cache_stats())
+
+
+# Timelines of one hashtag or of the tweets mentioning one user, read from
+# the TweetHashtag/Mention indexes rather than by scanning tweet bodies
+class HashtagTimelineView(LoginRequiredMixin, KeysetListMixin, ListView):
+    queryset = Tweet.objects.none()
+    template_name = "tweets/entity_timeline.html"
+
+    def get_keyset_page(self, queryset, cursor, direction):
+        return hashtag_timeline(self.kwargs["tag"], self.paginate_by, cursor, direction)
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault("title", f"#{self.kwargs['tag']}")
+        return super().get_context_data(**kwargs)
+
+
+class MentionTimelineView(LoginRequiredMixin, KeysetListMixin, ListView):
+    queryset = Tweet.objects.none()
+    template_name = "tweets/entity_timeline.html"
+
+    def get(self, request, *args, **kwargs):
+        self.mentioned = get_object_or_404(CustomUser, username=kwargs["username"])
+        return super().get(request, *args, **kwargs)
+
+    def get_keyset_page(self, queryset, cursor, direction):
+        return mention_timeline(self.mentioned, self.paginate_by, cursor, direction)
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault("title", f"@{self.mentioned.username}")
+        return super().get_context_data(**kwargs)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from user.models import CustomUser, Profile
+
+
+class Command(BaseCommand):
+    help = "Creates the missing profiles of users added without one"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        missing = (
+            CustomUser.objects.filter(profile__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        last_pk = 0
+        created = 0
+        while True:
+            batch = list(missing.filter(pk__gt=last_pk)[: options["batch_size"]])
+            if not batch:
+                break
+            Profile.objects.provision(batch)
+            created += len(batch)
+            last_pk = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f"Created {created} profiles"))
@@ -0,0 +1,27 @@
+# Generated by Django 4.0.1 on 2026-10-18 18:36
+
+from django.conf import settings
+from django.db import migrations
+import django.db.models.deletion
+import user.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_customuser_followers_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='customuser',
+            managers=[
+                ('objects', user.models.CustomUserManager()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='user',
+            field=user.models.AutoOneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,27 +1,145 @@
-from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.fields.related_descriptors import ReverseOneToOneDescriptor
 
 from phonenumber_field.modelfields import PhoneNumberField
 
 
+# ContentAddressedStorage keeps only the extension of this name
 def directory_path(instance, filename):
     return f"profile/images/user_{instance.user.id}/{filename}"
 
 
+class CustomUserManager(UserManager):
+    def bulk_create_with_profiles(self, objs, batch_size=None, ignore_conflicts=False):
+        """
+        bulk_create() that also inserts an empty Profile for every user, one
+        statement per batch for each table. Users skipped by ignore_conflicts
+        keep whatever profile they had.
+        """
+        with transaction.atomic(using=self.db):
+            users = self.bulk_create(
+                objs, batch_size=batch_size, ignore_conflicts=ignore_conflicts
+            )
+            user_ids = [user.pk for user in users if user.pk is not None]
+            if ignore_conflicts:
+                # ignore_conflicts leaves the primary keys unset: read them
+                # back by username
+                user_ids = self.filter(
+                    username__in=[user.username for user in users]
+                ).values_list("pk", flat=True)
+            Profile.objects.using(self.db).provision(user_ids, batch_size=batch_size)
+        return users
+
+
 class CustomUser(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     email = models.EmailField(blank=False)
     phone = PhoneNumberField(blank=True)
     date_of_birth = models.DateField()
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
     REQUIRED_FIELDS = ["date_of_birth"]
 
+    objects = CustomUserManager()
+
+    def is_following(self, user):
+        return Follow.objects.filter(follower=self, followee=user).exists()
+
+    def follow(self, user):
+        with transaction.atomic():
+            _, created = Follow.objects.get_or_create(follower=self, followee=user)
+            if created:
+                CustomUser.objects.filter(pk=self.pk).update(
+                    following_count=F("following_count") + 1
+                )
+                CustomUser.objects.filter(pk=user.pk).update(
+                    followers_count=F("followers_count") + 1
+                )
+        return created
+
+    def unfollow(self, user):
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(follower=self, followee=user).delete()
+            if deleted:
+                CustomUser.objects.filter(pk=self.pk).update(
+                    following_count=F("following_count") - 1
+                )
+                CustomUser.objects.filter(pk=user.pk).update(
+                    followers_count=F("followers_count") - 1
+                )
+        return bool(deleted)
+
+
+class Follow(models.Model):
+    follower = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="following_set"
+    )
+    followee = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="follower_set"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["follower", "followee"], name="unique_follow"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["followee", "follower"], name="follow_followee_idx"),
+        ]
+
+
+class AutoReverseOneToOneDescriptor(ReverseOneToOneDescriptor):
+    """Creates the related object on first access when there is none yet."""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        try:
+            return super().__get__(instance, cls)
+        except self.RelatedObjectDoesNotExist:
+            if instance.pk is None:
+                raise
+        related, _ = self.related.related_model._default_manager.get_or_create(
+            **{self.related.field.name: instance}
+        )
+        self.related.set_cached_value(instance, related)
+        return related
+
+
+class AutoOneToOneField(models.OneToOneField):
+    """
+    OneToOneField whose reverse accessor never raises for a saved instance,
+    so the related row can be created lazily instead of by a post_save
+    signal on every save.
+    """
+
+    related_accessor_class = AutoReverseOneToOneDescriptor
+
+
+class ProfileQuerySet(models.QuerySet):
+    def provision(self, user_ids, batch_size=None):
+        """Inserts empty profiles for user_ids, skipping those that have one."""
+        self.bulk_create(
+            [Profile(user_id=user_id) for user_id in user_ids],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
 
 class Profile(models.Model):
-    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True)
+    # Profiles are created on first access (user.profile), by
+    # CustomUser.objects.bulk_create_with_profiles() or by backfill_profiles
+    user = AutoOneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True)
     profile_img = models.ImageField(upload_to=directory_path, blank=True)
     bio = models.TextField(max_length=280, null=True, blank=True)
 
+    objects = ProfileQuerySet.as_manager()
+
     @property
     def profile_img_url(self):
         if self.profile_img:
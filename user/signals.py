@@ -1,11 +1,36 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from .models import CustomUser, Profile
+from .models import Profile
 
 
-# Creates a Profile automatically whenever a CustomUser is created
-@receiver(post_save, sender=CustomUser)
-def create_profile(sender, instance, created, **kwargs):
-    if created:
-        Profile.objects.create(user=instance)
+# Gives back the stored file of a replaced or deleted profile image once
+# the change commits
+@receiver(pre_save, sender=Profile)
+def find_replaced_profile_img(sender, instance, raw, **kwargs):
+    instance._replaced_profile_img = None
+    if raw or instance._state.adding:
+        return
+    old = (
+        Profile.objects.filter(pk=instance.pk)
+        .values_list("profile_img", flat=True)
+        .first()
+    )
+    if old and old != instance.profile_img.name:
+        instance._replaced_profile_img = old
+
+
+@receiver(post_save, sender=Profile)
+def release_replaced_profile_img(sender, instance, using, **kwargs):
+    old = getattr(instance, "_replaced_profile_img", None)
+    if old:
+        storage = instance.profile_img.storage
+        transaction.on_commit(lambda: storage.delete(old), using=using)
+
+
+@receiver(post_delete, sender=Profile)
+def release_deleted_profile_img(sender, instance, using, **kwargs):
+    if instance.profile_img:
+        storage, name = instance.profile_img.storage, instance.profile_img.name
+        transaction.on_commit(lambda: storage.delete(name), using=using)
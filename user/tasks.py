@@ -0,0 +1,29 @@
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from jobs.queue import task
+from tweets.images import encode
+
+from .models import Profile
+
+
+AVATAR_SIZE = (400, 400)
+
+
+@task("user.process_profile_image")
+def process_profile_image(user_id, name):
+    profile = Profile.objects.filter(pk=user_id, profile_img=name).first()
+    # Skip uploads that were replaced before the job got to them
+    if profile is None:
+        return
+    storage = profile.profile_img.storage
+    with profile.profile_img.open("rb") as f:
+        image = Image.open(f)
+        image.load()
+    image = ImageOps.fit(ImageOps.exif_transpose(image), AVATAR_SIZE)
+    base, _ = os.path.splitext(name)
+    avatar = storage.save(f"{base}_avatar.jpg", ContentFile(encode(image, "jpeg")))
+    Profile.objects.filter(pk=user_id).update(profile_img=avatar)
+    storage.delete(name)
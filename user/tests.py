@@ -1,10 +1,26 @@
+import datetime
+import hashlib
+from io import StringIO
+
 from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.hashers import check_password
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
 from django.core.files.images import ImageFile
+from django.core.management import call_command
+from django.db import connection
 from django.shortcuts import reverse
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
 
 from .forms import SignupForm
-from .models import CustomUser
+from .models import CustomUser, Follow, Profile
+from jobs.queue import work
+from mediastore.models import Blob
+from tweets.models import Tweet
+from tweets.timeline import fan_out
 
 
 class CreateUserFormTests(TestCase):
@@ -33,7 +49,7 @@ class SignupViewTests(TestCase):
 
 class PasswordViewTests(TestCase):
     def setUp(self):
-        self.info_session_data = {
+        self.info_data = {
             "username": "test",
             "email": "test@test.com",
             "phone": "",
@@ -43,22 +59,20 @@ class PasswordViewTests(TestCase):
         }
 
     def test_get_password_view(self):
-        # GET method returns status code 200 with session data
-        session = self.client.session
-        session["info_form_data"] = self.info_session_data
-        session.save()
+        # GET method returns status code 200 after the first step
+        self.client.post(reverse("user:signup"), self.info_data)
         response = self.client.get(reverse("user:create_password"))
         self.assertEqual(response.status_code, 200)
 
-    def test_get_password_view_with_invalid_session(self):
-        # Redirects to home view without session data
+    def test_get_password_view_without_earlier_steps(self):
+        # Redirects to the first step without wizard data
         response = self.client.get(reverse("user:create_password"))
         self.assertRedirects(response, reverse("user:signup"))
 
 
 class ConfirmViewTests(TestCase):
     def setUp(self):
-        self.password_session_data = {
+        self.password_data = {
             "username": "test",
             "email": "test@test.com",
             "phone": "",
@@ -70,15 +84,14 @@ class ConfirmViewTests(TestCase):
         }
 
     def test_get_confirm_view(self):
-        # GET method returns status code 200 with session data
-        session = self.client.session
-        session["password_form_data"] = self.password_session_data
-        session.save()
+        # GET method returns status code 200 after the first two steps
+        self.client.post(reverse("user:signup"), self.password_data)
+        self.client.post(reverse("user:create_password"), self.password_data)
         response = self.client.get(reverse("user:confirm"))
         self.assertEqual(response.status_code, 200)
 
-    def test_get_confirm_view_with_invalid_session(self):
-        # Returns to home view without session data
+    def test_get_confirm_view_without_earlier_steps(self):
+        # Returns to the first step without wizard data
         response = self.client.get(reverse("user:confirm"))
         self.assertRedirects(response, reverse("user:signup"))
 
@@ -106,19 +119,15 @@ class ValidSignupTests(TestCase):
 
     def test_info_post(self):
         # Valid post redirects to password view without saving data
-        session = self.client.session
-        session["info_form_data"] = self.valid_info_data
-        session.save()
+        self.client.post(reverse("user:signup"), self.valid_info_data)
         response = self.client.post(reverse("user:signup"), self.valid_info_data)
         self.assertFalse(CustomUser.objects.filter(username="test").exists())
         self.assertRedirects(response, reverse("user:create_password"))
 
     def test_password_post(self):
         # Valid post redirects to confirmation view without saving data
-        session = self.client.session
-        session["info_form_data"] = self.valid_info_data
-        session["password_form_data"] = self.valid_password_data
-        session.save()
+        self.client.post(reverse("user:signup"), self.valid_info_data)
+        self.client.post(reverse("user:create_password"), self.valid_password_data)
         response = self.client.post(
             reverse("user:create_password"), self.valid_password_data
         )
@@ -127,15 +136,65 @@ class ValidSignupTests(TestCase):
 
     def test_confirm_post(self):
         # Valid post saves data and redirects to thanks view
-        session = self.client.session
-        session["info_form_data"] = self.valid_info_data
-        session["password_form_data"] = self.valid_password_data
-        session.save()
+        self.client.post(reverse("user:signup"), self.valid_info_data)
+        self.client.post(reverse("user:create_password"), self.valid_password_data)
         response = self.client.post(reverse("user:confirm"), self.valid_password_data)
         self.assertTrue(CustomUser.objects.filter(username="test").exists())
         self.assertRedirects(response, reverse("user:thanks"))
 
 
+class SignupWizardTests(TestCase):
+    def setUp(self):
+        self.info_data = {
+            "username": "test",
+            "email": "test@test.com",
+            "phone": "",
+            "date_of_birth_month": "1",
+            "date_of_birth_day": "1",
+            "date_of_birth_year": "1901",
+        }
+        self.password_data = {"password1": "testpassword", "password2": "testpassword"}
+
+    def test_funnel_writes_no_sessions(self):
+        # The wizard lives in the cache, so no session row is ever written
+        self.client.post(reverse("user:signup"), self.info_data)
+        self.client.post(reverse("user:create_password"), self.password_data)
+        response = self.client.post(reverse("user:confirm"))
+        self.assertRedirects(response, reverse("user:thanks"))
+        self.assertEqual(Session.objects.count(), 0)
+        user = CustomUser.objects.get(username="test")
+        self.assertTrue(user.check_password("testpassword"))
+        self.assertEqual(str(user.date_of_birth), "1901-01-01")
+        # The wizard is gone once the account exists
+        self.assertRedirects(
+            self.client.get(reverse("user:confirm")), reverse("user:signup")
+        )
+
+    def test_only_a_password_hash_is_kept(self):
+        self.client.post(reverse("user:signup"), self.info_data)
+        self.client.post(reverse("user:create_password"), self.password_data)
+        token = self.client.cookies["signup"].value
+        self.assertNotIn("testpassword", token)
+        data = cache.get(f"signup_wizard:{token.split(':')[0]}")
+        self.assertEqual(set(data), {"info", "password"})
+        self.assertNotIn("testpassword", str(data))
+        self.assertTrue(check_password("testpassword", data["password"]))
+
+    def test_forged_cookie_is_ignored(self):
+        self.client.cookies["signup"] = "forged"
+        response = self.client.get(reverse("user:create_password"))
+        self.assertRedirects(response, reverse("user:signup"))
+
+    def test_changed_details_need_the_password_again(self):
+        self.client.post(reverse("user:signup"), self.info_data)
+        self.client.post(reverse("user:create_password"), self.password_data)
+        self.info_data["username"] = "renamed"
+        self.client.post(reverse("user:signup"), self.info_data)
+        response = self.client.post(reverse("user:confirm"))
+        self.assertRedirects(response, reverse("user:signup"))
+        self.assertFalse(CustomUser.objects.exists())
+
+
 class InvalidSignupTests(TestCase):
     def setUp(self):
         self.valid_info_data = {
@@ -169,10 +228,7 @@ class InvalidSignupTests(TestCase):
             "password1": "",
             "password2": "",
         }
-        session = self.client.session
-        session["password_form_data"] = blank_data
-        session.save()
-        response = self.client.post(reverse("user:confirm"), blank_data)
+        response = self.client.post(reverse("user:signup"), blank_data)
         self.assertEquals(response.status_code, 200)
         self.assertTrue(response.context.get("form").errors)
         self.assertFalse(CustomUser.objects.filter(username="test").exists())
@@ -195,9 +251,7 @@ class InvalidSignupTests(TestCase):
         # Posting a blank password brings you back to the form and raises errors
         self.valid_password_data["password1"] = ""
         self.valid_password_data["password2"] = ""
-        session = self.client.session
-        session["info_form_data"] = self.valid_info_data
-        session.save()
+        self.client.post(reverse("user:signup"), self.valid_info_data)
         response = self.client.post(
             reverse("user:create_password"), self.valid_password_data
         )
@@ -227,9 +281,7 @@ class InvalidSignupTests(TestCase):
         # Short or similar passwords are invalid.
         self.valid_password_data["password1"] = "test"
         self.valid_password_data["password2"] = "test"
-        session = self.client.session
-        session["info_form_data"] = self.valid_info_data
-        session.save()
+        self.client.post(reverse("user:signup"), self.valid_info_data)
         response = self.client.post(
             reverse("user:create_password"), self.valid_password_data
         )
@@ -254,9 +306,7 @@ class InvalidSignupTests(TestCase):
         # Passwords with only numbers are invalid.
         self.valid_password_data["password1"] = "12345678"
         self.valid_password_data["password2"] = "12345678"
-        session = self.client.session
-        session["info_form_data"] = self.valid_info_data
-        session.save()
+        self.client.post(reverse("user:signup"), self.valid_info_data)
         response = self.client.post(
             reverse("user:create_password"), self.valid_password_data
         )
@@ -269,9 +319,7 @@ class InvalidSignupTests(TestCase):
         # Two passwords do not match
         self.valid_password_data["password1"] = "testtest"
         self.valid_password_data["password2"] = "hogehoge"
-        session = self.client.session
-        session["info_form_data"] = self.valid_info_data
-        session.save()
+        self.client.post(reverse("user:signup"), self.valid_info_data)
         response = self.client.post(
             reverse("user:create_password"), self.valid_password_data
         )
@@ -509,7 +557,6 @@ class EditProfileTests(TestCase):
         self.assertEqual(self.user.profile.bio, "now testing")
         self.assertIn(SESSION_KEY, self.client.session)
 
-    # Make sure to delete /user_1/test_img.jpg every time you test this
     def test_valid_img_edit(self):
         url = reverse("user:edit_profile", kwargs={"pk": self.user.id})
         redirect_url = reverse("user:user_profile", kwargs={"pk": self.user.id})
@@ -520,12 +567,34 @@ class EditProfileTests(TestCase):
         self.assertRedirects(
             response, redirect_url, status_code=302, target_status_code=200
         )
+        # Stored under the hash of its content, so re-uploads never collide
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
         self.assertEqual(
             self.user.profile.profile_img.name,
-            f"profile/images/user_{self.user.id}/test_img.jpg",
+            f"cas/{digest[:2]}/{digest[2:4]}/{digest}.jpg",
         )
         self.assertIn(SESSION_KEY, self.client.session)
 
+    def test_img_edit_is_processed_in_background(self):
+        url = reverse("user:edit_profile", kwargs={"pk": self.user.id})
+        path = "./media/test/test_img.jpg"
+        self.context["profile-0-profile_img"] = ImageFile(open(path, "rb"))
+        self.client.post(url, self.context)
+        self.user.profile.refresh_from_db()
+        original = self.user.profile.profile_img.name
+
+        work()
+        self.user.profile.refresh_from_db()
+        profile_img = self.user.profile.profile_img
+        self.assertNotEqual(profile_img.name, original)
+        self.assertEqual(Blob.objects.get(name=original).refs, 0)
+        with profile_img.open("rb") as f:
+            image = Image.open(f)
+            self.assertEqual(image.size, (400, 400))
+            self.assertNotIn("exif", image.info)
+        profile_img.storage.delete(profile_img.name)
+
     def test_invalid_img_edit_with_pdf(self):
         url = reverse("user:edit_profile", kwargs={"pk": self.user.id})
         path = "./media/test/test_pdf.pdf"
@@ -589,3 +658,275 @@ class EditProfileTests(TestCase):
         self.assertEqual(self.user.username, "test")
         self.assertEqual(self.user.profile.bio, None)
         self.assertIn(SESSION_KEY, self.client.session)
+
+
+class HomeTimelinePaginationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.client.login(username="test", password="12345")
+
+        # 45 tweets where every pair shares a timestamp, to exercise the id tiebreak
+        now = timezone.now()
+        for i in range(45):
+            tweet = Tweet.objects.create(user=self.user, body=f"tweet {i}")
+            Tweet.objects.filter(pk=tweet.pk).update(
+                created_at=now + datetime.timedelta(seconds=i // 2)
+            )
+            tweet.refresh_from_db()
+            fan_out(tweet)
+        self.expected = list(
+            Tweet.objects.order_by("-created_at", "-id").values_list("id", flat=True)
+        )
+
+    def ids(self, response):
+        return [tweet.id for tweet in response.context["object_list"]]
+
+    def test_first_page_is_bounded(self):
+        response = self.client.get(reverse("user:home"))
+        self.assertEqual(self.ids(response), self.expected[:20])
+        self.assertTrue(response.context["page"].has_older)
+        self.assertFalse(response.context["page"].has_newer)
+
+    def test_walk_older_then_newer(self):
+        url = reverse("user:home")
+        response = self.client.get(url)
+        seen = self.ids(response)
+        while response.context["page"].has_older:
+            cursor = response.context["page"].older_cursor
+            response = self.client.get(url, {"older": cursor})
+            seen += self.ids(response)
+        self.assertEqual(seen, self.expected)
+
+        # Last page only holds the remainder, and can step back to newer tweets
+        self.assertEqual(self.ids(response), self.expected[40:])
+        cursor = response.context["page"].newer_cursor
+        response = self.client.get(url, {"newer": cursor})
+        self.assertEqual(self.ids(response), self.expected[20:40])
+        self.assertTrue(response.context["page"].has_older)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse("user:home"), {"older": "garbage"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids(response), self.expected[:20])
+
+
+class FollowTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.another_user = CustomUser.objects.create(
+            username="test2",
+            email="test2@test.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+        self.client.login(username="test", password="12345")
+        self.tweet = Tweet.objects.create(user=self.another_user, body="hello")
+        fan_out(self.tweet)
+
+    def test_follow(self):
+        response = self.client.post(
+            reverse("user:follow", kwargs={"pk": self.another_user.id})
+        )
+        self.assertRedirects(
+            response, reverse("user:user_profile", kwargs={"pk": self.another_user.id})
+        )
+        self.assertTrue(self.user.is_following(self.another_user))
+        self.another_user.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.another_user.followers_count, 1)
+        self.assertEqual(self.user.following_count, 1)
+
+        # Existing tweets are backfilled into the new follower's home timeline
+        response = self.client.get(reverse("user:home"))
+        self.assertEqual(list(response.context["object_list"]), [self.tweet])
+
+    def test_follow_twice_counts_once(self):
+        url = reverse("user:follow", kwargs={"pk": self.another_user.id})
+        self.client.post(url)
+        self.client.post(url)
+        self.another_user.refresh_from_db()
+        self.assertEqual(self.another_user.followers_count, 1)
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_cannot_follow_self(self):
+        self.client.post(reverse("user:follow", kwargs={"pk": self.user.id}))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_unfollow(self):
+        self.client.post(reverse("user:follow", kwargs={"pk": self.another_user.id}))
+        response = self.client.post(
+            reverse("user:unfollow", kwargs={"pk": self.another_user.id})
+        )
+        self.assertRedirects(
+            response, reverse("user:user_profile", kwargs={"pk": self.another_user.id})
+        )
+        self.assertFalse(self.user.is_following(self.another_user))
+        self.another_user.refresh_from_db()
+        self.assertEqual(self.another_user.followers_count, 0)
+        response = self.client.get(reverse("user:home"))
+        self.assertEqual(list(response.context["object_list"]), [])
+
+    def test_follow_fails_if_unauthorized(self):
+        self.client.logout()
+        url = reverse("user:follow", kwargs={"pk": self.another_user.id})
+        response = self.client.post(url)
+        self.assertRedirects(response, reverse("user:signin") + "?next=" + url)
+        self.assertFalse(Follow.objects.exists())
+
+
+class ProfileQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(
+            username="test", email="test@test.com", phone="", date_of_birth="1901-01-01"
+        )
+        self.user.set_password("12345")
+        self.user.save()
+        self.another_user = CustomUser.objects.create(
+            username="test2",
+            email="test2@test.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+        # Profiles are otherwise created by the first visit
+        Profile.objects.provision([self.user.pk, self.another_user.pk])
+        self.client.login(username="test", password="12345")
+        self.url = reverse("user:user_profile", kwargs={"pk": self.another_user.id})
+
+    def test_query_count_does_not_grow_with_tweets(self):
+        # session, request.user, page user + profile, tweets, follow state
+        for count in (1, 30):
+            Tweet.objects.bulk_create(
+                Tweet(user=self.another_user, body=f"tweet {i}") for i in range(count)
+            )
+            # bulk_create sends no signals to drop the cached first page; this
+            # also drops the cached session, which is read from the database
+            cache.clear()
+            with self.assertNumQueries(5):
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_first_page_is_cached_until_the_user_tweets(self):
+        Tweet.objects.create(user=self.another_user, body="first")
+        self.client.get(self.url)
+        # The session and tweets come from the cache on the second visit
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertContains(response, "first")
+
+        Tweet.objects.create(user=self.another_user, body="second")
+        self.assertContains(self.client.get(self.url), "second")
+
+    def test_cached_pages_show_the_viewers_own_like(self):
+        tweet = Tweet.objects.create(user=self.another_user, body="first")
+        self.user.follow(self.another_user)
+        fan_out(tweet)
+        home = reverse("user:home")
+        self.client.get(self.url)
+        self.client.get(home)
+        # Liking redirects back to the page the like was made on
+        response = self.client.post(
+            reverse("tweets:tweet_like", kwargs={"pk": tweet.pk}),
+            {"next": self.url},
+            follow=True,
+        )
+        self.assertEqual(response.context["tweets"][0].likes, 1)
+        self.assertEqual(self.client.get(home).context["object_list"][0].likes, 1)
+
+    def test_tweets_are_paginated(self):
+        Tweet.objects.bulk_create(
+            Tweet(user=self.another_user, body=f"tweet {i}") for i in range(30)
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context["tweets"]), 20)
+        cursor = response.context["page"].older_cursor
+        response = self.client.get(self.url, {"older": cursor})
+        self.assertEqual(len(response.context["tweets"]), 10)
+        self.assertFalse(response.context["page"].has_older)
+
+    def test_nonexistent_user_profile(self):
+        response = self.client.get(reverse("user:user_profile", kwargs={"pk": 555}))
+        self.assertEqual(response.status_code, 404)
+
+
+class ProfileProvisioningTests(TestCase):
+    def make_user(self, i):
+        return CustomUser(
+            username=f"test{i}",
+            email=f"test{i}@test.com",
+            phone="",
+            date_of_birth="1901-01-01",
+        )
+
+    def test_saving_a_user_does_not_create_a_profile(self):
+        # Only the user row is inserted
+        with self.assertNumQueries(1):
+            user = CustomUser.objects.create(
+                username="test", email="test@test.com", date_of_birth="1901-01-01"
+            )
+        self.assertFalse(Profile.objects.filter(user=user).exists())
+
+    def test_profile_is_created_on_first_access(self):
+        user = self.make_user(0)
+        user.save()
+        self.assertEqual(user.profile.bio, None)
+        self.assertTrue(Profile.objects.filter(user=user).exists())
+        # Later accesses, on a fresh instance too, find the existing profile
+        user = CustomUser.objects.select_related("profile").get(pk=user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.profile.pk, user.pk)
+
+    def test_unsaved_user_has_no_profile(self):
+        with self.assertRaises(Profile.DoesNotExist):
+            self.make_user(0).profile
+
+    def test_bulk_create_with_profiles(self):
+        # One insert for the users and one for their profiles
+        with self.assertNumQueries(4):
+            users = CustomUser.objects.bulk_create_with_profiles(
+                [self.make_user(i) for i in range(50)]
+            )
+        self.assertEqual(
+            Profile.objects.filter(user__in=users).count(),
+            50,
+        )
+
+    def test_bulk_create_with_profiles_ignoring_conflicts(self):
+        existing = self.make_user(0)
+        existing.save()
+        Profile.objects.filter(user=existing).delete()
+        CustomUser.objects.bulk_create_with_profiles(
+            [self.make_user(i) for i in range(3)], ignore_conflicts=True
+        )
+        # Primary keys are unset after an ignore_conflicts insert, yet
+        # every user ends up with a profile
+        self.assertEqual(CustomUser.objects.count(), 3)
+        self.assertEqual(Profile.objects.count(), 3)
+
+    def test_backfill_profiles(self):
+        CustomUser.objects.bulk_create([self.make_user(i) for i in range(5)])
+        Profile.objects.provision(CustomUser.objects.values_list("pk", flat=True)[:2])
+        out = StringIO()
+        call_command("backfill_profiles", "--batch-size", "2", stdout=out)
+        self.assertIn("Created 3 profiles", out.getvalue())
+        self.assertEqual(Profile.objects.count(), 5)
+
+    def test_edit_profile_view_provisions_the_profile(self):
+        user = self.make_user(0)
+        user.set_password("password")
+        user.save()
+        self.client.force_login(user)
+        response = self.client.get(reverse("user:edit_profile", kwargs={"pk": user.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Profile.objects.filter(user=user).exists())
+        # Once the profile exists, loading the page inserts nothing
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("user:edit_profile", kwargs={"pk": user.pk}))
+        self.assertFalse([q for q in queries if q["sql"].startswith("INSERT")])
@@ -31,4 +31,6 @@ urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
     path("<int:pk>/", views.ProfileView.as_view(), name="user_profile"),
     path("<int:pk>/edit/", views.EditProfileView.as_view(), name="edit_profile"),
+    path("<int:pk>/follow/", views.FollowView.as_view(), name="follow"),
+    path("<int:pk>/unfollow/", views.UnfollowView.as_view(), name="unfollow"),
 ]
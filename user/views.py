@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import (
     LoginView,
@@ -8,14 +10,20 @@ from django.contrib.auth.views import (
     PasswordResetCompleteView,
 )
 from django.shortcuts import render, redirect, get_object_or_404
-from django.views.generic import DetailView, ListView
+from django.views.generic import DetailView, ListView, View
 
 from django.urls import reverse_lazy
 from extra_views import UpdateWithInlinesView, InlineFormSetFactory, SuccessMessageMixin
 
 from .models import CustomUser, Profile
 from .forms import SignupForm, PasswordForm
+from .wizard import SignupWizard, compact
+from jobs.queue import enqueue
+from mytwitter.cache import cache_aside
 from tweets.models import Tweet
+from tweets import timeline
+from tweets.pagination import KeysetListMixin, KeysetPaginationMixin
+from tweets.sharding import user_tweets
 
 
 # Views for signing up
@@ -24,47 +32,59 @@ def index_view(request):
 
 
 def signup_view(request):
+    wizard = SignupWizard(request)
     if request.method == "POST":
         form = SignupForm(request.POST)
         if form.is_valid():
-            request.session["info_form_data"] = request.POST
-            return redirect("user:create_password")
+            response = redirect("user:create_password")
+            # Changed details need the password checked against them again
+            wizard.update(response, info=compact(form), password=None)
+            return response
     else:
-        session_form_data = request.session.get("info_form_data")
-        form = SignupForm(session_form_data)
+        form = SignupForm(wizard.info)
     return render(request, "user/signup/signup.html", {"form": form})
 
 
 def password_view(request):
-    session_form_data = request.session.get("info_form_data")
-    # session expired or invalid access
-    if session_form_data is None:
+    wizard = SignupWizard(request)
+    # wizard expired or invalid access
+    if wizard.info is None:
         return redirect("user:signup")
     # user inputs password
     if request.method == "POST":
-        form = PasswordForm(request.POST)
+        # Only the passwords come from this step; the rest was validated before
+        form = PasswordForm(
+            {
+                **wizard.info,
+                "password1": request.POST.get("password1", ""),
+                "password2": request.POST.get("password2", ""),
+            }
+        )
         if form.is_valid():
-            request.session["password_form_data"] = request.POST
-            return redirect("user:confirm")
+            response = redirect("user:confirm")
+            wizard.update(
+                response, password=make_password(form.cleaned_data["password1"])
+            )
+            return response
     else:
-        form = PasswordForm(session_form_data)
+        form = PasswordForm(initial=wizard.info)
     return render(request, "user/signup/password.html", {"form": form})
 
 
 def signup_confirm_view(request):
-    session_form_data = request.session.get("password_form_data")
-    if session_form_data is None:
+    wizard = SignupWizard(request)
+    if wizard.info is None or wizard.password is None:
         return redirect("user:signup")
 
-    if request.method == "POST":
-        form = PasswordForm(request.POST)
-        if form.is_valid():
-            del request.session["info_form_data"]
-            del request.session["password_form_data"]
-            form.save()
-            return redirect("user:thanks")
-    else:
-        form = PasswordForm(session_form_data)
+    # Validated again, as the username may have been taken in the meantime
+    form = SignupForm(wizard.info)
+    if request.method == "POST" and form.is_valid():
+        user = form.save(commit=False)
+        user.password = wizard.password
+        user.save()
+        response = redirect("user:thanks")
+        wizard.clear(response)
+        return response
     return render(request, "user/signup/signupConfirm.html", {"form": form})
 
 
@@ -104,26 +124,74 @@ class PasswordResetCompleteView(PasswordResetCompleteView):
 
 
 # Views for users
-class HomeView(LoginRequiredMixin, ListView):
+class HomeView(LoginRequiredMixin, KeysetListMixin, ListView):
+    use_read_replica = True
+    # Queries per request however many tweets are shown; see mytwitter.profiling
+    query_budget = 8
     queryset = Tweet.objects.select_related("user")
     template_name = "user/home.html"
     permission_denied_message = "Oops! Seems like you haven't signed in yet."
 
+    def get_keyset_page(self, queryset, cursor, direction):
+        user = self.request.user
 
-class ProfileView(LoginRequiredMixin, DetailView):
-    model = CustomUser
+        def fetch():
+            return timeline.home_timeline(user, self.paginate_by, cursor, direction)
+
+        if cursor is not None:
+            return fetch()
+        # Nearly every visit loads only the first page
+        timeout = getattr(settings, "HOME_TIMELINE_CACHE_TIMEOUT", 30)
+        return cache_aside(timeline.home_cache_key(user.pk), fetch, timeout)
+
+
+class ProfileView(LoginRequiredMixin, KeysetPaginationMixin, DetailView):
+    use_read_replica = True
+    query_budget = 10
+    queryset = CustomUser.objects.select_related("profile")
     template_name = "user/profile/user_profile.html"
     permission_denied_message = "Oops! Seems like you haven't signed in yet."
     context_object_name = "page_user"
 
+    def get_keyset_page(self, queryset, cursor, direction):
+        fetch = super().get_keyset_page
+        if cursor is not None:
+            return fetch(queryset, cursor, direction)
+        return cache_aside(
+            timeline.profile_cache_key(self.object.pk),
+            lambda: fetch(queryset, cursor, direction),
+            getattr(settings, "PROFILE_CACHE_TIMEOUT", 60),
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        page_user = get_object_or_404(CustomUser, id=self.kwargs["pk"])
-        tweets = Tweet.objects.filter(user_id=page_user.id)
-        context["tweets"] = tweets
+        page_user = self.object
+        page = self.paginate_keyset(user_tweets(page_user))
+        # Every tweet here belongs to page_user, so skip the per-row user join
+        for tweet in page:
+            tweet.user = page_user
+        context["page"] = page
+        context["tweets"] = page.object_list
+        context["is_following"] = self.request.user.is_following(page_user)
         return context
 
 
+class FollowView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        page_user = get_object_or_404(CustomUser, pk=pk)
+        if page_user != request.user and request.user.follow(page_user):
+            timeline.backfill(request.user, page_user)
+        return redirect("user:user_profile", pk=pk)
+
+
+class UnfollowView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        page_user = get_object_or_404(CustomUser, pk=pk)
+        if request.user.unfollow(page_user):
+            timeline.unfollow(request.user, page_user)
+        return redirect("user:user_profile", pk=pk)
+
+
 class ProfileInline(InlineFormSetFactory):
     model = Profile
     fields = ["profile_img", "bio"]
@@ -138,6 +206,29 @@ class EditProfileView(LoginRequiredMixin, SuccessMessageMixin, UpdateWithInlines
     permission_denied_message = "Oops! Seems like you haven't signed in yet."
     success_message = "Profile Updated!"
 
+    def get_queryset(self):
+        return super().get_queryset().select_related("profile")
+
+    def get_object(self, queryset=None):
+        user = super().get_object(queryset)
+        # The inline edits the existing profile: user.profile creates it
+        # only for users that have none yet
+        user.profile
+        return user
+
+    def forms_valid(self, form, inlines):
+        response = super().forms_valid(form, inlines)
+        for formset in inlines:
+            for profile_form in formset:
+                profile = profile_form.instance
+                if "profile_img" in profile_form.changed_data and profile.profile_img:
+                    enqueue(
+                        "user.process_profile_image",
+                        user_id=profile.pk,
+                        name=profile.profile_img.name,
+                    )
+        return response
+
     # Redirect to user's profile page with kwargs on success
     def get_success_url(self):
         pk = self.kwargs["pk"]
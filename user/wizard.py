@@ -0,0 +1,68 @@
+import datetime
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def wizard_timeout():
+    return getattr(settings, "SIGNUP_WIZARD_TIMEOUT", 1800)
+
+
+def compact(form):
+    """The cleaned fields of a validated form as short JSON-friendly strings."""
+    data = {}
+    for name in form.Meta.fields:
+        value = form.cleaned_data.get(name)
+        if isinstance(value, datetime.date):
+            value = value.isoformat()
+        data[name] = "" if value is None else str(value)
+    return data
+
+
+class SignupWizard:
+    """
+    State of the three signup steps, kept in the cache under a random token
+    that travels in a signed cookie, so the funnel never writes a session.
+    Only validated fields are kept, and the password only as a hash.
+    """
+
+    cookie_name = "signup"
+    salt = "user.signup"
+
+    def __init__(self, request):
+        self.token = request.get_signed_cookie(
+            self.cookie_name, default=None, salt=self.salt, max_age=wizard_timeout()
+        )
+        self.data = cache.get(self.cache_key()) if self.token else None
+        self.data = self.data or {}
+
+    def cache_key(self):
+        return f"signup_wizard:{self.token}"
+
+    @property
+    def info(self):
+        return self.data.get("info")
+
+    @property
+    def password(self):
+        return self.data.get("password")
+
+    def update(self, response, **values):
+        self.data.update(values)
+        if self.token is None:
+            self.token = secrets.token_urlsafe(16)
+        cache.set(self.cache_key(), self.data, wizard_timeout())
+        response.set_signed_cookie(
+            self.cookie_name,
+            self.token,
+            salt=self.salt,
+            max_age=wizard_timeout(),
+            httponly=True,
+            samesite="Lax",
+        )
+
+    def clear(self, response):
+        if self.token is not None:
+            cache.delete(self.cache_key())
+        response.delete_cookie(self.cookie_name, samesite="Lax")